@@ -0,0 +1,76 @@
+"""
+Compare the JSON codec backends on an unwind-shaped batch.
+
+    $ python -m bench.bench_codec --records 2000 --items 50
+
+Reports decode time and peak traced memory for each available backend, the
+shared encode time, and the full pipeline with each backend, and checks that
+every backend yields byte-identical responses.
+"""
+import argparse
+import io
+import json
+import logging
+import timeit
+import tracemalloc
+from bench.generator import generateBody
+from service import codec, compact, pipeline
+
+
+def best(function, repeat):
+    return min(timeit.repeat(function, number=1, repeat=repeat))
+
+
+def peakMemory(function):
+    # Peak Python allocation while `function` runs, the result included
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--records', type=int, default=2000)
+    parser.add_argument('--items', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    body = generateBody(args.records, items=(args.items, args.items))
+    backends = [('json', codec._stdlibLoads)]
+    if codec.orjson is not None:
+        backends.append(('orjson', codec._orjsonLoads))
+
+    print('%d records x %d items, %.1f MB body, selected backend: %s'
+          % (args.records, args.items, len(body) / 1e6, codec.BACKEND))
+
+    decoded = json.loads(body)
+    result = [item for record in decoded for item in pipeline.unwindRecords([record])]
+    print('%-24s %8.1f ms' % ('encode (compact)', 1000 * best(lambda: compact.encodeArray(result), args.repeat)))
+    expanded = [compact.toItem(item) for item in result]
+    print('%-24s %8.1f ms' % ('encode (stdlib)', 1000 * best(lambda: codec.dumps(expanded), args.repeat)))
+
+    outputs = {}
+    original = codec.loads
+    try:
+        for name, loads in backends:
+            print('%-24s %8.1f ms %8.1f MB peak' % ('decode (%s)' % name, 1000 * best(lambda: loads(body), args.repeat),
+                                                   peakMemory(lambda: loads(body)) / 1e6))
+            codec.loads = loads
+            outputs[name] = pipeline.unwindBody(io.BytesIO(body))[1]
+            elapsed = best(lambda: pipeline.unwindBody(io.BytesIO(body)), args.repeat)
+            print('%-24s %8.1f ms' % ('pipeline (%s)' % name, 1000 * elapsed))
+    finally:
+        codec.loads = original
+
+    identical = len(set(outputs.values())) == 1
+    print('responses byte-identical across backends: %s' % identical)
+    if not identical:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
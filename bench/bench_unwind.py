@@ -0,0 +1,172 @@
+"""
+Throughput, latency and memory benchmark for the unwind service.
+
+    $ python -m bench.bench_unwind --output bench_results.json
+    $ python -m bench.bench_unwind --compare bench_results.json
+
+For each batch size, measures applyModel alone and the full
+/bkt_service/unwind round trip through the bottle app (in process, over WSGI)
+on batches from the seeded event generator. Reports records/sec, items/sec,
+p50/p99 batch latency and peak traced memory, and writes everything as JSON so
+runs can be compared between releases.
+"""
+import argparse
+import io
+import json
+import logging
+import platform
+import time
+import tracemalloc
+from bench.generator import generateBody
+from service import codec, config, model
+from service.unwind_array import bkt_app
+
+DEFAULT_SIZES = (1, 10, 100, 1000, 10000, 100000)
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def callApp(body, headers=None, contentType='application/json'):
+    # Minimal in-process WSGI request; returns the response body bytes
+    environ = {
+        'REQUEST_METHOD': 'POST',
+        'PATH_INFO': '/bkt_service/unwind',
+        'SERVER_NAME': 'bench',
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'CONTENT_LENGTH': str(len(body)),
+        'CONTENT_TYPE': contentType or '',
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': io.StringIO(),
+        'wsgi.url_scheme': 'http',
+    }
+    for name, value in (headers or {}).items():
+        environ['HTTP_' + name.upper().replace('-', '_')] = value
+    status = []
+    chunks = bkt_app(environ, lambda s, h, exc_info=None: status.append(s))
+    try:
+        data = b''.join(chunks)
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+    if not status[0].startswith('200'):
+        raise RuntimeError('Unwind failed: %s' % status[0])
+    return data
+
+
+def measure(function, records, items, repeat):
+    latencies = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        latencies.append(time.perf_counter() - started)
+
+    # Peak memory is traced on a separate run so tracing does not skew timings
+    tracemalloc.start()
+    try:
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    total = sum(latencies)
+    return {
+        'repeat': repeat,
+        'recordsPerSec': records * repeat / total,
+        'itemsPerSec': items * repeat / total,
+        'p50Ms': 1000 * percentile(latencies, 0.5),
+        'p99Ms': 1000 * percentile(latencies, 0.99),
+        'peakBytes': peak,
+    }
+
+
+def run(sizes, seed, itemRange, budget, maxRepeat):
+    results = []
+    for size in sizes:
+        body = generateBody(size, seed=seed, items=itemRange)
+        records = json.loads(body)
+        items = sum(len(model.unwindRecord(r, 0)) for r in records)
+        # Aim for roughly `budget` seconds per measurement
+        started = time.perf_counter()
+        callApp(body)
+        once = time.perf_counter() - started
+        repeat = max(3, min(maxRepeat, int(budget / max(once, 1e-6))))
+
+        row = {'records': size, 'items': items, 'bodyBytes': len(body)}
+        row['applyModel'] = measure(lambda: [model.unwindRecord(r, i) for i, r in enumerate(records)],
+                                    size, items, repeat)
+        del records
+        row['roundTrip'] = measure(lambda: callApp(body), size, items, repeat)
+        results.append(row)
+        printRow(row)
+    return results
+
+
+def printRow(row):
+    for stage in ('applyModel', 'roundTrip'):
+        m = row[stage]
+        print('%7d records %-10s %12.0f rec/s %12.0f items/s  p50 %9.2f ms  p99 %9.2f ms  peak %8.1f MB'
+              % (row['records'], stage, m['recordsPerSec'], m['itemsPerSec'],
+                 m['p50Ms'], m['p99Ms'], m['peakBytes'] / 1e6))
+
+
+def compare(previous, current):
+    # Ratio of current to previous for each metric; >1 is faster or larger
+    before = dict((row['records'], row) for row in previous['results'])
+    for row in current['results']:
+        old = before.get(row['records'])
+        if old is None:
+            continue
+        for stage in ('applyModel', 'roundTrip'):
+            a, b = old[stage], row[stage]
+            print('%7d records %-10s rec/s x%.2f  p99 x%.2f  peak x%.2f'
+                  % (row['records'], stage, b['recordsPerSec'] / a['recordsPerSec'],
+                     b['p99Ms'] / a['p99Ms'], b['peakBytes'] / max(a['peakBytes'], 1)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', default=','.join(str(s) for s in DEFAULT_SIZES),
+                        help='comma-separated batch sizes in records')
+    parser.add_argument('--items', default='1,60', help='min,max item results per event')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--budget', type=float, default=2.0, help='seconds to spend per measurement')
+    parser.add_argument('--max-repeat', type=int, default=200)
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--compare', help='previous JSON results to compare against')
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    # The largest default batch is over the service's 256 MB body limit, and
+    # the benchmark measures unwinding, not admission control
+    config.MAX_BODY_BYTES = 0
+
+    itemRange = tuple(int(n) for n in args.items.split(','))
+    sizes = [int(s) for s in args.sizes.split(',')]
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'codec': codec.BACKEND,
+        'seed': args.seed,
+        'items': itemRange,
+        'config': {'STREAM_REQUEST': config.STREAM_REQUEST,
+                   'STREAM_RESPONSE': config.STREAM_RESPONSE,
+                   'POOL_WORKERS': config.POOL_WORKERS,
+                   'MAX_BODY_BYTES': config.MAX_BODY_BYTES},
+        'results': run(sizes, args.seed, itemRange, args.budget, args.max_repeat),
+    }
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+    if args.compare:
+        with open(args.compare) as previous:
+            compare(json.load(previous), report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+Seeded generator of synthetic Caliper OutcomeEvents.
+
+Events follow the shape the sensors send (see the GUID propagation fixture in
+the tests): an envelope with sensorId and apiKey around an OutcomeEvent whose
+`generated.itemResults` hold the questions. The same seed always yields the
+same events, so benchmark runs are comparable.
+"""
+import json
+import random
+import uuid
+
+LEARNER = "urn:lti:instrole:ims/lis/Learner"
+INSTRUCTOR = "urn:lti:role:ims/lis/Instructor"
+
+QUESTION_TYPES = ("mcq", "classification", "clozeassociation", "shorttext", "orderlist")
+ASSESSMENT_TYPES = ("Concept Quiz", "Diagnostic Assessment", "Unit Test", "Practice")
+
+
+def _uuid(rng):
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def generateEvents(count, seed=0, items=(1, 60), optionalRate=0.9, learnerRate=0.98,
+                   nullScoreRate=0.05, sensors=8, classrooms=50):
+    """
+    Yield `count` pipeline records.
+
+    `items` is the inclusive range of item results per event, `optionalRate`
+    the chance each optional field (count, eventTime, startedAtTime,
+    endedAtTime) is present and `learnerRate` the share of events whose actor
+    is a learner; the rest are instructor events the model rejects.
+    """
+    rng = random.Random(seed)
+    apiKeys = [_uuid(rng)[:22] for _ in range(sensors)]
+
+    for n in range(count):
+        session = _uuid(rng)
+        classroom = rng.randrange(classrooms)
+        attempt = {
+            "@id": session,
+            "@type": "http://purl.imsglobal.org/caliper/v1/Attempt",
+            "extensions": {
+                "assessmentType": rng.choice(ASSESSMENT_TYPES),
+                "assessmentId": "NG_IMA_H_01_U%02d_Quiz" % rng.randrange(40)
+            },
+            "maxAttempts": 3,
+            "assessmentItems": []
+        }
+        if rng.random() < optionalRate:
+            attempt["count"] = rng.randint(1, 3)
+        if rng.random() < optionalRate:
+            attempt["startedAtTime"] = "2016-11-11T20:%02d:00Z" % rng.randrange(60)
+        if rng.random() < optionalRate:
+            attempt["endedAtTime"] = "2016-11-11T21:%02d:00Z" % rng.randrange(60)
+
+        itemResults = []
+        for sequence in range(1, rng.randint(*items) + 1):
+            maxScore = rng.choice((1, 1, 2, 5, 10))
+            score = None if rng.random() < nullScoreRate else rng.randint(0, maxScore)
+            itemResults.append({
+                "@id": "%s_%032x" % (session, rng.getrandbits(128)),
+                "@type": "http://purl.imsglobal.org/caliper/v1/Result",
+                "question_type": rng.choice(QUESTION_TYPES),
+                "automarkable": 1,
+                "score": score,
+                "max_score": maxScore,
+                "question_reference": _uuid(rng),
+                "item_reference": _uuid(rng),
+                "sequenceNumber": sequence,
+                "extensions": None
+            })
+
+        event = {
+            "@context": "http://purl.imsglobal.org/ctx/caliper/v1/Context",
+            "@type": "http://purl.imsglobal.org/caliper/v1/OutcomeEvent",
+            "action": "http://purl.imsglobal.org/vocab/caliper/v1/action#Graded",
+            "actor": {
+                "@id": str(4000000 + rng.randrange(100000)),
+                "@type": "http://purl.imsglobal.org/caliper/v1/lis/Person",
+                "roles": [LEARNER if rng.random() < learnerRate else INSTRUCTOR]
+            },
+            "object": attempt,
+            "generated": {
+                "@id": session,
+                "@type": "http://purl.imsglobal.org/caliper/v1/Result",
+                "itemResults": itemResults,
+                "totalScore": len(itemResults)
+            },
+            "group": {
+                "@id": "class-%d" % classroom,
+                "@type": "http://purl.imsglobal.org/caliper/v1/lis/CourseOffering",
+                "extensions": {
+                    "CourseOfferingId": "%d.0" % (1200 + classroom),
+                    "contextId": "%024x" % rng.getrandbits(96),
+                    "platform": "D2L",
+                    "gradeLevel": str(rng.randint(6, 12))
+                }
+            },
+            "edApp": {"name": "K12 LearnX"}
+        }
+        if rng.random() < optionalRate:
+            event["eventTime"] = "2016-11-11T21:%02d:06Z" % rng.randrange(60)
+
+        sensor = n % sensors
+        yield {
+            "sensorId": "com.k12.learnx.events.outcome.%d" % sensor,
+            "apiKey": apiKeys[sensor],
+            "event": event,
+            "system": {"@id": [_uuid(rng)]}
+        }
+
+
+def generateBody(count, ndjson=False, **options):
+    """
+    Return `count` generated records as a UTF-8 request body.
+    """
+    events = generateEvents(count, **options)
+    if ndjson:
+        return "".join(json.dumps(e) + "\n" for e in events).encode("utf-8")
+    return json.dumps(list(events)).encode("utf-8")
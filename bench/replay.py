@@ -0,0 +1,183 @@
+"""
+Replay captured unwind traffic and report latency and errors.
+
+    $ python -m bench.replay capture.jsonl --concurrency 8 --duration 30
+    $ python -m bench.replay capture.jsonl --rate 50 --url http://localhost:9998
+
+Requests come from a capture file written by the service with
+BKT_CAPTURE_FILE set, and are sent round-robin either to the bottle `bkt_app`
+in process or over HTTP to --url. With --concurrency, that many clients send
+back to back (closed loop). With --rate, requests are started on a fixed
+schedule (open loop) and latency is measured from the scheduled start, so a
+stalled server is not hidden by clients backing off.
+"""
+import argparse
+import http.client
+import itertools
+import json
+import logging
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from bench.bench_unwind import callApp, percentile
+from service.capture import readCapture
+
+# Upper bounds, in milliseconds, of the latency histogram buckets
+BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000)
+
+
+class HttpClient(object):
+    """
+    One keep-alive connection per thread to the service under test.
+    """
+
+    def __init__(self, url):
+        parts = urllib.parse.urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.path = (parts.path.rstrip('/') or '') + '/bkt_service/unwind'
+        self.local = threading.local()
+
+    def __call__(self, request):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = self.local.connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        headers = {'Content-Type': request.get('contentType') or 'application/json'}
+        if request.get('accept'):
+            headers['Accept'] = request['accept']
+        try:
+            connection.request('POST', self.path, request['data'], headers)
+            response = connection.getresponse()
+            response.read()
+        except (http.client.HTTPException, OSError):
+            self.local.connection = None
+            connection.close()
+            raise
+        if response.status != 200:
+            raise RuntimeError('HTTP %d' % response.status)
+
+
+def inProcess(request):
+    headers = {'Accept': request['accept']} if request.get('accept') else None
+    callApp(request['data'], headers, request.get('contentType'))
+
+
+class Recorder(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.errors = 0
+
+    def record(self, started, failed):
+        elapsed = time.perf_counter() - started
+        with self.lock:
+            self.latencies.append(elapsed)
+            self.errors += failed
+
+
+def send(client, request, started, recorder):
+    failed = False
+    try:
+        client(request)
+    except Exception:
+        failed = True
+    recorder.record(started, failed)
+
+
+def closedLoop(client, requests, concurrency, deadline, limit, recorder):
+    counter = itertools.count()
+    lock = threading.Lock()
+
+    def worker():
+        while time.perf_counter() < deadline:
+            with lock:
+                n = next(counter)
+                request = next(requests)
+            if limit and n >= limit:
+                return
+            send(client, request, time.perf_counter(), recorder)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def openLoop(client, requests, rate, deadline, limit, recorder, maxWorkers):
+    interval = 1.0 / rate
+    with ThreadPoolExecutor(maxWorkers) as executor:
+        scheduled = time.perf_counter()
+        for n in itertools.count():
+            if scheduled >= deadline or (limit and n >= limit):
+                break
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(send, client, next(requests), scheduled, recorder)
+            scheduled += interval
+
+
+def report(recorder, elapsed):
+    latencies = recorder.latencies
+    total = len(latencies)
+    result = {
+        'requests': total,
+        'errors': recorder.errors,
+        'errorRate': recorder.errors / total if total else 0.0,
+        'throughput': total / elapsed if elapsed else 0.0,
+        'histogram': dict(('<=%dms' % bound, 0) for bound in BUCKETS),
+    }
+    result['histogram']['>%dms' % BUCKETS[-1]] = 0
+    for latency in latencies:
+        ms = 1000 * latency
+        bucket = next(('<=%dms' % b for b in BUCKETS if ms <= b), '>%dms' % BUCKETS[-1])
+        result['histogram'][bucket] += 1
+    if latencies:
+        for name, fraction in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('max', 1.0)):
+            result[name + 'Ms'] = 1000 * percentile(latencies, fraction)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('capture', help='capture file written with BKT_CAPTURE_FILE')
+    parser.add_argument('--url', help='service base URL; replays in process when omitted')
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('--concurrency', type=int, default=4, help='closed-loop clients')
+    target.add_argument('--rate', type=float, help='open-loop requests per second')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds to run')
+    parser.add_argument('--requests', type=int, default=0, help='stop after this many requests')
+    parser.add_argument('--max-workers', type=int, default=64, help='open-loop client threads')
+    parser.add_argument('--output', help='write the report as JSON to this file')
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    captured = []
+    for entry in readCapture(args.capture):
+        entry['data'] = entry['body'].encode('utf-8')
+        captured.append(entry)
+    if not captured:
+        raise SystemExit('No requests in %s' % args.capture)
+
+    client = HttpClient(args.url) if args.url else inProcess
+    recorder = Recorder()
+    requests = itertools.cycle(captured)
+    started = time.perf_counter()
+    deadline = started + args.duration
+    if args.rate:
+        openLoop(client, requests, args.rate, deadline, args.requests, recorder, args.max_workers)
+    else:
+        closedLoop(client, requests, args.concurrency, deadline, args.requests, recorder)
+
+    result = report(recorder, time.perf_counter() - started)
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(result, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""
+Per-request resource accounting: CPU time, traced peak memory and the response
+headers that report them.
+
+CPU time is the request thread's own (`time.thread_time`), so concurrent
+requests do not inflate each other. Peak memory comes from tracemalloc, which
+is process wide: one request is traced at a time and allocations made by other
+threads meanwhile are included in its peak.
+"""
+import threading
+import tracemalloc
+
+_tracing = threading.Lock()
+
+
+def startMemoryTrace():
+    """
+    Start tracing allocations for the calling request. Returns False when
+    another request, or anything else in the process, is already tracing.
+    """
+    if not _tracing.acquire(blocking=False):
+        return False
+    if tracemalloc.is_tracing():
+        _tracing.release()
+        return False
+    tracemalloc.start()
+    return True
+
+
+def stopMemoryTrace():
+    """
+    Stop tracing and return the peak bytes allocated since it started.
+    """
+    try:
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+        _tracing.release()
+
+
+def responseHeaders(stats):
+    """
+    Headers reporting the cost of a finished request, for responses that are
+    complete before they are sent.
+    """
+    timings = (('decode', stats.decodeTime), ('unwind', max(stats.itemsTime - stats.decodeTime, 0.0)),
+               ('encode', stats.encodeTime), ('cpu', stats.cpuTime), ('total', stats.duration))
+    headers = [
+        ('Server-Timing', ', '.join('%s;dur=%.2f' % (name, 1000 * value) for name, value in timings)),
+        ('X-Unwind-Records', str(stats.records)),
+        ('X-Unwind-Items', str(stats.items)),
+        ('X-Unwind-Rejected', str(stats.rejected)),
+        ('X-Unwind-Bytes-In', str(stats.bytesIn)),
+        ('X-Unwind-Bytes-Out', str(stats.bytesOut)),
+    ]
+    if stats.memoryPeak is not None:
+        headers.append(('X-Unwind-Memory-Peak', str(stats.memoryPeak)))
+    return headers
@@ -0,0 +1,108 @@
+"""
+Admission control for unwind requests.
+
+A request is turned away before any work is done on it when its body, or
+later its batch, is larger than configured (413), or when the process already
+has `config.INFLIGHT_BUDGET_BYTES` of request bodies being unwound (429 with
+a Retry-After). Body size stands in for the memory and CPU a request will
+need, since the unwound output grows with it. An idle process always admits
+one request, so a body under the size limit but over the budget still gets
+through. `load` is what the /ready route reports to load balancers.
+"""
+import threading
+from service import config, metrics, scheduler
+
+
+class TooLarge(ValueError):
+    pass
+
+
+class Overloaded(ValueError):
+
+    def __init__(self, message):
+        super(Overloaded, self).__init__(message)
+        self.retryAfter = config.RETRY_AFTER
+
+
+_lock = threading.Lock()
+_inflightBytes = 0
+_inflightRequests = 0
+
+
+def checkBody(size):
+    """
+    Reject a body of `size` bytes, e.g. from its Content-Length, over the limit.
+    """
+    if config.MAX_BODY_BYTES and size is not None and size > config.MAX_BODY_BYTES:
+        metrics.SHED.inc(1, 'body')
+        raise TooLarge('Request body exceeds %d bytes' % config.MAX_BODY_BYTES)
+
+
+def checkLoad(size):
+    """
+    Shed a request of `size` bytes the budget has no room for now, without
+    reserving anything; lets a front end refuse before reading the body.
+    """
+    if not _fits(size or 0):
+        metrics.SHED.inc(1, 'budget')
+        raise Overloaded('Too much work in flight, retry later')
+
+
+def _fits(size):
+    budget = config.INFLIGHT_BUDGET_BYTES
+    return budget <= 0 or _inflightRequests == 0 or _inflightBytes + size <= budget
+
+
+def reserve(size):
+    """
+    Reserve `size` bytes of the in-flight budget for a request, or raise
+    Overloaded. Every reservation is given back with `release`.
+    """
+    global _inflightBytes, _inflightRequests
+    with _lock:
+        if not _fits(size):
+            metrics.SHED.inc(1, 'budget')
+            raise Overloaded('Too much work in flight, retry later')
+        _inflightBytes += size
+        _inflightRequests += 1
+        metrics.INFLIGHT_BYTES.set(_inflightBytes)
+
+
+def grow(size):
+    """
+    Add `size` bytes to a reservation, e.g. once a compressed body is found to
+    be larger, or raise Overloaded leaving the reservation as it was.
+    """
+    global _inflightBytes
+    with _lock:
+        budget = config.INFLIGHT_BUDGET_BYTES
+        if budget > 0 and _inflightRequests > 1 and _inflightBytes + size > budget:
+            metrics.SHED.inc(1, 'budget')
+            raise Overloaded('Too much work in flight, retry later')
+        _inflightBytes += size
+        metrics.INFLIGHT_BYTES.set(_inflightBytes)
+
+
+def release(size):
+    global _inflightBytes, _inflightRequests
+    with _lock:
+        _inflightBytes -= size
+        _inflightRequests -= 1
+        metrics.INFLIGHT_BYTES.set(_inflightBytes)
+
+
+def load():
+    """
+    The current load of this process, as reported by /ready.
+    """
+    budget = config.INFLIGHT_BUDGET_BYTES
+    utilization = float(_inflightBytes) / budget if budget > 0 else 0.0
+    slots = scheduler.getScheduler()
+    return {
+        'ready': utilization < config.READY_THRESHOLD,
+        'requests': _inflightRequests,
+        'bytes': _inflightBytes,
+        'budget': budget,
+        'utilization': round(utilization, 3),
+        'queued': sum(slots.depths().values()) if slots is not None else 0,
+    }
@@ -0,0 +1,203 @@
+"""
+ASGI front end for the unwind service.
+
+Exposes the same routes as the bottle `bkt_app`, for example with
+``uvicorn service.asgi:application``. Request bodies are received on the event
+loop, so thousands of slow uploads cost no threads; only once a body is
+complete does the CPU-bound unwinding run, in a thread executor and behind a
+semaphore that bounds how many unwinds run at once.
+"""
+import asyncio
+import json
+import logging
+import tempfile
+import time
+from urllib.parse import parse_qsl
+from concurrent.futures import ThreadPoolExecutor
+from service import admission, config, metrics, pipeline, pool, profiling
+
+log = logging.getLogger(__name__)
+
+_executor = None
+_slots = None
+
+
+def getExecutor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(config.ASGI_CONCURRENCY, thread_name_prefix='unwind')
+    return _executor
+
+
+def getSlots():
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(config.ASGI_CONCURRENCY)
+    return _slots
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+    elif scope['type'] == 'http':
+        if scope['path'] == '/' and scope['method'] in ('GET', 'HEAD'):
+            await respond(send, 200, 'text/html; charset=UTF-8', pipeline.indexPage())
+        elif scope['path'] == '/metrics' and scope['method'] in ('GET', 'HEAD'):
+            await respond(send, 200, metrics.CONTENT_TYPE, metrics.REGISTRY.expose())
+        elif scope['path'] == '/ready' and scope['method'] in ('GET', 'HEAD'):
+            state = admission.load()
+            await respond(send, 200 if state['ready'] else 503, 'application/json', json.dumps(state))
+        elif scope['path'] == '/admin/profile' and config.ADMIN_TOKEN:
+            await profileControl(scope, send)
+        elif scope['path'] == '/bkt_service/unwind':
+            if scope['method'] == 'POST':
+                await processPipelineOperation(scope, receive, send)
+            else:
+                await respond(send, 405, 'text/plain; charset=UTF-8', 'Method not allowed.')
+        else:
+            await respond(send, 404, 'text/plain; charset=UTF-8', 'Not found.')
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            profiling.installSignalHandler()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if _executor is not None:
+                _executor.shutdown()
+            pool.shutdown()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def processPipelineOperation(scope, receive, send):
+    headers = dict((k.decode('latin-1').lower(), v.decode('latin-1')) for k, v in scope['headers'])
+    query = dict(parse_qsl(scope.get('query_string', b'').decode('latin-1')))
+
+    # Refuse before receiving the body when Content-Length already rules it out
+    try:
+        pipeline.screenRequest(int(headers.get('content-length') or -1))
+    except ValueError:
+        await respond(send, 400, 'text/plain; charset=UTF-8', 'Invalid Content-Length.')
+        return
+    except pipeline.PipelineError as e:
+        await respond(send, e.status, 'text/plain; charset=UTF-8', e.message, e.headers)
+        return
+
+    started = time.perf_counter()
+    try:
+        body = await readBody(receive)
+    except admission.TooLarge as e:
+        await respond(send, 413, 'text/plain; charset=UTF-8', str(e))
+        return
+    if body is None:
+        return
+    metrics.STAGE_SECONDS.observe(time.perf_counter() - started, 'read')
+
+    loop = asyncio.get_running_loop()
+    executor = getExecutor()
+    extraHeaders = []
+    try:
+        # A slot is held only while unwinding runs, never while a response
+        # is sent, so slow clients cannot keep unwinds from running
+        async with getSlots():
+            try:
+                contentType, payload = await loop.run_in_executor(
+                    executor, pipeline.unwindBody, body, headers.get('content-type'), headers.get('accept'),
+                    extraHeaders, query.get('shape'), headers.get('content-encoding'),
+                    headers.get('accept-encoding'))
+                # Pull the first chunk of a streamed payload before committing
+                # to a status, as bottle does, so early failures still get a 500
+                if not isinstance(payload, (str, bytes)):
+                    chunk = await loop.run_in_executor(executor, next, payload, None)
+            except pipeline.PipelineError as e:
+                error = e
+            except Exception:
+                log.exception('Unwind failed')
+                error = pipeline.PipelineError(500, 'Internal Server Error')
+            else:
+                error = None
+        if error is not None:
+            await respond(send, error.status, 'text/plain; charset=UTF-8', error.message, error.headers)
+            return
+
+        if isinstance(payload, (str, bytes)):
+            await respond(send, 200, contentType, payload, extraHeaders)
+            return
+
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type', contentType.encode('latin-1'))] + encodeHeaders(extraHeaders)})
+        try:
+            while chunk is not None:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                # Each further chunk is unwound in a slot of its own
+                async with getSlots():
+                    chunk = await loop.run_in_executor(executor, next, payload, None)
+        except Exception:
+            # The status line is already sent; all we can do is cut it short
+            log.exception('Unwind failed mid-stream')
+            raise
+        finally:
+            payload.close()
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        body.close()
+
+
+async def profileControl(scope, send):
+    headers = dict((k.decode('latin-1').lower(), v.decode('latin-1')) for k, v in scope['headers'])
+    if not profiling.authorized(headers.get('x-admin-token')):
+        await respond(send, 403, 'text/plain; charset=UTF-8', 'Forbidden.')
+        return
+    if scope['method'] == 'GET':
+        result = profiling.status()
+    elif scope['method'] == 'POST':
+        try:
+            result = profiling.control(dict(parse_qsl(scope.get('query_string', b'').decode('latin-1'))))
+        except ValueError as e:
+            await respond(send, 400, 'text/plain; charset=UTF-8', str(e))
+            return
+    else:
+        await respond(send, 405, 'text/plain; charset=UTF-8', 'Method not allowed.')
+        return
+    await respond(send, 200, 'application/json', json.dumps(result))
+
+
+async def readBody(receive):
+    # Spool the body so large batches do not have to fit in memory; returns
+    # None if the client disconnects first. A body without a Content-Length
+    # is refused with TooLarge as soon as it crosses the limit.
+    body = tempfile.SpooledTemporaryFile(config.ASGI_SPOOL_SIZE)
+    size = 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            body.close()
+            return None
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        try:
+            admission.checkBody(size)
+        except admission.TooLarge:
+            body.close()
+            raise
+        body.write(chunk)
+        if not message.get('more_body', False):
+            break
+    body.seek(0)
+    return body
+
+
+def encodeHeaders(headers):
+    return [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+
+async def respond(send, status, contentType, text, headers=()):
+    # `text` may already be encoded, e.g. a compressed payload
+    data = text.encode('utf-8') if isinstance(text, str) else text
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', contentType.encode('latin-1')),
+                            (b'content-length', str(len(data)).encode('latin-1'))] + encodeHeaders(headers)})
+    await send({'type': 'http.response.body', 'body': data})
@@ -0,0 +1,386 @@
+"""
+Offline unwinding of event files, without the HTTP layer.
+
+    $ python -m service.backfill events-2016.json.gz events-2017.jsonl --output-dir unwound --workers 8
+
+Each input holds a JSON array or newline-delimited JSON of pipeline records,
+optionally gzip compressed, and is unwound into ``<output-dir>/<name>.ndjson``
+with the same lines `/bkt_service/unwind` returns for
+``Accept: application/x-ndjson``; the `recordIndex` of an error item counts
+from the start of its file. With ``--format parquet`` or ``--format arrow``
+(which need pyarrow) the output is instead a directory ``<name>.parquet`` or
+``<name>.arrow`` of one columnar file per shard, with the columns of
+service/columnar.py, readable as one dataset. Files are read and written as streams and unwound
+in shards by worker processes, with a bounded number of shards in flight, so
+memory does not grow with the input.
+
+Progress is checkpointed to ``<output-dir>/checkpoint.json``. Running the
+same command again after a crash skips the finished files and picks each
+partly written one up after its last checkpointed shard.
+"""
+import argparse
+import collections
+import gzip
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from service import codec, columnar, compact, config, jsonstream, model, pool
+
+log = logging.getLogger(__name__)
+
+CHECKPOINT_NAME = 'checkpoint.json'
+
+FORMATS = ('ndjson', 'arrow', 'parquet')
+
+_GZIP_MAGIC = b'\x1f\x8b'
+
+
+#####################################################################
+#
+# Input
+#
+#####################################################################
+
+
+def openInput(path):
+    """
+    Open an input file for reading, decompressing it if it is gzip.
+    """
+    with open(path, 'rb') as raw:
+        compressed = raw.read(2) == _GZIP_MAGIC
+    return gzip.open(path, 'rb') if compressed else open(path, 'rb')
+
+
+def isJsonArray(stream):
+    # JSON Lines documents are objects; only an array starts with '['
+    head = stream.read(4096).lstrip()
+    stream.seek(0)
+    return head[:1] == b'['
+
+
+def iterShards(stream, size, skip=0):
+    """
+    Yield ``(records, lineNumbers)`` shards of at most `size` records after
+    the first `skip`. JSON Lines are left undecoded for the workers, with
+    their line numbers; records of a JSON array are decoded here and have no
+    line numbers.
+    """
+    if isJsonArray(stream):
+        records = jsonstream.iterArrayElements(stream, config.READ_CHUNK_SIZE)
+        for shard in pool.iterShards(itertools.islice(records, skip, None), size):
+            yield shard, None
+        return
+
+    lines = ((number, line) for number, line in enumerate(stream, 1) if line.strip())
+    for shard in pool.iterShards(itertools.islice(lines, skip, None), size):
+        yield [line for _, line in shard], [number for number, _ in shard]
+
+
+#####################################################################
+#
+# Unwinding
+#
+#####################################################################
+
+
+def unwindShard(records, start, lineNumbers=None, format='ndjson'):
+    """
+    Worker entry point: unwind one shard and encode it as the service would.
+    Returns the NDJSON lines, or a whole Arrow or Parquet file, with the
+    counts of records, items and rejected events.
+    """
+    if lineNumbers is not None:
+        records = [_decodeLine(line, number) for line, number in zip(records, lineNumbers)]
+    items = model.unwindShard(records, start)
+    rejected = sum(1 for item in items if item.__class__ is not tuple)
+    if format == 'arrow':
+        data = columnar.encodeArrowFile(items)
+    elif format == 'parquet':
+        data = columnar.encodeParquet(items)
+    else:
+        data = ''.join([compact.encodeItem(item) + '\n' for item in items]).encode('utf-8')
+    return data, len(records), len(items), rejected
+
+
+def _decodeLine(line, number):
+    try:
+        return codec.loads(line)
+    except ValueError as e:
+        raise ValueError('Malformed JSON on line %d: %s' % (number, e))
+
+
+def iterUnwound(shards, start, executor, window, format='ndjson'):
+    """
+    Yield the results of `unwindShard` in input order, keeping at most
+    `window` shards in flight on `executor`, or unwinding inline without one.
+    """
+    if executor is None:
+        for records, lineNumbers in shards:
+            result = unwindShard(records, start, lineNumbers, format)
+            start += result[1]
+            yield result
+        return
+
+    pending = collections.deque()
+    try:
+        for records, lineNumbers in shards:
+            pending.append(executor.submit(unwindShard, records, start, lineNumbers, format))
+            start += len(records)
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+#####################################################################
+#
+# Output
+#
+#####################################################################
+
+
+class FileOutput(object):
+    """
+    NDJSON appended to a single file; its position is a byte offset.
+    """
+
+    def __init__(self, path, position):
+        self.file = open(path, 'r+b' if position else 'wb')
+        self.file.truncate(position)
+        self.file.seek(position)
+        self.position = position
+
+    def write(self, data):
+        self.file.write(data)
+        self.position += len(data)
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+
+class PartsOutput(object):
+    """
+    A directory of one columnar file per shard; its position is the number of
+    parts written. Parts appear under their final name only once complete.
+    """
+
+    def __init__(self, path, extension, position):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.extension = extension
+        self.position = position
+        for name in os.listdir(path):
+            if name.endswith('.tmp') or _partNumber(name) >= position:
+                os.remove(os.path.join(path, name))
+
+    def write(self, data):
+        name = os.path.join(self.path, 'part-%05d.%s' % (self.position, self.extension))
+        with open(name + '.tmp', 'wb') as part:
+            part.write(data)
+            part.flush()
+            os.fsync(part.fileno())
+        os.replace(name + '.tmp', name)
+        self.position += 1
+
+    def sync(self):
+        # Make the renames durable
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def close(self):
+        pass
+
+
+def _partNumber(name):
+    try:
+        return int(name.split('.', 1)[0][len('part-'):]) if name.startswith('part-') else -1
+    except ValueError:
+        return -1
+
+
+def outputPath(path, outputDir, format='ndjson'):
+    name = os.path.basename(path)
+    for suffix in ('.gz', '.jsonl', '.ndjson', '.json'):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    return os.path.join(outputDir, '%s.%s' % (name, format))
+
+
+def openOutput(path, format, position):
+    if format == 'ndjson':
+        return FileOutput(path, position)
+    return PartsOutput(path, format, position)
+
+
+#####################################################################
+#
+# Checkpoints and progress
+#
+#####################################################################
+
+
+class Checkpoint(object):
+    """
+    Records, per input file, how many records have been unwound, how far
+    into the output they reach and in which format. Saved by atomic rename.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path) as saved:
+                self.files = json.load(saved)['files']
+        except FileNotFoundError:
+            self.files = {}
+
+    def entry(self, path):
+        return self.files.get(os.path.abspath(path), {'records': 0, 'offset': 0, 'format': None, 'done': False})
+
+    def update(self, path, records, offset, format='ndjson', done=False):
+        self.files[os.path.abspath(path)] = {'records': records, 'offset': offset, 'format': format, 'done': done}
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w') as output:
+            json.dump({'files': self.files}, output, indent=1, sort_keys=True)
+            output.flush()
+            os.fsync(output.fileno())
+        os.replace(temporary, self.path)
+
+
+class Progress(object):
+
+    def __init__(self, interval, stream=None):
+        self.interval = interval
+        self.stream = stream or sys.stderr
+        self.started = time.perf_counter()
+        self.reported = self.started
+        self.records = 0
+        self.items = 0
+        self.rejected = 0
+        self.bytesOut = 0
+
+    def add(self, records, items, rejected, bytesOut):
+        self.records += records
+        self.items += items
+        self.rejected += rejected
+        self.bytesOut += bytesOut
+        now = time.perf_counter()
+        if self.interval and now - self.reported >= self.interval:
+            self.reported = now
+            self.report()
+
+    def report(self, prefix='unwound'):
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        self.stream.write('%s %d records, %d items (%d rejected) in %.1fs: %.0f records/s, %.0f items/s, %.1f MB/s\n'
+                          % (prefix, self.records, self.items, self.rejected, elapsed, self.records / elapsed,
+                             self.items / elapsed, self.bytesOut / elapsed / 1e6))
+        self.stream.flush()
+
+
+#####################################################################
+#
+# Driver
+#
+#####################################################################
+
+
+def unwindFile(path, output, format, checkpoint, executor, window, shardSize, progress, checkpointInterval):
+    entry = checkpoint.entry(path)
+    started = entry.get('format') or 'ndjson'
+    if entry['records'] and started != format:
+        raise ValueError('%s was started as %s, not %s' % (path, started, format))
+    if entry['done']:
+        log.info('Skipping %s, already unwound', path)
+        return
+    records = entry['records']
+
+    # Anything written after the last checkpoint is written again
+    out = openOutput(output, format, entry['offset'])
+    try:
+        with openInput(path) as stream:
+            saved = time.perf_counter()
+            for data, count, items, rejected in iterUnwound(iterShards(stream, shardSize, records), records,
+                                                            executor, window, format):
+                out.write(data)
+                records += count
+                progress.add(count, items, rejected, len(data))
+                if time.perf_counter() - saved >= checkpointInterval:
+                    out.sync()
+                    checkpoint.update(path, records, out.position, format)
+                    saved = time.perf_counter()
+        out.sync()
+    finally:
+        out.close()
+    checkpoint.update(path, records, out.position, format, done=True)
+
+
+def backfill(inputs, outputDir, workers=0, shardSize=1000, checkpointInterval=5.0, progress=None,
+             format='ndjson'):
+    """
+    Unwind each of the `inputs` files into `outputDir` as `format`, resuming
+    from its checkpoint. `workers` processes unwind shards of `shardSize`
+    records; 0 unwinds inline.
+    """
+    if format not in FORMATS:
+        raise ValueError('Unknown output format: %s' % format)
+    if format != 'ndjson' and not columnar.available():
+        raise ValueError('The %s format needs pyarrow installed' % format)
+    outputs = [outputPath(path, outputDir, format) for path in inputs]
+    if len(set(outputs)) < len(outputs):
+        raise ValueError('Input files must have distinct names')
+    os.makedirs(outputDir, exist_ok=True)
+    checkpoint = Checkpoint(os.path.join(outputDir, CHECKPOINT_NAME))
+    progress = progress or Progress(0)
+
+    executor = None
+    if workers > 0:
+        executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context(config.POOL_START_METHOD))
+    try:
+        for path, output in zip(inputs, outputs):
+            unwindFile(path, output, format, checkpoint, executor, 2 * workers, shardSize, progress,
+                       checkpointInterval)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+    return progress
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('inputs', nargs='+', help='JSON array or JSON Lines files, optionally gzip compressed')
+    parser.add_argument('--output-dir', required=True, help='directory for the unwound output and the checkpoint')
+    parser.add_argument('--format', choices=FORMATS, default='ndjson', help='output format')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='worker processes; 0 unwinds inline')
+    parser.add_argument('--shard-size', type=int, default=1000, help='records unwound per worker task')
+    parser.add_argument('--checkpoint-interval', type=float, default=5.0, help='seconds between checkpoints')
+    parser.add_argument('--progress-interval', type=float, default=10.0, help='seconds between progress lines')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    logging.getLogger('service.model').setLevel(logging.WARNING)
+
+    progress = Progress(args.progress_interval)
+    try:
+        backfill(args.inputs, args.output_dir, args.workers, args.shard_size, args.checkpoint_interval, progress,
+                 args.format)
+    except (OSError, ValueError) as e:
+        progress.report('stopped after')
+        raise SystemExit('backfill: %s' % e)
+    progress.report()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+"""
+Idempotency cache of unwind results, keyed by a hash of the request body and
+the response format.
+
+Unwinding is a pure function of the body, so a retried batch can be answered
+from the cache. Results are kept uncompressed, least recently used first out
+once `config.CACHE_MAX_BYTES` is exceeded, and expire after
+`config.CACHE_TTL` seconds. Identical requests that arrive while the first is
+still being unwound wait for its result instead of repeating the work
+("single flight"). The cache is per process.
+"""
+import collections
+import hashlib
+import threading
+import time
+from service import config, metrics
+
+
+class CachedResult(object):
+    """
+    A serialized response and the counts to report when it is served again.
+    """
+
+    __slots__ = ('contentType', 'payload', 'format', 'records', 'items', 'rejected', 'expires')
+
+    def __init__(self, contentType, payload, format, records, items, rejected):
+        self.contentType = contentType
+        self.payload = payload
+        self.format = format
+        self.records = records
+        self.items = items
+        self.rejected = rejected
+        self.expires = time.monotonic() + config.CACHE_TTL
+
+    @property
+    def size(self):
+        # Payload plus a rough allowance for the entry and its key
+        return len(self.payload) + 256
+
+
+class Flight(object):
+    """
+    One computation of a result that identical requests can wait for.
+    """
+
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.key = key
+        self.done = threading.Event()
+
+    def finish(self, result):
+        """
+        Store `result`, or None when it could not be computed or kept, and
+        release the waiting requests. Safe to call more than once.
+        """
+        if not self.done.is_set():
+            self.cache.land(self, result)
+
+
+class ResultCache(object):
+
+    def __init__(self, maxBytes, waitTimeout):
+        self.maxBytes = maxBytes
+        self.waitTimeout = waitTimeout
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.flights = {}
+        self.bytes = 0
+
+    def begin(self, key):
+        """
+        Return ``(result, None)`` for a cached result, or ``(None, flight)``
+        when the caller is to compute it and then call ``flight.finish``.
+        Waits while another request is computing the same key.
+        """
+        waited = False
+        while True:
+            with self.lock:
+                result = self._get(key)
+                if result is not None:
+                    metrics.CACHE_REQUESTS.inc(1, 'coalesced' if waited else 'hit')
+                    return result, None
+                flight = self.flights.get(key)
+                if flight is None:
+                    flight = self.flights[key] = Flight(self, key)
+                    metrics.CACHE_REQUESTS.inc(1, 'miss')
+                    return None, flight
+            # A leader that never finishes, e.g. a stream that was never
+            # read, only delays its followers by the wait timeout
+            if not flight.done.wait(self.waitTimeout):
+                with self.lock:
+                    if self.flights.get(key) is flight:
+                        del self.flights[key]
+            waited = True
+
+    def _get(self, key):
+        result = self.entries.get(key)
+        if result is None:
+            return None
+        if result.expires <= time.monotonic():
+            self._remove(key)
+            return None
+        self.entries.move_to_end(key)
+        return result
+
+    def _remove(self, key):
+        self.bytes -= self.entries.pop(key).size
+        metrics.CACHE_BYTES.set(self.bytes)
+
+    def land(self, flight, result):
+        with self.lock:
+            if self.flights.get(flight.key) is flight:
+                del self.flights[flight.key]
+            if result is not None and result.size <= config.CACHE_MAX_ENTRY_BYTES:
+                if flight.key in self.entries:
+                    self._remove(flight.key)
+                self.entries[flight.key] = result
+                self.bytes += result.size
+                while self.bytes > self.maxBytes:
+                    self.bytes -= self.entries.popitem(last=False)[1].size
+                    metrics.CACHE_EVICTIONS.inc()
+            metrics.CACHE_BYTES.set(self.bytes)
+        flight.done.set()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+            metrics.CACHE_BYTES.set(0)
+
+
+def requestKey(body, *options):
+    """
+    Hash the seekable `body` and the response format `options`.
+    """
+    digest = hashlib.sha256(repr(options).encode('utf-8'))
+    body.seek(0)
+    for chunk in iter(lambda: body.read(1024 * 1024), b''):
+        digest.update(chunk)
+    body.seek(0)
+    return digest.digest()
+
+
+_cache = None
+_cacheLock = threading.Lock()
+
+
+def getCache():
+    """
+    Return the process's result cache, or None when caching is turned off.
+    """
+    global _cache
+    if config.CACHE_MAX_BYTES <= 0:
+        return None
+    if _cache is None:
+        with _cacheLock:
+            if _cache is None:
+                _cache = ResultCache(config.CACHE_MAX_BYTES, config.CACHE_WAIT_TIMEOUT)
+    return _cache
+
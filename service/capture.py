@@ -0,0 +1,96 @@
+"""
+Sampling capture of production request bodies.
+
+When CAPTURE_FILE is set, a CAPTURE_RATE fraction of unwind requests no larger
+than CAPTURE_MAX_BYTES are copied onto a bounded queue. A background thread
+appends them to the file as JSON lines, one request per line, so the request
+thread never waits on disk. Samples arriving while the queue is full are
+dropped and counted. The file is replayed with ``python -m bench.replay``.
+"""
+import json
+import logging
+import queue
+import random
+import threading
+import time
+from service import config
+
+log = logging.getLogger(__name__)
+
+
+class Capture(object):
+
+    def __init__(self, path, queueSize):
+        self.path = path
+        self.queue = queue.Queue(queueSize)
+        self.captured = 0
+        self.dropped = 0
+        self.writer = threading.Thread(target=self.write, name='capture', daemon=True)
+        self.writer.start()
+
+    def offer(self, body, contentType, accept, rate, maxBytes):
+        # Called on the request thread; `body` is a seekable binary stream
+        if random.random() >= rate:
+            return
+        data = body.read(maxBytes + 1)
+        body.seek(0)
+        if not data or len(data) > maxBytes:
+            return
+        entry = {
+            'capturedAt': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'contentType': contentType,
+            'accept': accept,
+            'body': data.decode('utf-8', 'replace'),
+        }
+        try:
+            self.queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+
+    def write(self):
+        while True:
+            entry = self.queue.get()
+            try:
+                with open(self.path, 'a') as output:
+                    output.write(json.dumps(entry) + '\n')
+                    # Drain whatever else queued up while the file was open
+                    while True:
+                        try:
+                            output.write(json.dumps(self.queue.get_nowait()) + '\n')
+                        except queue.Empty:
+                            break
+                        self.captured += 1
+                self.captured += 1
+            except (IOError, OSError):
+                log.exception('Could not write capture file %s', self.path)
+
+
+_capture = None
+_lock = threading.Lock()
+
+
+def getCapture():
+    # Created on first use so the writer thread starts in the serving process
+    global _capture
+    if not config.CAPTURE_FILE:
+        return None
+    with _lock:
+        if _capture is None or _capture.path != config.CAPTURE_FILE:
+            _capture = Capture(config.CAPTURE_FILE, config.CAPTURE_QUEUE_SIZE)
+        return _capture
+
+
+def offer(body, contentType, accept):
+    capture = getCapture()
+    if capture is not None:
+        capture.offer(body, contentType, accept, config.CAPTURE_RATE, config.CAPTURE_MAX_BYTES)
+
+
+def readCapture(path):
+    """
+    Yield the requests recorded in a capture file.
+    """
+    with open(path) as lines:
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
@@ -0,0 +1,78 @@
+"""
+JSON codec used by the unwind pipeline.
+
+Decoding picks the fastest backend available at import time (orjson when it
+is installed) and falls back to the stdlib `json` module. Both decode straight
+from the request bytes, without an intermediate str copy.
+
+Encoding always goes through the stdlib encoder. No faster backend reproduces
+its ", "/": " separators, ASCII escaping and float repr, and downstream
+consumers depend on the output staying byte-for-byte the same.
+"""
+import json
+from service import config
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# orjson silently turns integers wider than 64 bits into floats, where the
+# stdlib keeps them exact; bodies with such long integers take the stdlib.
+# Folding every digit to '0' and searching for a run is several times faster
+# than a regex scan. It is done a chunk at a time so that the body is never
+# copied whole.
+_foldDigits = bytes.maketrans(b'123456789', b'000000000')
+_longDigits = b'0' * 19
+_SCAN_CHUNK = 1024 * 1024
+_DIGITS = frozenset(b'0123456789')
+_BLANK_OR_SIGN = frozenset(b' \t\r\n-')
+
+
+def _hasLongInteger(data):
+    size = len(data)
+    start = 0
+    while start < size:
+        # Chunks overlap so that a run across a boundary is still found
+        chunk = data[start:start + _SCAN_CHUNK + len(_longDigits) - 1].translate(_foldDigits)
+        found = chunk.find(_longDigits)
+        while found >= 0:
+            # Only a run that starts a number counts; ids and other strings
+            # are full of digit runs
+            i = start + found - 1
+            while i >= 0 and data[i] in _DIGITS:
+                i -= 1
+            while i >= 0 and data[i] in _BLANK_OR_SIGN:
+                i -= 1
+            if i < 0 or data[i] in b':,[':
+                return True
+            found = chunk.find(_longDigits, found + len(_longDigits))
+        start += _SCAN_CHUNK
+    return False
+
+
+def _stdlibLoads(data):
+    return json.loads(data)
+
+
+def _orjsonLoads(data):
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    if not _hasLongInteger(data):
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+    # orjson also rejects a few inputs the stdlib accepts (NaN, Infinity, lone
+    # surrogates); let the stdlib decide so both backends accept the same input.
+    return json.loads(data)
+
+
+if orjson is not None and config.JSON_BACKEND in ('auto', 'orjson'):
+    BACKEND = 'orjson'
+    loads = _orjsonLoads
+else:
+    BACKEND = 'json'
+    loads = _stdlibLoads
+
+dumps = json.dumps
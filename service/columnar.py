@@ -0,0 +1,218 @@
+"""
+Columnar output of unwound questions as Apache Arrow or Parquet.
+
+Requested with ``Accept: application/vnd.apache.arrow.stream`` or
+``Accept: application/vnd.apache.parquet`` and available when the optional
+`pyarrow` package is installed. Every question becomes a row of the flat item
+fields, and an event that could not be unwound a row with only `recordIndex`,
+`errorCode` and `errorMessage` set; `errorCode` is 0 on every other row.
+
+Columns are built straight from the compact rows: the fields an event's
+questions share are repeated once per event rather than read per question,
+and no item dicts are made. Every text column (ids, types and times) is
+dictionary encoded, as its values repeat across questions and events.
+Arrow responses are streamed one record batch at a time; a Parquet file is
+only complete at its footer, so it is returned whole.
+"""
+from service import grouped
+from service.compact import encodeValue
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+ARROW = 'application/vnd.apache.arrow.stream'
+PARQUET = 'application/vnd.apache.parquet'
+
+MEDIA_TYPES = {'arrow': ARROW, 'parquet': PARQUET}
+
+# Rows per Arrow record batch or Parquet row group
+BATCH_ROWS = 64 * 1024
+
+# (name, kind) in flat item order; kind is the Arrow type of the column
+COLUMNS = (
+    ('studentId', 'id'), ('questionId', 'id'), ('sequenceNumber', 'int'),
+    ('score', 'float'), ('maxScore', 'float'), ('classroomId', 'id'),
+    ('assessmentId', 'id'), ('assessmentType', 'id'), ('learnositySessionId', 'id'),
+    ('learnosityUserId', 'id'), ('assessmentAttempt', 'int'), ('courseOfferingId', 'id'),
+    ('eventSubmitTime', 'id'), ('assessmentStartTime', 'id'), ('assessmentEndTime', 'id'),
+    ('questionType', 'id'), ('itemReference', 'id'),
+    ('recordIndex', 'int'), ('errorCode', 'int'), ('errorMessage', 'id'),
+)
+
+NAMES = tuple(name for name, _ in COLUMNS)
+
+# Where each column's values come from in an EventHeader or a compact row
+_HEADER_POSITIONS = tuple((NAMES.index(name), i) for i, name in enumerate(grouped.HEADER_FIELDS))
+_ROW_POSITIONS = tuple((NAMES.index(name), i) for i, name in enumerate(grouped.COLUMNS, 1))
+_RECORD_INDEX, _ERROR_CODE, _ERROR_MESSAGE = NAMES.index('recordIndex'), NAMES.index('errorCode'), NAMES.index('errorMessage')
+
+
+class ColumnTypeError(ValueError):
+    """
+    A value that its column's Arrow type cannot hold.
+    """
+
+
+def available():
+    return pyarrow is not None
+
+
+def _types():
+    return {
+        'id': pyarrow.dictionary(pyarrow.int32(), pyarrow.string()),
+        'int': pyarrow.int64(),
+        'float': pyarrow.float64(),
+    }
+
+
+_schema = None
+
+
+def schema():
+    global _schema
+    if _schema is None:
+        types = _types()
+        _schema = pyarrow.schema([(name, types[kind]) for name, kind in COLUMNS])
+    return _schema
+
+
+class ColumnBuilder(object):
+    """
+    Accumulates unwound items as column lists.
+    """
+
+    def __init__(self):
+        self.columns = [[] for _ in COLUMNS]
+        self.rows = 0
+
+    def addEvent(self, header, rows):
+        count = len(rows)
+        columns = self.columns
+        fields = header.fields()
+        for column, position in _HEADER_POSITIONS:
+            columns[column].extend([fields[position]] * count)
+        values = tuple(zip(*rows))
+        for column, position in _ROW_POSITIONS:
+            columns[column].extend(values[position])
+        columns[_RECORD_INDEX].extend([None] * count)
+        columns[_ERROR_CODE].extend([0] * count)
+        columns[_ERROR_MESSAGE].extend([''] * count)
+        self.rows += count
+
+    def addError(self, item):
+        for column in self.columns:
+            column.append(None)
+        error = item.get('error') or {}
+        self.columns[_RECORD_INDEX][-1] = item.get('recordIndex')
+        self.columns[_ERROR_CODE][-1] = error.get('code')
+        self.columns[_ERROR_MESSAGE][-1] = error.get('message')
+        self.rows += 1
+
+    def add(self, group):
+        if group.__class__ is tuple:
+            self.addEvent(*group)
+        else:
+            self.addError(group)
+
+    def toBatch(self):
+        batchSchema = schema()
+        arrays = [_toArray(values, name, field.type)
+                  for values, name, field in zip(self.columns, NAMES, batchSchema)]
+        return pyarrow.RecordBatch.from_arrays(arrays, schema=batchSchema)
+
+
+def _toArray(values, name, arrowType):
+    if pyarrow.types.is_dictionary(arrowType) or pyarrow.types.is_string(arrowType):
+        # Any JSON value fits a text column, written as its JSON
+        values = [value if value is None or value.__class__ is str else encodeValue(value)
+                  for value in values]
+    try:
+        return pyarrow.array(values, arrowType)
+    except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError, OverflowError) as e:
+        raise ColumnTypeError('Column %s cannot be written as %s: %s' % (name, arrowType, e))
+
+
+def iterBatches(items, rows=BATCH_ROWS):
+    """
+    Yield record batches of about `rows` rows of `items`; at least one, so an
+    empty result still carries the schema.
+    """
+    builder = ColumnBuilder()
+    batches = 0
+    for group in grouped.iterGroups(items):
+        builder.add(group)
+        if builder.rows >= rows:
+            yield builder.toBatch()
+            batches += 1
+            builder = ColumnBuilder()
+    if builder.rows or not batches:
+        yield builder.toBatch()
+
+
+class _Sink(object):
+    """
+    File-like target collecting what an Arrow writer writes.
+    """
+
+    closed = False
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def iterArrowChunks(items, rows=BATCH_ROWS):
+    """
+    Yield an Arrow IPC stream of `items` in chunks of one record batch each.
+    """
+    sink = _Sink()
+    writer = pyarrow.ipc.new_stream(pyarrow.PythonFile(sink, mode='w'), schema())
+    for batch in iterBatches(items, rows):
+        writer.write_batch(batch)
+        yield sink.take()
+    writer.close()
+    yield sink.take()
+
+
+def encodeArrow(items, rows=BATCH_ROWS):
+    return b''.join(iterArrowChunks(items, rows))
+
+
+def encodeParquet(items, rows=BATCH_ROWS):
+    """
+    Serialize `items` as a Parquet file with a row group per `rows` rows.
+    """
+    sink = _Sink()
+    writer = pyarrow.parquet.ParquetWriter(pyarrow.PythonFile(sink, mode='w'), schema())
+    for batch in iterBatches(items, rows):
+        writer.write_batch(batch)
+    writer.close()
+    return sink.take()
+
+
+def encodeArrowFile(items):
+    """
+    Serialize `items` as an Arrow IPC file of one record batch. The file
+    format, unlike the stream, allows one dictionary per column.
+    """
+    sink = _Sink()
+    writer = pyarrow.ipc.new_file(pyarrow.PythonFile(sink, mode='w'), schema())
+    for batch in iterBatches(items, float('inf')):
+        writer.write_batch(batch)
+    writer.close()
+    return sink.take()
@@ -0,0 +1,158 @@
+"""
+Compact in-memory layout for unwound items.
+
+Every question of an event repeats the same record-level fields, so inside the
+service an unwound question is a row tuple
+
+    (header, questionId, sequenceNumber, score, maxScore, questionType, itemReference)
+
+sharing one `EventHeader` per event, instead of three nested dicts per
+question. Error items stay plain dicts. String values that recur across a
+batch (ids, assessment and question types) are interned.
+
+Rows are serialized straight to the JSON of the equivalent item dict, with the
+header's parts of that JSON encoded once per event.
+"""
+import json
+import sys
+from service import codec
+
+_encodeString = json.encoder.encode_basestring_ascii
+
+# The fixed end of every successfully unwound item
+_TAIL = ', "error": {"code": 0, "message": ""}}'
+
+
+def _intern(value):
+    return sys.intern(value) if value.__class__ is str else value
+
+
+def encodeValue(value):
+    """
+    Encode a scalar exactly as ``json.dumps`` would, skipping its setup.
+    """
+    kind = value.__class__
+    if kind is str:
+        return _encodeString(value)
+    if kind is int:
+        return int.__repr__(value)
+    if kind is float and value - value == 0:
+        # Finite floats only; json spells out NaN and Infinity
+        return float.__repr__(value)
+    return codec.dumps(value)
+
+
+class EventHeader(object):
+    """
+    The record-level fields shared by all questions of one event.
+    """
+
+    __slots__ = ('studentId', 'classroomId', 'assessmentId', 'assessmentType',
+                 'learnositySessionId', 'learnosityUserId', 'assessmentAttempt',
+                 'courseOfferingId', 'eventSubmitTime', 'assessmentStartTime',
+                 'assessmentEndTime', 'fragments')
+
+    def __init__(self, studentId, classroomId, assessmentId, assessmentType,
+                 learnositySessionId, learnosityUserId, assessmentAttempt,
+                 courseOfferingId, eventSubmitTime, assessmentStartTime,
+                 assessmentEndTime):
+        self.studentId = _intern(studentId)
+        self.classroomId = _intern(classroomId)
+        self.assessmentId = _intern(assessmentId)
+        self.assessmentType = _intern(assessmentType)
+        self.learnositySessionId = learnositySessionId
+        self.learnosityUserId = _intern(learnosityUserId)
+        self.assessmentAttempt = assessmentAttempt
+        self.courseOfferingId = _intern(courseOfferingId)
+        self.eventSubmitTime = eventSubmitTime
+        self.assessmentStartTime = assessmentStartTime
+        self.assessmentEndTime = assessmentEndTime
+        self.fragments = None
+
+    def fields(self):
+        return tuple(getattr(self, name) for name in self.__slots__[:-1])
+
+    def __eq__(self, other):
+        return isinstance(other, EventHeader) and self.fields() == other.fields()
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'EventHeader%r' % (self.fields(),)
+
+    def __getstate__(self):
+        # Fragments are rebuilt on demand rather than shipped to or from workers
+        return self.fields()
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+        self.fragments = None
+
+    def encodeFragments(self):
+        """
+        Encode, once, the JSON around the per-question values of a row.
+        """
+        self.fragments = (
+            '{"question": {"studentId": %s, "questionId": ' % encodeValue(self.studentId),
+            ', "classroomId": %s, "assessmentId": %s, "assessmentType": %s}, '
+            '"learnositySessionId": %s, "learnosityUserId": %s, "assessmentAttempt": %s, '
+            '"courseOfferingId": %s, "eventSubmitTime": %s, "assessmentStartTime": %s, '
+            '"assessmentEndTime": %s, "questionType": '
+            % tuple(encodeValue(value) for value in self.fields()[1:]),
+        )
+        return self.fragments
+
+
+def toItem(row):
+    """
+    Expand a row into the item dict it stands for; error items pass through.
+    """
+    if row.__class__ is not tuple:
+        return row
+    header, questionId, sequenceNumber, score, maxScore, questionType, itemReference = row
+    return {
+        "question": {
+            "studentId": header.studentId,
+            "questionId": questionId,
+            "sequenceNumber": sequenceNumber,
+            "score": score,
+            "maxScore": maxScore,
+            "classroomId": header.classroomId,
+            "assessmentId": header.assessmentId,
+            "assessmentType": header.assessmentType
+        },
+        "learnositySessionId": header.learnositySessionId,
+        "learnosityUserId": header.learnosityUserId,
+        "assessmentAttempt": header.assessmentAttempt,
+        "courseOfferingId": header.courseOfferingId,
+        "eventSubmitTime": header.eventSubmitTime,
+        "assessmentStartTime": header.assessmentStartTime,
+        "assessmentEndTime": header.assessmentEndTime,
+        "questionType": questionType,
+        "itemReference": itemReference,
+        "error": {"code": 0, "message": ""}
+    }
+
+
+def encodeItem(item):
+    """
+    Serialize a row or an error item, identically to ``json.dumps(toItem(item))``.
+    """
+    if item.__class__ is not tuple:
+        return codec.dumps(item)
+    header, questionId, sequenceNumber, score, maxScore, questionType, itemReference = item
+    fragments = header.fragments or header.encodeFragments()
+    return ''.join((fragments[0], encodeValue(questionId),
+                    ', "sequenceNumber": ', encodeValue(sequenceNumber),
+                    ', "score": ', encodeValue(score),
+                    ', "maxScore": ', encodeValue(maxScore),
+                    fragments[1], encodeValue(questionType),
+                    ', "itemReference": ', encodeValue(itemReference), _TAIL))
+
+
+def encodeArray(items):
+    """
+    Serialize a list of items as ``json.dumps`` would the list of their dicts.
+    """
+    return '[%s]' % ', '.join([encodeItem(item) for item in items])
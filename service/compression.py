@@ -0,0 +1,185 @@
+"""
+Content-Encoding of request bodies and Accept-Encoding negotiated compression
+of responses.
+
+gzip and deflate use the stdlib; zstd is offered when the optional
+`zstandard` package is installed. Request bodies are decompressed a chunk at a
+time into a spooled file and rejected once they grow past
+`config.MAX_DECOMPRESSED_BYTES`, so a small body cannot expand without bound.
+Streamed responses are flushed after every chunk, so clients still receive
+items as they are produced.
+"""
+import gzip
+import tempfile
+import zlib
+from service import config
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class UnsupportedEncoding(ValueError):
+    pass
+
+
+class BodyTooLarge(ValueError):
+    pass
+
+
+class MalformedBody(ValueError):
+    pass
+
+
+# What the decompressors raise on a corrupt or truncated body
+_CORRUPT = (OSError, EOFError, zlib.error) + ((zstandard.ZstdError,) if zstandard is not None else ())
+
+
+def supportedEncodings():
+    # Server preference when a client accepts several equally
+    encodings = ('zstd', 'gzip', 'deflate') if zstandard is not None else ('gzip', 'deflate')
+    return encodings if config.COMPRESSION_LEVEL > 0 else ()
+
+
+#####################################################################
+#
+# Request bodies
+#
+#####################################################################
+
+
+class _DeflateReader(object):
+    """
+    File-like reader over a deflate stream, with or without the zlib header.
+    """
+
+    def __init__(self, raw):
+        self.raw = raw
+        head = raw.read(2)
+        raw.seek(-len(head), 1)
+        # RFC 1950 header: compression method 8 and a check value
+        zlibHeader = len(head) == 2 and head[0] & 0x0f == 8 and (head[0] << 8 | head[1]) % 31 == 0
+        self.inflater = zlib.decompressobj(zlib.MAX_WBITS if zlibHeader else -zlib.MAX_WBITS)
+
+    def read(self, size):
+        output = b''
+        while not output and not self.inflater.eof:
+            data = self.inflater.unconsumed_tail or self.raw.read(config.READ_CHUNK_SIZE)
+            if not data:
+                raise EOFError('Compressed body ended early')
+            output = self.inflater.decompress(data, size)
+        return output
+
+
+def _reader(raw, coding):
+    if coding in ('gzip', 'x-gzip'):
+        return gzip.GzipFile(fileobj=raw, mode='rb')
+    if coding == 'deflate':
+        return _DeflateReader(raw)
+    if coding == 'zstd' and zstandard is not None:
+        return zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True)
+    raise UnsupportedEncoding('Unsupported Content-Encoding: %s' % coding)
+
+
+def decodeBody(body, contentEncoding):
+    """
+    Return a seekable stream of `body` with its Content-Encoding undone.
+    """
+    codings = [c.strip().lower() for c in contentEncoding.split(',')]
+    for coding in reversed([c for c in codings if c and c != 'identity']):
+        body = _decodeOne(body, coding)
+    return body
+
+
+def _decodeOne(body, coding):
+    reader = _reader(body, coding)
+    output = tempfile.SpooledTemporaryFile(config.DECOMPRESS_SPOOL_SIZE)
+    limit = config.MAX_DECOMPRESSED_BYTES
+    size = 0
+    try:
+        while True:
+            # Never ask for more than one byte past the limit
+            chunk = reader.read(min(config.READ_CHUNK_SIZE, limit - size + 1))
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > limit:
+                raise BodyTooLarge('Decompressed body exceeds %d bytes' % limit)
+            output.write(chunk)
+    except _CORRUPT as e:
+        output.close()
+        raise MalformedBody('Malformed %s body: %s' % (coding, e))
+    except BaseException:
+        output.close()
+        raise
+    output.seek(0)
+    return output
+
+
+#####################################################################
+#
+# Responses
+#
+#####################################################################
+
+
+def negotiate(acceptEncoding):
+    """
+    Pick the response coding from an Accept-Encoding header, or None.
+    """
+    quality = {}
+    for entry in (acceptEncoding or '').split(','):
+        params = entry.split(';')
+        q = 1.0
+        for param in params[1:]:
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        quality[params[0].strip().lower()] = q
+
+    best = None
+    for coding in supportedEncodings():
+        q = quality.get(coding, quality.get('*', 0.0))
+        if q > 0 and (best is None or q > quality.get(best, quality.get('*', 0.0))):
+            best = coding
+    return best
+
+
+class _Compressor(object):
+
+    def __init__(self, coding):
+        if coding == 'zstd':
+            self.compressor = zstandard.ZstdCompressor(level=config.ZSTD_LEVEL).compressobj()
+            self.sync = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        else:
+            wbits = 16 + zlib.MAX_WBITS if coding == 'gzip' else zlib.MAX_WBITS
+            self.compressor = zlib.compressobj(config.COMPRESSION_LEVEL, zlib.DEFLATED, wbits)
+            self.sync = zlib.Z_SYNC_FLUSH
+
+    def chunk(self, data):
+        return self.compressor.compress(data) + self.compressor.flush(self.sync)
+
+    def finish(self):
+        return self.compressor.flush()
+
+
+def compress(data, coding):
+    compressor = _Compressor(coding)
+    return compressor.compressor.compress(data) + compressor.finish()
+
+
+def iterCompressed(chunks, coding):
+    """
+    Compress a stream of byte chunks, flushing after each one.
+    """
+    compressor = _Compressor(coding)
+    try:
+        for chunk in chunks:
+            yield compressor.chunk(chunk)
+        yield compressor.finish()
+    finally:
+        chunks.close()
@@ -0,0 +1,219 @@
+"""
+Runtime configuration for the unwind service.
+
+Every setting can be overridden from the environment so the same image can be
+tuned per deployment without code changes.
+"""
+import os
+
+
+def _flag(name, default=False):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def _int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+# Parse the request body element by element instead of loading it whole
+STREAM_REQUEST = _flag('BKT_STREAM_REQUEST')
+
+# Bytes read from the request body per chunk in streaming mode
+READ_CHUNK_SIZE = _int('BKT_READ_CHUNK_SIZE', 64 * 1024)
+
+# Return the unwound array as a generator written out as items are produced
+STREAM_RESPONSE = _flag('BKT_STREAM_RESPONSE')
+
+# Bytes buffered before each chunk of a streamed response is written
+WRITE_CHUNK_SIZE = _int('BKT_WRITE_CHUNK_SIZE', 64 * 1024)
+
+# Worker processes used to unwind large batches; 0 keeps all work inline
+POOL_WORKERS = _int('BKT_POOL_WORKERS', 0)
+
+# Batches with fewer records than this are unwound inline
+POOL_THRESHOLD = _int('BKT_POOL_THRESHOLD', 2000)
+
+# Records sent to a worker per task
+POOL_SHARD_SIZE = _int('BKT_POOL_SHARD_SIZE', 250)
+
+# multiprocessing start method for pool workers
+POOL_START_METHOD = os.environ.get('BKT_POOL_START_METHOD', 'spawn')
+
+# Server used by `python -m service.unwind_array`: waitress, prefork or wsgiref
+SERVER = os.environ.get('BKT_SERVER', 'waitress')
+
+HOST = os.environ.get('BKT_HOST', '0.0.0.0')
+PORT = _int('BKT_PORT', 9998)
+
+# Request-handling threads per server process
+SERVER_THREADS = _int('BKT_SERVER_THREADS', 8)
+
+# Pending connections the listening socket queues before refusing
+SERVER_BACKLOG = _int('BKT_SERVER_BACKLOG', 1024)
+
+# Open client connections, keep-alive included, before accepts are paused
+SERVER_CONNECTION_LIMIT = _int('BKT_SERVER_CONNECTION_LIMIT', 100)
+
+# Seconds an idle connection, keep-alive included, is held open
+SERVER_CHANNEL_TIMEOUT = _int('BKT_SERVER_CHANNEL_TIMEOUT', 120)
+
+# Largest request body accepted, in bytes
+SERVER_MAX_BODY = _int('BKT_SERVER_MAX_BODY', 1024 * 1024 * 1024)
+
+# Seconds to wait for in-flight requests to finish on shutdown
+SERVER_DRAIN_TIMEOUT = _int('BKT_SERVER_DRAIN_TIMEOUT', 30)
+
+# Processes forked by the prefork server; 0 means one per CPU
+PREFORK_WORKERS = _int('BKT_PREFORK_WORKERS', 0)
+
+# Give each prefork worker its own SO_REUSEPORT socket instead of sharing one
+PREFORK_REUSEPORT = _flag('BKT_PREFORK_REUSEPORT')
+
+# Recycle a server process after this many requests; 0 disables
+MAX_REQUESTS = _int('BKT_MAX_REQUESTS', 0)
+
+# Recycle a server process once its resident memory exceeds this many bytes
+MAX_RSS = _int('BKT_MAX_RSS', 0)
+
+# Unwinds the ASGI app runs at once; further requests wait for a slot
+ASGI_CONCURRENCY = _int('BKT_ASGI_CONCURRENCY', os.cpu_count() or 1)
+
+# Request bytes the ASGI app buffers in memory before spilling to disk
+ASGI_SPOOL_SIZE = _int('BKT_ASGI_SPOOL_SIZE', 1024 * 1024)
+
+# JSON decoding backend: auto picks the fastest installed, json forces stdlib
+JSON_BACKEND = os.environ.get('BKT_JSON_BACKEND', 'auto')
+
+# JSONL file sampled request bodies are appended to; empty disables capture
+CAPTURE_FILE = os.environ.get('BKT_CAPTURE_FILE', '')
+
+# Fraction of unwind requests captured
+CAPTURE_RATE = float(os.environ.get('BKT_CAPTURE_RATE') or 0.01)
+
+# Bodies larger than this many bytes are never captured
+CAPTURE_MAX_BYTES = _int('BKT_CAPTURE_MAX_BYTES', 10 * 1024 * 1024)
+
+# Captured bodies queued for the writer before further samples are dropped
+CAPTURE_QUEUE_SIZE = _int('BKT_CAPTURE_QUEUE_SIZE', 64)
+
+# Log file written by the background log writer
+LOG_FILE = os.environ.get('BKT_LOG_FILE', 'bkt_outcome_unwind.log')
+LOG_LEVEL = os.environ.get('BKT_LOG_LEVEL', 'INFO')
+
+# Rotate the log once it reaches this many bytes; 0 disables size rotation
+LOG_MAX_BYTES = _int('BKT_LOG_MAX_BYTES', 0)
+
+# Rotate the log on this schedule instead (a TimedRotatingFileHandler `when`,
+# e.g. midnight or H); takes precedence over LOG_MAX_BYTES
+LOG_ROTATE_WHEN = os.environ.get('BKT_LOG_ROTATE_WHEN', '')
+
+# Rotated log files kept
+LOG_BACKUPS = _int('BKT_LOG_BACKUPS', 5)
+
+# Log records queued for the writer thread
+LOG_QUEUE_SIZE = _int('BKT_LOG_QUEUE_SIZE', 10000)
+
+# What a full log queue does to the logging thread: drop the record or block
+LOG_QUEUE_POLICY = os.environ.get('BKT_LOG_QUEUE_POLICY', 'drop')
+
+# The writer flushes after this many records or this many seconds, whichever
+# comes first
+LOG_BATCH_SIZE = _int('BKT_LOG_BATCH_SIZE', 256)
+LOG_FLUSH_INTERVAL = float(os.environ.get('BKT_LOG_FLUSH_INTERVAL') or 1.0)
+
+# Shared secret for the /admin routes, sent as X-Admin-Token; empty disables them
+ADMIN_TOKEN = os.environ.get('BKT_ADMIN_TOKEN', '')
+
+# Directory that profiles are written to
+PROFILE_DIR = os.environ.get('BKT_PROFILE_DIR', 'profiles')
+
+# Length of a sampling window, in seconds, and the time between samples
+PROFILE_SECONDS = float(os.environ.get('BKT_PROFILE_SECONDS') or 30.0)
+PROFILE_INTERVAL = float(os.environ.get('BKT_PROFILE_INTERVAL') or 0.005)
+
+# Fraction of unwind requests whose CPU time is measured and reported in
+# response headers and the request log line
+ACCOUNTING_RATE = float(os.environ.get('BKT_ACCOUNTING_RATE') or 1.0)
+
+# Fraction of those whose peak Python allocation is traced as well; tracing
+# slows every thread down while it runs, so keep this low
+ACCOUNTING_MEMORY_RATE = float(os.environ.get('BKT_ACCOUNTING_MEMORY_RATE') or 0.0)
+
+# Largest request body accepted after Content-Encoding is undone, in bytes
+MAX_DECOMPRESSED_BYTES = _int('BKT_MAX_DECOMPRESSED_BYTES', 512 * 1024 * 1024)
+
+# Decompressed bytes held in memory before the body spills to a temporary file
+DECOMPRESS_SPOOL_SIZE = _int('BKT_DECOMPRESS_SPOOL_SIZE', 4 * 1024 * 1024)
+
+# Response compression levels for gzip/deflate (0 turns them off) and zstd
+COMPRESSION_LEVEL = _int('BKT_COMPRESSION_LEVEL', 1)
+ZSTD_LEVEL = _int('BKT_ZSTD_LEVEL', 3)
+
+# Whole responses smaller than this are sent uncompressed
+COMPRESS_MIN_BYTES = _int('BKT_COMPRESS_MIN_BYTES', 1024)
+
+# Bytes of unwind results kept for retried requests; 0 (the default) turns
+# the cache off
+CACHE_MAX_BYTES = _int('BKT_CACHE_MAX_BYTES', 0)
+
+# Largest single result cached, in bytes
+CACHE_MAX_ENTRY_BYTES = _int('BKT_CACHE_MAX_ENTRY_BYTES', 16 * 1024 * 1024)
+
+# Seconds a cached result is served for
+CACHE_TTL = float(os.environ.get('BKT_CACHE_TTL') or 300.0)
+
+# Seconds an identical request waits for the first one before unwinding itself
+CACHE_WAIT_TIMEOUT = float(os.environ.get('BKT_CACHE_WAIT_TIMEOUT') or 60.0)
+
+# Largest unwind request body accepted, in bytes, before and after
+# Content-Encoding is undone; 0 leaves only SERVER_MAX_BODY
+MAX_BODY_BYTES = _int('BKT_MAX_BODY_BYTES', 256 * 1024 * 1024)
+
+# Events and unwound items allowed in one batch; 0 means no limit
+MAX_BATCH_RECORDS = _int('BKT_MAX_BATCH_RECORDS', 0)
+MAX_BATCH_ITEMS = _int('BKT_MAX_BATCH_ITEMS', 0)
+
+# Request body bytes a process unwinds at once before shedding requests with
+# a 429; 0 turns shedding off
+INFLIGHT_BUDGET_BYTES = _int('BKT_INFLIGHT_BUDGET_BYTES', 512 * 1024 * 1024)
+
+# Seconds a shed client is told to wait before retrying
+RETRY_AFTER = _int('BKT_RETRY_AFTER', 1)
+
+# Fraction of the in-flight budget in use at which /ready reports not ready
+READY_THRESHOLD = float(os.environ.get('BKT_READY_THRESHOLD') or 0.9)
+
+# Batches a process unwinds at once, shared fairly across sensors or API
+# keys; 0 (the default) turns the fair scheduler off
+SCHEDULER_SLOTS = _int('BKT_SCHEDULER_SLOTS', 0)
+
+# Record field batches are scheduled by: sensorId or apiKey
+SCHEDULER_KEY = os.environ.get('BKT_SCHEDULER_KEY', 'sensorId')
+
+# Relative shares of keys, e.g. live-sensor=4,backfill=1; others get 1
+SCHEDULER_WEIGHTS = os.environ.get('BKT_SCHEDULER_WEIGHTS', '')
+
+# Body bytes per second and burst each key may send before its batches wait
+# behind every other key's; 0 gives no key a rate
+SCHEDULER_RATE = _int('BKT_SCHEDULER_RATE', 0)
+SCHEDULER_BURST = _int('BKT_SCHEDULER_BURST', 0)
+
+# Seconds a batch waits for a slot before it is shed with a 429
+SCHEDULER_WAIT_TIMEOUT = float(os.environ.get('BKT_SCHEDULER_WAIT_TIMEOUT') or 30.0)
+
+# Keys besides those in SCHEDULER_WEIGHTS that scheduler metrics are labelled
+# with; batches of any further key are counted under "other"
+SCHEDULER_METRIC_KEYS = _int('BKT_SCHEDULER_METRIC_KEYS', 100)
+
+# Seconds an unwound event is remembered so that copies of it resent in later
+# batches are dropped; 0 (the default) turns duplicate suppression off
+DEDUP_WINDOW = float(os.environ.get('BKT_DEDUP_WINDOW') or 0.0)
+
+# Events remembered per window, and the rate at which an event never seen
+# before is taken for a duplicate; together they size the filter's memory
+DEDUP_CAPACITY = _int('BKT_DEDUP_CAPACITY', 1000000)
+DEDUP_ERROR_RATE = float(os.environ.get('BKT_DEDUP_ERROR_RATE') or 1e-6)
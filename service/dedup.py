@@ -0,0 +1,182 @@
+"""
+Suppression of events resent across batches.
+
+Sensors resend the same OutcomeEvent in later batches. With
+`config.DEDUP_WINDOW` set, an unwound event whose `learnositySessionId`,
+`assessmentAttempt` and question references (the `questionId` and
+`itemReference` of each of its questions, in order) were already delivered is
+dropped from the response, as is a second copy within one batch, so no later
+stage receives it twice. Events that could not be unwound are never dropped,
+and the `recordIndex` of their error items still counts every record of the
+batch.
+
+An event only counts as delivered once its response has been produced in full
+with a 200 and the server has written all of it, streamed or not. A batch refused with a 413, cut short by a disconnect or failing
+part way remembers nothing, so retrying it returns every event. Two copies of
+an event in batches unwound at the same time may both be delivered. A batch
+answered from the result cache (service/cache.py) gets the response it got the
+first time; the cache serves byte-identical retries, and this module catches
+copies in other batches.
+
+Delivered events are remembered in two Bloom filters, one per generation: an
+event is a duplicate if either holds it. A delivered or dropped event is added
+to the current filter, which becomes the previous one every
+`config.DEDUP_WINDOW` seconds, or sooner once it holds `config.DEDUP_CAPACITY`
+events. So an event is remembered for one to two windows after it was last
+seen, and memory stays fixed. Each filter is sized for `config.DEDUP_CAPACITY`
+events at a false positive rate of `config.DEDUP_ERROR_RATE`; a false positive
+drops an event that was not a duplicate. The filter is per process.
+"""
+import hashlib
+import math
+import threading
+import time
+from service import config, grouped, metrics
+
+
+class BloomFilter(object):
+    """
+    A fixed-size set of 16-byte digests that may report false positives,
+    sized for `capacity` digests at a false positive rate of `errorRate`.
+    """
+
+    def __init__(self, capacity, errorRate):
+        capacity = max(capacity, 1)
+        self.size = max(int(math.ceil(-capacity * math.log(errorRate) / math.log(2) ** 2)), 8)
+        self.hashes = max(int(round(float(self.size) / capacity * math.log(2))), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, digest):
+        # Double hashing: k positions from the two halves of the digest
+        position = int.from_bytes(digest[:8], 'little')
+        step = int.from_bytes(digest[8:], 'little') | 1
+        size = self.size
+        for _ in range(self.hashes):
+            yield position % size
+            position += step
+
+    def __contains__(self, digest):
+        bits = self.bits
+        for p in self._positions(digest):
+            if not bits[p >> 3] & (1 << (p & 7)):
+                return False
+        return True
+
+    def add(self, digest):
+        """
+        Add `digest` and return whether it was already present.
+        """
+        bits = self.bits
+        present = True
+        for p in self._positions(digest):
+            mask = 1 << (p & 7)
+            if not bits[p >> 3] & mask:
+                bits[p >> 3] |= mask
+                present = False
+        if not present:
+            self.count += 1
+        return present
+
+
+class WindowedFilter(object):
+    """
+    Remembers digests for one to two `window`s of seconds, in two generations
+    of Bloom filter.
+    """
+
+    def __init__(self, window, capacity, errorRate):
+        self.window = window
+        self.capacity = capacity
+        self.errorRate = errorRate
+        self.lock = threading.Lock()
+        self.current = BloomFilter(capacity, errorRate)
+        self.previous = None
+        self.rotated = time.monotonic()
+
+    def holds(self, digest):
+        """
+        Return whether `digest` was added within the window.
+        """
+        with self.lock:
+            self._expire()
+            return digest in self.current or (self.previous is not None and digest in self.previous)
+
+    def add(self, digests):
+        """
+        Remember `digests`, e.g. those of a delivered response.
+        """
+        with self.lock:
+            for digest in digests:
+                self._expire()
+                self.current.add(digest)
+
+    def _expire(self):
+        if time.monotonic() - self.rotated >= self.window or self.current.count >= self.capacity:
+            self._rotate()
+
+    def _rotate(self):
+        now = time.monotonic()
+        # After a quiet spell of two windows nothing is left to remember
+        self.previous = self.current if now - self.rotated < 2 * self.window else None
+        self.current = BloomFilter(self.capacity, self.errorRate)
+        self.rotated = now
+
+
+def eventKey(header, rows):
+    """
+    The digest identifying an unwound event: its session, attempt and
+    question references.
+    """
+    identity = (header.learnositySessionId, header.assessmentAttempt,
+                [row[1] for row in rows], [row[6] for row in rows])
+    return hashlib.blake2b(repr(identity).encode('utf-8'), digest_size=16).digest()
+
+
+def suppress(items, seen, stats=None):
+    """
+    Drop the rows of events `seen` holds, and of repeats within `items`. The
+    digests of the events are left in `stats` for `RequestStats.finish` to
+    add to `seen` once the response is delivered, or added when `items` is
+    exhausted if there are no stats.
+    """
+    digests = set()
+    if stats is not None:
+        stats.dedup = seen
+        stats.digests = digests
+    for group in grouped.iterGroups(items):
+        if group.__class__ is not tuple:
+            yield group
+            continue
+        header, rows = group
+        digest = eventKey(header, rows)
+        if digest in digests or seen.holds(digest):
+            digests.add(digest)
+            metrics.DUPLICATES.inc()
+            metrics.DUPLICATE_ITEMS.inc(len(rows))
+            if stats is not None:
+                stats.duplicates += 1
+            continue
+        digests.add(digest)
+        for row in rows:
+            yield row
+    if stats is None:
+        seen.add(digests)
+
+
+_filter = None
+_filterLock = threading.Lock()
+
+
+def getFilter():
+    """
+    Return the process's duplicate filter, or None when suppression is off.
+    """
+    global _filter
+    if config.DEDUP_WINDOW <= 0:
+        return None
+    if _filter is None:
+        with _filterLock:
+            if _filter is None:
+                _filter = WindowedFilter(config.DEDUP_WINDOW, config.DEDUP_CAPACITY, config.DEDUP_ERROR_RATE)
+    return _filter
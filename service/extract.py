@@ -0,0 +1,103 @@
+"""
+Shape-specialized extractors for unwinding OutcomeEvents.
+
+Events differ only in which optional keys they carry (the attempt count and
+the submit, start and end times). For every such shape we generate and compile
+one unwinding function, once, and cache it. The generated code reads the
+record-level fields a single time per event and leaves only the per-question
+fields inside the loop, with the optional-key checks resolved at compile time.
+The functions return compact rows sharing one header per event (see
+service/compact.py).
+"""
+import sys
+from service.compact import EventHeader
+
+# (variable, container, key, default) for each optional field of an event
+OPTIONAL_FIELDS = (
+    ("assessmentAttempt", "obj", "count", "0"),
+    ("eventSubmitTime", "event", "eventTime", "None"),
+    ("assessmentStartTime", "obj", "startedAtTime", "None"),
+    ("assessmentEndTime", "obj", "endedAtTime", "None"),
+)
+
+_TEMPLATE = '''
+def unwind(event):
+    itemResults = event["generated"]["itemResults"]
+    if not itemResults:
+        return []
+
+    obj = event["object"]
+    group = event["group"]
+    studentId = event["actor"]["@id"]
+    classroomId = group["@id"]
+    assessmentId = obj["extensions"]["assessmentId"]
+    assessmentType = obj["extensions"]["assessmentType"]
+    learnositySessionId = obj["@id"]
+    learnosityUserId = group["extensions"]["contextId"]
+    courseOfferingId = group["extensions"]["CourseOfferingId"]
+%(optional)s
+    header = EventHeader(studentId, classroomId, assessmentId, assessmentType,
+                         learnositySessionId, learnosityUserId, assessmentAttempt,
+                         courseOfferingId, eventSubmitTime, assessmentStartTime,
+                         assessmentEndTime)
+
+    # Fields are read in the order the item dicts used to be built, so a bad
+    # question is reported the same way
+    result = []
+    for question in itemResults:
+        score = question["score"]
+        maxScore = question["max_score"]
+        questionId = question["question_reference"]
+        sequenceNumber = question["sequenceNumber"]
+        score = 0 if score is None or score <= 0 else score
+        maxScore = maxScore if maxScore is not None and maxScore > 0 else 0
+        questionType = question["question_type"]
+        if questionType.__class__ is str:
+            questionType = intern(questionType)
+        result.append((header, questionId, sequenceNumber, score, maxScore,
+                       questionType, question["item_reference"]))
+    return result
+'''
+
+_extractors = {}
+
+
+def shapeOf(event):
+    """
+    Return a tuple flagging which optional fields `event` carries.
+    """
+    obj = event.get("object") or ()
+    return (
+        "count" in obj,
+        "eventTime" in event,
+        "startedAtTime" in obj,
+        "endedAtTime" in obj,
+    )
+
+
+def compileExtractor(shape):
+    """
+    Generate the unwinding function for events of the given `shape`.
+    """
+    lines = []
+    for present, (variable, container, key, default) in zip(shape, OPTIONAL_FIELDS):
+        value = '%s["%s"]' % (container, key) if present else default
+        lines.append('    %s = %s' % (variable, value))
+
+    namespace = {"EventHeader": EventHeader, "intern": sys.intern}
+    source = _TEMPLATE % {"optional": "\n".join(lines)}
+    exec(compile(source, "<unwind extractor %r>" % (shape,), "exec"), namespace)
+    return namespace["unwind"]
+
+
+def extractorFor(event):
+    """
+    Return the cached unwinding function matching the shape of `event`.
+    """
+    shape = shapeOf(event)
+    try:
+        return _extractors[shape]
+    except KeyError:
+        # At most 16 shapes exist, so the cache needs no eviction. Two threads
+        # compiling the same shape at once is harmless.
+        return _extractors.setdefault(shape, compileExtractor(shape))
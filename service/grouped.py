@@ -0,0 +1,174 @@
+"""
+The grouped output shape: one header object per event with its questions as
+rows, instead of one flat item per question.
+
+Selected with ``?shape=grouped`` or an Accept profile, e.g.
+``Accept: application/json; profile="urn:bkt:unwind:grouped"``. A JSON
+response is a single document
+
+    {"schemaVersion": 1, "columns": [...], "events": [group, ...]}
+
+and an NDJSON response carries the same schema object on its first line and
+one group per line after it. A group is ``{"header": {...}, "rows": [[...]]}``
+with the row values in `columns` order, or the usual error item for an event
+that could not be unwound. `expand` and `expandLines` turn either back into
+the flat items; they depend on nothing else in the service so consumers can
+copy them.
+"""
+import json
+from service import codec
+from service.compact import encodeValue
+
+SCHEMA_VERSION = 1
+
+PROFILE = 'urn:bkt:unwind:grouped'
+
+# Header keys, in EventHeader slot order
+HEADER_FIELDS = ('studentId', 'classroomId', 'assessmentId', 'assessmentType',
+                 'learnositySessionId', 'learnosityUserId', 'assessmentAttempt',
+                 'courseOfferingId', 'eventSubmitTime', 'assessmentStartTime',
+                 'assessmentEndTime')
+
+COLUMNS = ('questionId', 'sequenceNumber', 'score', 'maxScore', 'questionType', 'itemReference')
+
+SCHEMA = {'schemaVersion': SCHEMA_VERSION, 'columns': list(COLUMNS)}
+
+_HEADER = '{%s}' % ', '.join('"%s": %%s' % name for name in HEADER_FIELDS)
+
+_ROW = '[%s]' % ', '.join(['%s'] * len(COLUMNS))
+
+_DOCUMENT = '{"schemaVersion": %d, "columns": %s, "events": ' % (SCHEMA_VERSION, codec.dumps(list(COLUMNS)))
+
+
+def iterGroups(items):
+    """
+    Collect consecutive rows of the same event into ``(header, rows)`` pairs;
+    error items pass through.
+    """
+    header = None
+    rows = None
+    for item in items:
+        if item.__class__ is tuple:
+            if item[0] is header:
+                rows.append(item)
+                continue
+            if rows:
+                yield header, rows
+            header = item[0]
+            rows = [item]
+        else:
+            if rows:
+                yield header, rows
+                header = rows = None
+            yield item
+    if rows:
+        yield header, rows
+
+
+def encodeGroup(group):
+    if group.__class__ is not tuple:
+        return codec.dumps(group)
+    header, rows = group
+    return '{"header": %s, "rows": [%s]}' % (
+        _HEADER % tuple([encodeValue(value) for value in header.fields()]),
+        ', '.join([_ROW % tuple([encodeValue(value) for value in row[1:]]) for row in rows]))
+
+
+def encodeDocument(items):
+    return '%s[%s]}' % (_DOCUMENT, ', '.join([encodeGroup(group) for group in iterGroups(items)]))
+
+
+def iterDocumentChunks(chunks):
+    """
+    Wrap the chunks of the JSON array of groups into the grouped document.
+    """
+    # The prefix goes out with the first chunk, so a batch that fails before
+    # anything is unwound still gets an error status
+    chunks = iter(chunks)
+    yield _DOCUMENT.encode('utf-8') + next(chunks)
+    for chunk in chunks:
+        yield chunk
+    yield b'}'
+
+
+def iterLines(chunks):
+    """
+    Prefix the NDJSON chunks of the groups with the schema line.
+    """
+    # As in iterDocumentChunks, nothing is yielded before the first group
+    chunks = iter(chunks)
+    yield (codec.dumps(SCHEMA) + '\n').encode('utf-8') + next(chunks, b'')
+    for chunk in chunks:
+        yield chunk
+
+
+#####################################################################
+#
+# Reference expander
+#
+#####################################################################
+
+
+def expandGroup(group, columns=COLUMNS):
+    """
+    Return the flat items of one decoded group.
+    """
+    if 'header' not in group:
+        return [group]
+    header = group['header']
+    items = []
+    for values in group['rows']:
+        row = dict(zip(columns, values))
+        items.append({
+            "question": {
+                "studentId": header["studentId"],
+                "questionId": row["questionId"],
+                "sequenceNumber": row["sequenceNumber"],
+                "score": row["score"],
+                "maxScore": row["maxScore"],
+                "classroomId": header["classroomId"],
+                "assessmentId": header["assessmentId"],
+                "assessmentType": header["assessmentType"]
+            },
+            "learnositySessionId": header["learnositySessionId"],
+            "learnosityUserId": header["learnosityUserId"],
+            "assessmentAttempt": header["assessmentAttempt"],
+            "courseOfferingId": header["courseOfferingId"],
+            "eventSubmitTime": header["eventSubmitTime"],
+            "assessmentStartTime": header["assessmentStartTime"],
+            "assessmentEndTime": header["assessmentEndTime"],
+            "questionType": row["questionType"],
+            "itemReference": row["itemReference"],
+            "error": {"code": 0, "message": ""}
+        })
+    return items
+
+
+def _checkSchema(schema):
+    if schema.get('schemaVersion') != SCHEMA_VERSION:
+        raise ValueError('Unsupported grouped schema version: %r' % schema.get('schemaVersion'))
+    return schema['columns']
+
+
+def expand(document):
+    """
+    Return the flat items of a decoded grouped JSON document.
+    """
+    columns = _checkSchema(document)
+    items = []
+    for group in document['events']:
+        items.extend(expandGroup(group, columns))
+    return items
+
+
+def expandLines(lines):
+    """
+    Return the flat items of grouped NDJSON, given its lines as str or bytes.
+    """
+    lines = iter(lines)
+    columns = _checkSchema(json.loads(next(lines)))
+    items = []
+    for line in lines:
+        if line.strip():
+            items.extend(expandGroup(json.loads(line), columns))
+    return items
@@ -0,0 +1,192 @@
+"""
+Incremental JSON parsing for large pipeline batches.
+
+The unwind endpoint receives one JSON array of events. Loading it with
+``json.loads`` keeps the raw bytes, the decoded text and the whole object tree
+alive at once, so peak memory grows with the batch. The helpers here read a
+binary stream in chunks and yield each top-level element as soon as it is
+complete, so peak memory follows the largest single event instead. The
+encoders do the same on the way out, writing the result as it is produced.
+
+Newline-delimited JSON (one document per line) is supported in both
+directions as well.
+"""
+import codecs
+import json
+import re
+from service import codec
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+_decoder = json.JSONDecoder()
+_whitespace = re.compile(r'[ \t\n\r]*')
+_numberTail = frozenset('0123456789+-.eE')
+
+# Characters of a literal or escape cut at the window edge before the decoder
+# reports an error, e.g. 'fals' or '\\u12'
+_LONGEST_CUT_TOKEN = 5
+
+
+class _TextBuffer(object):
+    """
+    Sliding window of decoded text over a binary stream.
+    """
+
+    def __init__(self, stream, chunkSize):
+        self.stream = stream
+        self.chunkSize = chunkSize
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.text = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self, minimum=1):
+        # Drop the consumed prefix, then read until at least `minimum` more
+        # characters are buffered or the stream is exhausted.
+        pending = self.text[self.pos:]
+        target = len(pending) + max(minimum, 1)
+        parts = [pending]
+        size = len(pending)
+        while not self.eof and size < target:
+            chunk = self.stream.read(self.chunkSize)
+            if chunk:
+                part = self.decoder.decode(chunk)
+            else:
+                part = self.decoder.decode(b'', True)
+                self.eof = True
+            parts.append(part)
+            size += len(part)
+        self.text = ''.join(parts)
+        self.pos = 0
+
+    def peek(self):
+        # Skip whitespace and return the next significant character, or ''
+        # at the end of the stream.
+        while True:
+            self.pos = _whitespace.match(self.text, self.pos).end()
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if self.eof:
+                return ''
+            self.fill()
+
+    def decodeValue(self):
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.text, self.pos)
+            except ValueError as e:
+                if self.eof or not _truncated(e, len(self.text)):
+                    raise
+                # Incomplete value: at least double the window before retrying
+                # so a large event is not re-parsed once per chunk.
+                self.fill(len(self.text) - self.pos)
+                continue
+            if not self.eof and (end == len(self.text) or self.text[end] in _numberTail):
+                # A number cut at the window edge may continue in the next chunk
+                self.fill()
+                continue
+            self.pos = end
+            return value
+
+
+def _truncated(error, length):
+    # Whether a decode error could be the window ending mid-value rather than
+    # malformed input: the error is within a token's length of the end, or a
+    # string runs on past it. Anything else fails without reading further.
+    return (length - getattr(error, 'pos', 0) <= _LONGEST_CUT_TOKEN
+            or getattr(error, 'msg', '').startswith('Unterminated string'))
+
+
+def iterArrayElements(stream, chunkSize=DEFAULT_CHUNK_SIZE):
+    """
+    Yield the elements of the JSON array read from the binary `stream`.
+
+    Raises ValueError if the document is not a well-formed array.
+    """
+    buf = _TextBuffer(stream, chunkSize)
+
+    if buf.peek() != '[':
+        raise ValueError('Expecting a JSON array at char %d' % buf.pos)
+    buf.pos += 1
+
+    if buf.peek() == ']':
+        buf.pos += 1
+    else:
+        while True:
+            yield buf.decodeValue()
+            delimiter = buf.peek()
+            buf.pos += 1
+            if delimiter == ']':
+                break
+            if delimiter != ',':
+                raise ValueError("Expecting ',' delimiter at char %d" % (buf.pos - 1))
+
+    if buf.peek():
+        raise ValueError('Extra data at char %d' % buf.pos)
+
+
+def iterJsonLines(stream):
+    """
+    Yield one decoded document per non-blank line of the binary `stream`.
+
+    Raises ValueError naming the line number of the first malformed line.
+    """
+    for number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            yield codec.loads(line)
+        except ValueError as e:
+            raise ValueError('Malformed JSON on line %d: %s' % (number, e))
+
+
+def iterArrayChunks(items, chunkSize=DEFAULT_CHUNK_SIZE, encode=None):
+    """
+    Yield the JSON array of `items` as UTF-8 chunks of about `chunkSize` bytes.
+
+    The concatenated output is identical to ``json.dumps(list(items))``. The
+    first item is written on its own so the client sees bytes immediately.
+    `encode` serializes one item and defaults to ``codec.dumps``.
+    """
+    encode = encode or codec.dumps
+    parts = ['[']
+    size = 1
+    separator = ''
+    flush = 0
+    for item in items:
+        text = encode(item)
+        parts.append(separator)
+        parts.append(text)
+        separator = ', '
+        size += len(text) + 2
+        if size >= flush:
+            yield ''.join(parts).encode('utf-8')
+            parts = []
+            size = 0
+            flush = chunkSize
+    parts.append(']')
+    yield ''.join(parts).encode('utf-8')
+
+
+def iterLineChunks(items, chunkSize=DEFAULT_CHUNK_SIZE, encode=None):
+    """
+    Yield `items` as newline-delimited JSON in UTF-8 chunks of about `chunkSize`
+    bytes, writing the first line on its own.
+    """
+    encode = encode or codec.dumps
+    parts = []
+    size = 0
+    flush = 0
+    for item in items:
+        text = encode(item)
+        parts.append(text)
+        parts.append('\n')
+        size += len(text) + 1
+        if size >= flush:
+            yield ''.join(parts).encode('utf-8')
+            parts = []
+            size = 0
+            flush = chunkSize
+    if parts:
+        yield ''.join(parts).encode('utf-8')
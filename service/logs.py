@@ -0,0 +1,167 @@
+"""
+Non-blocking, batched logging.
+
+Request threads only put log records on a bounded queue. A single writer
+thread takes them off in batches, writes them to a (size- or time-) rotating
+log file and flushes once per batch, so a log call costs a queue put rather
+than a synchronous file write under a lock shared by every thread. When the
+queue is full, records are dropped and counted, or the caller blocks, as
+LOG_QUEUE_POLICY chooses.
+"""
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+from service import config
+
+FORMAT = '%(levelname)s:%(asctime)s:%(message)s'
+DATEFMT = '%m/%d/%Y %I:%M:%S %p'
+
+_STOP = object()
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler that drops (and counts) records, or blocks, when full.
+    """
+
+    def __init__(self, queue, block=False):
+        super(BoundedQueueHandler, self).__init__(queue)
+        self.block = block
+        self.dropped = 0
+
+    def enqueue(self, record):
+        if self.block:
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _BatchFlush(object):
+    # Stream handlers flush after every record; defer that to the writer,
+    # which flushes once per batch.
+
+    def flush(self):
+        pass
+
+    def flushBatch(self):
+        logging.StreamHandler.flush(self)
+
+    def close(self):
+        self.flushBatch()
+        super(_BatchFlush, self).close()
+
+
+class BatchedRotatingFileHandler(_BatchFlush, logging.handlers.RotatingFileHandler):
+    pass
+
+
+class BatchedTimedRotatingFileHandler(_BatchFlush, logging.handlers.TimedRotatingFileHandler):
+    pass
+
+
+class BatchWriter(object):
+    """
+    Background thread moving records from the queue to the file handler.
+    """
+
+    def __init__(self, queue, handler, batchSize, flushInterval):
+        self.queue = queue
+        self.handler = handler
+        self.batchSize = batchSize
+        self.flushInterval = flushInterval
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='log-writer', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.put(_STOP)
+            self.thread.join()
+        self.thread = None
+
+    def run(self):
+        while True:
+            record = self.queue.get()
+            written = 0
+            deadline = time.time() + self.flushInterval
+            # Write until the batch is full, the queue stays empty past the
+            # flush interval, or we are told to stop
+            while record is not _STOP:
+                self.handler.handle(record)
+                written += 1
+                if written >= self.batchSize:
+                    break
+                try:
+                    record = self.queue.get(timeout=max(0, deadline - time.time()))
+                except queue.Empty:
+                    break
+            self.handler.flushBatch()
+            if record is _STOP:
+                return
+
+
+_writer = None
+_queueHandler = None
+
+
+def fileHandler():
+    if config.LOG_ROTATE_WHEN:
+        handler = BatchedTimedRotatingFileHandler(config.LOG_FILE, when=config.LOG_ROTATE_WHEN,
+                                                  backupCount=config.LOG_BACKUPS)
+    else:
+        handler = BatchedRotatingFileHandler(config.LOG_FILE, maxBytes=config.LOG_MAX_BYTES,
+                                             backupCount=config.LOG_BACKUPS)
+    handler.setFormatter(logging.Formatter(FORMAT, DATEFMT))
+    return handler
+
+
+def configure():
+    """
+    Route the root logger through the queue to the background writer.
+    """
+    global _writer, _queueHandler
+    if _writer is not None:
+        return
+
+    records = queue.Queue(config.LOG_QUEUE_SIZE)
+    _queueHandler = BoundedQueueHandler(records, block=config.LOG_QUEUE_POLICY == 'block')
+    _writer = BatchWriter(records, fileHandler(), config.LOG_BATCH_SIZE, config.LOG_FLUSH_INTERVAL)
+    _writer.start()
+
+    root = logging.getLogger()
+    root.addHandler(_queueHandler)
+    root.setLevel(config.LOG_LEVEL)
+
+    atexit.register(stop)
+    # Threads do not survive fork: pre-forked workers start their own writer
+    os.register_at_fork(after_in_child=_restartInChild)
+
+
+def _restartInChild():
+    # The parent's queue may have been locked mid-put by another thread
+    if _writer is not None and _writer.thread is not None:
+        records = queue.Queue(config.LOG_QUEUE_SIZE)
+        _queueHandler.queue = _writer.queue = records
+        _writer.start()
+
+
+def stop():
+    """
+    Write out everything queued and stop the writer thread.
+    """
+    if _writer is not None:
+        _writer.stop()
+        _writer.handler.close()
+
+
+def dropped():
+    return _queueHandler.dropped if _queueHandler is not None else 0
@@ -0,0 +1,203 @@
+"""
+In-process metrics exposed in the Prometheus text format on /metrics.
+
+Recording is a lock acquire and a few integer updates, cheap enough to leave
+on for every request. Metrics are per process: under the pre-fork server each
+worker reports its own, identified by the `pid` label on
+bkt_process_start_time_seconds.
+"""
+import bisect
+import os
+import threading
+import time
+from service import logs
+
+# Upper bounds for latency histograms, in seconds
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Upper bounds for payload size histograms, in bytes
+BYTES_BUCKETS = tuple(1024 * 4 ** n for n in range(11))
+
+
+def _formatLabels(names, values):
+    if not names:
+        return ''
+    pairs = ('%s="%s"' % (n, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+             for n, v in zip(names, values))
+    return '{%s}' % ','.join(pairs)
+
+
+def _formatValue(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return repr(value)
+    return str(value)
+
+
+class _Metric(object):
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labelNames = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def expose(self):
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s %s' % (self.name, self.type)]
+        with self.lock:
+            items = sorted(self.values.items())
+        for labels, value in items:
+            lines.extend(self.samples(labels, value))
+        return lines
+
+    def samples(self, labels, value):
+        return ['%s%s %s' % (self.name, _formatLabels(self.labelNames, labels), _formatValue(value))]
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, *labels):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def __init__(self, name, help, labels=(), function=None):
+        super(Gauge, self).__init__(name, help, labels)
+        self.function = function
+
+    def inc(self, amount=1, *labels):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def dec(self, amount=1, *labels):
+        self.inc(-amount, *labels)
+
+    def set(self, value, *labels):
+        with self.lock:
+            self.values[labels] = value
+
+    def expose(self):
+        # Gauges backed by a function are sampled at scrape time
+        if self.function is not None:
+            self.set(self.function())
+        return super(Gauge, self).expose()
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=SECONDS_BUCKETS):
+        super(Histogram, self).__init__(name, help, labels)
+        self.bounds = tuple(buckets)
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.bounds, value)
+        with self.lock:
+            state = self.values.get(labels)
+            if state is None:
+                state = self.values[labels] = [[0] * (len(self.bounds) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self, labels, state):
+        counts, total, count = state
+        names = self.labelNames + ('le',)
+        lines = []
+        cumulative = 0
+        for bound, n in zip(self.bounds + (float('inf'),), counts):
+            cumulative += n
+            lines.append('%s_bucket%s %d' % (self.name, _formatLabels(names, labels + (_formatValue(float(bound)),)), cumulative))
+        lines.append('%s_sum%s %s' % (self.name, _formatLabels(self.labelNames, labels), repr(total)))
+        lines.append('%s_count%s %d' % (self.name, _formatLabels(self.labelNames, labels), count))
+        return lines
+
+
+class Registry(object):
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def expose(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.expose())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+START_TIME = REGISTRY.register(Gauge(
+    'bkt_process_start_time_seconds', 'Start time of the process since the epoch.', ('pid',)))
+START_TIME.set(time.time(), os.getpid())
+
+REQUESTS = REGISTRY.register(Counter(
+    'bkt_unwind_requests_total', 'Unwind requests by response status.', ('status',)))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'bkt_unwind_request_seconds', 'Time spent handling an unwind request.'))
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'bkt_unwind_stage_seconds', 'Time spent in each stage of an unwind request.', ('stage',)))
+INFLIGHT = REGISTRY.register(Gauge(
+    'bkt_unwind_inflight_requests', 'Unwind requests currently being handled.'))
+RECORDS = REGISTRY.register(Counter(
+    'bkt_unwind_records_total', 'Events received for unwinding.'))
+ITEMS = REGISTRY.register(Counter(
+    'bkt_unwind_items_total', 'Unwound question items returned.'))
+REJECTED = REGISTRY.register(Counter(
+    'bkt_unwind_rejected_total', 'Events replaced by an error item.'))
+BYTES = REGISTRY.register(Counter(
+    'bkt_unwind_bytes_total', 'Payload bytes by direction.', ('direction',)))
+REQUEST_BYTES = REGISTRY.register(Histogram(
+    'bkt_unwind_request_bytes', 'Size of unwind request bodies.', buckets=BYTES_BUCKETS))
+CPU_SECONDS = REGISTRY.register(Histogram(
+    'bkt_unwind_cpu_seconds', 'CPU time of accounted unwind requests.'))
+MEMORY_PEAK = REGISTRY.register(Histogram(
+    'bkt_unwind_memory_peak_bytes', 'Peak traced allocation of memory-accounted unwind requests.',
+    buckets=BYTES_BUCKETS))
+CACHE_REQUESTS = REGISTRY.register(Counter(
+    'bkt_unwind_cache_requests_total', 'Result cache lookups by outcome: hit, miss or coalesced.', ('result',)))
+CACHE_EVICTIONS = REGISTRY.register(Counter(
+    'bkt_unwind_cache_evictions_total', 'Results evicted from the cache to stay within its size.'))
+CACHE_BYTES = REGISTRY.register(Gauge(
+    'bkt_unwind_cache_bytes', 'Approximate size of the cached results.'))
+SHED = REGISTRY.register(Counter(
+    'bkt_unwind_shed_total', 'Unwind requests turned away by admission control, by limit.', ('reason',)))
+INFLIGHT_BYTES = REGISTRY.register(Gauge(
+    'bkt_unwind_inflight_bytes', 'Request body bytes of the unwinds in flight.'))
+SCHEDULER_QUEUED = REGISTRY.register(Gauge(
+    'bkt_unwind_scheduler_queued', 'Batches waiting for an unwind slot, by scheduling key.', ('key',)))
+SCHEDULER_WAIT_SECONDS = REGISTRY.register(Histogram(
+    'bkt_unwind_scheduler_wait_seconds', 'Time batches waited for an unwind slot, by scheduling key.', ('key',)))
+SCHEDULER_THROTTLED = REGISTRY.register(Counter(
+    'bkt_unwind_scheduler_throttled_total', 'Batches over their key\'s rate, queued behind other keys.', ('key',)))
+DUPLICATES = REGISTRY.register(Counter(
+    'bkt_unwind_duplicates_total', 'Events dropped as copies of one seen within the dedup window.'))
+DUPLICATE_ITEMS = REGISTRY.register(Counter(
+    'bkt_unwind_duplicate_items_total', 'Unwound items of the events dropped as duplicates.'))
+LOG_DROPPED = REGISTRY.register(Gauge(
+    'bkt_log_dropped_records', 'Log records dropped because the log queue was full.',
+    function=logs.dropped))
+
+
+def _resetAfterFork():
+    # A forked worker starts with its own, empty metrics
+    for metric in REGISTRY.metrics:
+        metric.lock = threading.Lock()
+        metric.values = {}
+    START_TIME.set(time.time(), os.getpid())
+
+
+os.register_at_fork(after_in_child=_resetAfterFork)
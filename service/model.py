@@ -0,0 +1,92 @@
+"""
+Unwrapping of Caliper OutcomeEvents into one item per question.
+
+This module has no web-framework dependencies so it can be imported cheaply
+by pool workers and offline tools.
+"""
+import logging
+from service import compact, extract
+
+log = logging.getLogger(__name__)
+
+# Error codes reported on unwound items; 0 marks a successfully unwound question
+OK = 0
+LACKS_LEARNER_ROLE = 21
+MISSING_FIELD = 22
+MALFORMED_EVENT = 23
+
+
+class InternalAssertionError(Exception):
+    """
+    An event the model refuses to unwind, with the error code to report.
+    """
+
+    def __init__(self, message, code):
+        super(InternalAssertionError, self).__init__(message, code)
+        self.message = message
+        self.code = code
+
+#####################################################################
+#
+# Unwrapping Function
+#
+#####################################################################
+
+
+def scorelessthanone (score):
+    if score is None or score <= 0:
+        score = 0
+    else:
+        score = score
+
+    return score
+
+
+def applyModel(record):
+    # One item dict per question, expanded from the compact rows
+    return [compact.toItem(row) for row in applyModelRows(record)]
+
+
+def applyModelRows(record):
+    # Check incoming outcome event is a student event
+    if not any("learner" in role.lower() for role in record["event"]["actor"]["roles"]):
+        raise InternalAssertionError("Event lacks Learner role", LACKS_LEARNER_ROLE)
+
+    # Record-level fields are read once per event by the extractor
+    event = record["event"]
+    return extract.extractorFor(event)(event)
+
+
+def errorItem(index, code, message):
+    return {"recordIndex": index, "error": {"code": code, "message": message}}
+
+
+def unwindRecord(record, index):
+    # A failing record becomes a single error item so the rest of the batch
+    # is still unwound and upstream does not have to retry all of it.
+    try:
+        return applyModelRows(record)
+    except InternalAssertionError as e:
+        code, message = e.code, e.message
+    except KeyError as e:
+        code, message = MISSING_FIELD, 'Event is missing field %s' % e
+    except (TypeError, AttributeError, ValueError) as e:
+        code, message = MALFORMED_EVENT, 'Malformed event: %s' % e
+
+    log.debug('Rejected record %d with code %d: %s', index, code, message)
+    return [errorItem(index, code, message)]
+
+
+def unwindSerial(records, start=0):
+    # Lazily apply the Unwrapping Function to each record in turn
+    for index, record in enumerate(records, start):
+        for item in unwindRecord(record, index):
+            yield item
+
+
+def unwindShard(records, start=0):
+    # Worker-pool entry point: unwind a list of records in one call
+    result = []
+    for index, record in enumerate(records, start):
+        result.extend(unwindRecord(record, index))
+    return result
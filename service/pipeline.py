@@ -0,0 +1,624 @@
+"""
+The unwind pipeline operation, independent of any web framework.
+
+Both the bottle application (unwind_array.py) and the ASGI application
+(asgi.py) are thin adapters over `unwindBody`, so the two front ends cannot
+drift apart in how requests are parsed, unwound or serialized.
+"""
+import logging
+import random
+import time
+from service import accounting, admission, cache, capture, codec, columnar, compact, compression, config, dedup, grouped, jsonstream, metrics, model, pool, profiling, scheduler
+
+log = logging.getLogger(__name__)
+
+NDJSON = 'application/x-ndjson'
+
+READY_MESSAGE = 'BKT Outcome Unwind - ready to go!!!'
+
+# Sentinel for the end of an iterator being timed
+_END = object()
+
+
+class PipelineError(Exception):
+    """
+    A request the pipeline rejects, carrying the HTTP status to answer with
+    and any headers to send along.
+    """
+
+    def __init__(self, status, message, headers=()):
+        super(PipelineError, self).__init__(status, message)
+        self.status = status
+        self.message = message
+        self.headers = list(headers)
+
+
+class RequestStats(object):
+    """
+    Counters for one unwind request, logged as a single line when it ends.
+
+    Stage times are seconds spent decoding events, producing unwound items
+    (decoding included) and serializing them; the unwind stage is the
+    difference of the first two. CPU time and peak memory are only measured on
+    the sampled fraction of requests marked `accounted`. `reserved` is the
+    share of the in-flight budget held until the request ends,
+    `scheduled` the scheduler whose unwind slot it holds, and `duplicates`
+    the events dropped as resent. `digests` are the events seen, added to the
+    `dedup` filter only if the request succeeds.
+    """
+
+    __slots__ = ('started', 'format', 'records', 'items', 'rejected', 'duplicates',
+                 'bytesIn', 'bytesOut', 'status', 'duration',
+                 'decodeTime', 'itemsTime', 'encodeTime',
+                 'accounted', 'cpuTime', 'memoryPeak', 'tracing', 'cache', 'reserved',
+                 'scheduled', 'dedup', 'digests')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.format = 'json'
+        self.records = 0
+        self.items = 0
+        self.rejected = 0
+        self.duplicates = 0
+        self.bytesIn = 0
+        self.bytesOut = 0
+        self.status = None
+        self.duration = None
+        self.decodeTime = 0.0
+        self.itemsTime = 0.0
+        self.encodeTime = 0.0
+        self.accounted = random.random() < config.ACCOUNTING_RATE
+        self.cpuTime = 0.0
+        self.memoryPeak = None
+        self.tracing = (self.accounted and random.random() < config.ACCOUNTING_MEMORY_RATE
+                        and accounting.startMemoryTrace())
+        self.cache = None
+        self.reserved = None
+        self.scheduled = None
+        self.dedup = None
+        self.digests = None
+        metrics.INFLIGHT.inc()
+
+    def chargeCpu(self, since):
+        # CPU time of the calling thread since `since`
+        if self.accounted:
+            self.cpuTime += time.thread_time() - since
+
+    def finish(self, status):
+        # Events only count as delivered once the whole response is
+        if self.dedup is not None:
+            if status == 200:
+                self.dedup.add(self.digests)
+            self.dedup = self.digests = None
+        if self.scheduled is not None:
+            self.scheduled.release()
+            self.scheduled = None
+        if self.reserved is not None:
+            admission.release(self.reserved)
+            self.reserved = None
+        self.status = status
+        self.duration = time.perf_counter() - self.started
+        if self.tracing:
+            self.memoryPeak = accounting.stopMemoryTrace()
+            self.tracing = False
+        log.info('unwind status=%s format=%s records=%d items=%d rejected=%d duplicates=%d '
+                 'bytes_in=%d bytes_out=%d duration_ms=%.1f cpu_ms=%s peak_bytes=%s cache=%s',
+                 status, self.format, self.records, self.items, self.rejected, self.duplicates,
+                 self.bytesIn, self.bytesOut, 1000 * self.duration,
+                 '%.1f' % (1000 * self.cpuTime) if self.accounted else '-',
+                 self.memoryPeak if self.memoryPeak is not None else '-',
+                 self.cache or '-')
+        self.record()
+
+    def record(self):
+        metrics.INFLIGHT.dec()
+        metrics.REQUESTS.inc(1, str(self.status))
+        metrics.REQUEST_SECONDS.observe(self.duration)
+        metrics.STAGE_SECONDS.observe(self.decodeTime, 'decode')
+        metrics.STAGE_SECONDS.observe(max(self.itemsTime - self.decodeTime, 0.0), 'unwind')
+        metrics.STAGE_SECONDS.observe(self.encodeTime, 'encode')
+        metrics.RECORDS.inc(self.records)
+        metrics.ITEMS.inc(self.items)
+        metrics.REJECTED.inc(self.rejected)
+        metrics.BYTES.inc(self.bytesIn, 'in')
+        metrics.BYTES.inc(self.bytesOut, 'out')
+        metrics.REQUEST_BYTES.observe(self.bytesIn)
+        if self.accounted:
+            metrics.CPU_SECONDS.observe(self.cpuTime)
+        if self.memoryPeak is not None:
+            metrics.MEMORY_PEAK.observe(self.memoryPeak)
+
+
+def indexPage():
+    return '<pre>%s\nJSON codec: %s</pre>' % (READY_MESSAGE, codec.BACKEND)
+
+
+def screenRequest(contentLength):
+    """
+    Turn a request away on its Content-Length alone, before its body is read,
+    when it is over the body limit or the process has no room for it.
+    """
+    try:
+        admission.checkBody(contentLength)
+        admission.checkLoad(max(contentLength or 0, 0))
+    except (admission.TooLarge, admission.Overloaded) as e:
+        raise _admissionError(e)
+
+
+def _admissionError(e):
+    if isinstance(e, admission.Overloaded):
+        return PipelineError(429, str(e), [('Retry-After', '%d' % e.retryAfter)])
+    return PipelineError(413, str(e))
+
+
+def _admit(stats, size):
+    # Check the body against the limits and hold `size` bytes of the budget
+    try:
+        admission.checkBody(size)
+        if stats.reserved is None:
+            admission.reserve(size)
+        elif size > stats.reserved:
+            admission.grow(size - stats.reserved)
+        else:
+            return
+    except (admission.TooLarge, admission.Overloaded) as e:
+        raise _admissionError(e)
+    stats.reserved = size
+
+
+def unwindBody(body, contentType=None, accept=None, headers=None, shape=None,
+               contentEncoding=None, acceptEncoding=None):
+    """
+    Unwind the events in the seekable binary stream `body`.
+
+    Returns a ``(contentType, payload)`` pair where payload is either the whole
+    serialized response as a str or bytes, or an iterator of byte chunks.
+    Extra response headers are appended to the `headers` list when one is
+    given; without it the response is never compressed. `shape` is the
+    requested output shape, ``flat`` (the default) or ``grouped``.
+    """
+    # Profiling, when switched on, covers the whole request
+    profile = profiling.claimRequest()
+    if profile is not None:
+        return profiling.profileRequest(profile, _unwindRequest, body, contentType, accept, headers, shape,
+                                        contentEncoding, acceptEncoding)
+    return _unwindRequest(body, contentType, accept, headers, shape, contentEncoding, acceptEncoding)
+
+
+def _unwindRequest(body, contentType, accept, headers, shape, contentEncoding, acceptEncoding):
+    stats = RequestStats()
+    stats.bytesIn = body.seek(0, 2)
+    body.seek(0)
+
+    cpu = time.thread_time()
+    try:
+        _admit(stats, stats.bytesIn)
+        if contentEncoding:
+            body = _decodeBody(body, contentEncoding, stats)
+        responseType, payload = _unwindBody(body, contentType, accept, shape, stats)
+    except PipelineError as e:
+        stats.chargeCpu(cpu)
+        stats.finish(e.status)
+        raise
+    except Exception:
+        stats.chargeCpu(cpu)
+        stats.finish(500)
+        raise
+
+    coding = None
+    if headers is not None:
+        headers.append(('Vary', 'Accept-Encoding'))
+        if stats.cache:
+            headers.append(('X-Unwind-Cache', stats.cache))
+        coding = compression.negotiate(acceptEncoding)
+
+    if isinstance(payload, (str, bytes)):
+        if coding and len(payload) >= config.COMPRESS_MIN_BYTES:
+            started = time.perf_counter()
+            if isinstance(payload, str):
+                payload = payload.encode('utf-8')
+            payload = compression.compress(payload, coding)
+            stats.encodeTime += time.perf_counter() - started
+            headers.append(('Content-Encoding', coding))
+        stats.chargeCpu(cpu)
+        stats.bytesOut = len(payload)
+        # The events of a whole response are remembered once it is sent, not
+        # when the request is finished here
+        seen, digests = stats.dedup, stats.digests
+        stats.dedup = stats.digests = None
+        stats.finish(200)
+        # Only a response built whole can report its own cost
+        if headers is not None and stats.accounted:
+            headers.extend(accounting.responseHeaders(stats))
+        if seen is not None:
+            if isinstance(payload, str):
+                payload = payload.encode('utf-8')
+            if headers is not None:
+                headers.append(('Content-Length', '%d' % len(payload)))
+            payload = _rememberWhenSent(payload, seen, digests)
+        return responseType, payload
+
+    stats.chargeCpu(cpu)
+    if coding:
+        headers.append(('Content-Encoding', coding))
+        payload = compression.iterCompressed(payload, coding)
+    return responseType, _finishStream(payload, stats)
+
+
+def _decodeBody(body, contentEncoding, stats):
+    # Decompression counts as part of decoding the request
+    started = time.perf_counter()
+    try:
+        body = compression.decodeBody(body, contentEncoding)
+    except compression.UnsupportedEncoding as e:
+        raise PipelineError(415, str(e))
+    except compression.BodyTooLarge as e:
+        raise PipelineError(413, str(e))
+    except compression.MalformedBody as e:
+        raise PipelineError(400, str(e))
+    elapsed = time.perf_counter() - started
+    stats.decodeTime += elapsed
+    stats.itemsTime += elapsed
+
+    # The decompressed size is what the request really costs
+    size = body.seek(0, 2)
+    body.seek(0)
+    _admit(stats, size)
+    return body
+
+
+def _unwindBody(body, contentType, accept, shape, stats):
+    # Sample production traffic for replay when capture is enabled
+    capture.offer(body, contentType, accept)
+
+    # Newline-delimited JSON is negotiated separately in each direction
+    ndjsonIn = mediaType(contentType) == NDJSON
+    ndjsonOut = acceptsNdjson(accept)
+
+    if shape not in (None, '', 'flat', 'grouped'):
+        raise PipelineError(400, 'Unknown output shape: %s' % shape)
+    groupedOut = shape == 'grouped' or (not shape and acceptsProfile(accept, grouped.PROFILE))
+    # Columns are only offered for the flat shape
+    columnarOut = None if groupedOut else columnarFormat(accept)
+
+    results = cache.getCache()
+    if results is None:
+        return _unwind(body, ndjsonIn, ndjsonOut, groupedOut, columnarOut, stats)
+
+    # Retried and concurrent duplicate batches are answered from one unwind
+    result, flight = results.begin(cache.requestKey(body, ndjsonIn, ndjsonOut, groupedOut, columnarOut))
+    if result is not None:
+        stats.cache = 'hit'
+        stats.format = result.format
+        stats.records = result.records
+        stats.items = result.items
+        stats.rejected = result.rejected
+        return result.contentType, result.payload
+
+    stats.cache = 'miss'
+    try:
+        responseType, payload = _unwind(body, ndjsonIn, ndjsonOut, groupedOut, columnarOut, stats)
+    except BaseException:
+        flight.finish(None)
+        raise
+    if isinstance(payload, (str, bytes)):
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        flight.finish(cache.CachedResult(responseType, payload, stats.format,
+                                         stats.records, stats.items, stats.rejected))
+        return responseType, payload
+    return responseType, _cacheStream(payload, flight, responseType, stats)
+
+
+def _unwind(body, ndjsonIn, ndjsonOut, groupedOut, columnarOut, stats):
+    slots = scheduler.getScheduler()
+    if slots is not None:
+        _schedule(slots, body, ndjsonIn, stats)
+    records = _readRecords(body, ndjsonIn, stats)
+    items = unwindRecords(records, stats)
+    if columnarOut:
+        return _serializeColumnar(items, columnarOut, stats)
+    if groupedOut:
+        return _serializeGrouped(items, ndjsonOut, stats)
+    return _serialize(items, ndjsonOut, stats)
+
+
+def _schedule(slots, body, ndjsonIn, stats):
+    # Wait for the batch's turn before its body is decoded, so a queued batch
+    # holds only its bytes; the slot is held until the response is complete
+    try:
+        slots.acquire(scheduler.batchKey(_firstRecord(body, ndjsonIn)), stats.reserved or stats.bytesIn)
+    except scheduler.WaitTimeout as e:
+        raise PipelineError(429, str(e), [('Retry-After', '%d' % config.RETRY_AFTER)])
+    stats.scheduled = slots
+
+
+def _firstRecord(body, ndjsonIn):
+    # Decode only the first record to key the batch by; a body that is not
+    # well formed is reported when it is read in full
+    try:
+        if ndjsonIn:
+            records = jsonstream.iterJsonLines(body)
+        else:
+            records = jsonstream.iterArrayElements(body, config.READ_CHUNK_SIZE)
+        return next(records, None)
+    except ValueError:
+        return None
+    finally:
+        body.seek(0)
+
+
+def _cacheStream(chunks, flight, responseType, stats):
+    # Keep a copy of what is streamed and cache it once the stream completes
+    parts = []
+    size = 0
+    try:
+        for chunk in chunks:
+            if parts is not None:
+                size += len(chunk)
+                if size <= config.CACHE_MAX_ENTRY_BYTES:
+                    parts.append(chunk)
+                else:
+                    # Too large to keep; let any followers unwind it themselves
+                    parts = None
+                    flight.finish(None)
+            yield chunk
+    except BaseException:
+        flight.finish(None)
+        raise
+    finally:
+        chunks.close()
+    flight.finish(None if parts is None else cache.CachedResult(
+        responseType, b''.join(parts), stats.format, stats.records, stats.items, stats.rejected))
+
+
+def _readRecords(body, ndjsonIn, stats):
+    # Read JSON from previous pipeline operation
+    if ndjsonIn or config.STREAM_REQUEST:
+        if not body.read(1):
+            raise PipelineError(400, 'No data received')
+
+        # Records are parsed one at a time and released once unwound
+        body.seek(0)
+        if ndjsonIn:
+            return jsonstream.iterJsonLines(body)
+        return jsonstream.iterArrayElements(body, config.READ_CHUNK_SIZE)
+
+    data = body.read()
+
+    if not data:
+        raise PipelineError(400, 'No data received')
+
+    # Decoded straight from the bytes, without a str copy of the body
+    started = time.perf_counter()
+    records = codec.loads(data)
+    elapsed = time.perf_counter() - started
+    stats.decodeTime += elapsed
+    stats.itemsTime += elapsed
+
+    # A decoded batch can be refused before any of it is unwound
+    if isinstance(records, list):
+        _checkBatch(len(records), config.MAX_BATCH_RECORDS, 'records', 'events')
+    return records
+
+
+def _serialize(items, ndjsonOut, stats):
+    # One unwound item per line, always streamed
+    if ndjsonOut:
+        stats.format = 'ndjson'
+        return NDJSON, jsonstream.iterLineChunks(items, config.WRITE_CHUNK_SIZE, compact.encodeItem)
+
+    # Write each unwound item out as soon as it is produced
+    if config.STREAM_RESPONSE:
+        return 'application/json', jsonstream.iterArrayChunks(items, config.WRITE_CHUNK_SIZE, compact.encodeItem)
+
+    # Loop through each JSON record and apply the Unwrapping Function to it
+    result = list(items)
+
+    started = time.perf_counter()
+    payload = compact.encodeArray(result)
+    stats.encodeTime = time.perf_counter() - started
+    return 'application/json', payload
+
+
+def _serializeGrouped(items, ndjsonOut, stats):
+    # One header per event with its questions as rows, see service/grouped.py
+    groups = grouped.iterGroups(items)
+    if ndjsonOut:
+        stats.format = 'ndjson-grouped'
+        return ('%s; profile="%s"' % (NDJSON, grouped.PROFILE),
+                grouped.iterLines(jsonstream.iterLineChunks(groups, config.WRITE_CHUNK_SIZE, grouped.encodeGroup)))
+
+    stats.format = 'json-grouped'
+    responseType = 'application/json; profile="%s"' % grouped.PROFILE
+    if config.STREAM_RESPONSE:
+        return responseType, grouped.iterDocumentChunks(
+            jsonstream.iterArrayChunks(groups, config.WRITE_CHUNK_SIZE, grouped.encodeGroup))
+
+    result = list(items)
+
+    started = time.perf_counter()
+    payload = grouped.encodeDocument(result)
+    stats.encodeTime = time.perf_counter() - started
+    return responseType, payload
+
+
+def _serializeColumnar(items, format, stats):
+    # Arrow or Parquet columns, see service/columnar.py
+    stats.format = format
+    if format == 'arrow':
+        return columnar.ARROW, _columnarErrors(columnar.iterArrowChunks(items))
+
+    result = list(items)
+
+    started = time.perf_counter()
+    try:
+        payload = columnar.encodeParquet(result)
+    except columnar.ColumnTypeError as e:
+        raise PipelineError(406, str(e))
+    stats.encodeTime = time.perf_counter() - started
+    return columnar.PARQUET, payload
+
+
+def _columnarErrors(chunks):
+    try:
+        for chunk in chunks:
+            yield chunk
+    except columnar.ColumnTypeError as e:
+        raise PipelineError(406, str(e))
+    finally:
+        chunks.close()
+
+
+def _rememberWhenSent(payload, seen, digests):
+    # The server asks for more only once it has written the response; a
+    # response it gives up on is closed at the yield instead
+    yield payload
+    seen.add(digests)
+
+
+def _finishStream(chunks, stats):
+    # Count what is written and log the request once the stream ends
+    # Time spent producing chunks, not waiting for the server to send them
+    clock = time.perf_counter
+    produced = 0.0
+    status = 500
+    try:
+        while True:
+            started = clock()
+            cpu = time.thread_time()
+            chunk = next(chunks, None)
+            stats.chargeCpu(cpu)
+            produced += clock() - started
+            if chunk is None:
+                break
+            stats.bytesOut += len(chunk)
+            yield chunk
+        status = 200
+    except GeneratorExit:
+        # The client went away before the response was complete
+        status = 499
+        raise
+    except PipelineError as e:
+        status = e.status
+        raise
+    finally:
+        chunks.close()
+        stats.encodeTime = max(produced - stats.itemsTime, 0.0)
+        stats.finish(status)
+
+
+def unwindRecords(records, stats=None):
+    """
+    Lazily unwind `records` into compact rows and error items.
+    """
+    if stats is not None:
+        records = _countRecords(records, stats)
+
+    # Large batches are sharded across the worker pool when it is enabled
+    if config.POOL_WORKERS > 0:
+        items = pool.unwindParallel(records, config.POOL_THRESHOLD, config.POOL_SHARD_SIZE)
+    else:
+        items = model.unwindSerial(records)
+
+    # Events resent from earlier batches are dropped, see service/dedup.py
+    seen = dedup.getFilter()
+    if seen is not None:
+        items = dedup.suppress(items, seen, stats)
+
+    if stats is None:
+        return items
+    return _countItems(items, stats)
+
+
+def _countRecords(records, stats):
+    # Pulling the next record is where a streamed body gets decoded
+    clock = time.perf_counter
+    records = iter(records)
+    while True:
+        started = clock()
+        record = next(records, _END)
+        stats.decodeTime += clock() - started
+        if record is _END:
+            return
+        stats.records += 1
+        _checkBatch(stats.records, config.MAX_BATCH_RECORDS, 'records', 'events')
+        yield record
+
+
+def _countItems(items, stats):
+    clock = time.perf_counter
+    items = iter(items)
+    while True:
+        started = clock()
+        item = next(items, _END)
+        stats.itemsTime += clock() - started
+        if item is _END:
+            return
+        stats.items += 1
+        _checkBatch(stats.items, config.MAX_BATCH_ITEMS, 'items', 'unwound items')
+        # Unwound questions are compact rows; error items are dicts
+        if item.__class__ is not tuple:
+            stats.rejected += 1
+        yield item
+
+
+def _checkBatch(count, limit, reason, noun):
+    if limit and count > limit:
+        metrics.SHED.inc(1, reason)
+        raise PipelineError(413, 'Batch exceeds %d %s' % (limit, noun))
+
+
+def mediaType(header):
+    return (header or '').split(';', 1)[0].strip().lower()
+
+
+def acceptsProfile(accept, profile):
+    # True when any media range in the Accept header asks for `profile`
+    for entry in (accept or '').split(','):
+        for param in entry.split(';')[1:]:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'profile' and profile in value.strip().strip('"').split():
+                return True
+    return False
+
+
+def acceptQualities(accept):
+    # Media type to q-value for each entry of an Accept header
+    quality = {}
+    for entry in (accept or '').split(','):
+        params = entry.split(';')
+        q = 1.0
+        for param in params[1:]:
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        quality[mediaType(params[0])] = q
+    return quality
+
+
+def acceptsNdjson(accept):
+    # Prefer NDJSON only when the client ranks it at least as high as JSON
+    quality = acceptQualities(accept)
+    ndjson = quality.get(NDJSON, 0.0)
+    return ndjson > 0 and ndjson >= quality.get('application/json', 0.0)
+
+
+def columnarFormat(accept):
+    """
+    Return 'arrow' or 'parquet' when the client ranks one of them at least as
+    high as JSON and pyarrow is installed, else None.
+    """
+    if not columnar.available() or not accept:
+        return None
+    quality = acceptQualities(accept)
+    best = None
+    bestQuality = quality.get('application/json', 0.0)
+    for format in sorted(columnar.MEDIA_TYPES):
+        q = quality.get(columnar.MEDIA_TYPES[format], 0.0)
+        if q > 0 and q >= bestQuality and (best is None or q > bestQuality):
+            best, bestQuality = format, q
+    return best
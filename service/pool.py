@@ -0,0 +1,141 @@
+"""
+Process-pool unwinding for large batches.
+
+The unwind loop is pure Python and CPU bound, so within one process it runs on
+a single core. Batches above a size threshold are split into shards that are
+unwound by a shared pool of worker processes; results are yielded in the
+original record order. Records that fail to unwind become error items in the
+worker exactly as they do inline; any other exception is re-raised unchanged
+in the caller when its shard's results are reached. A worker that dies, e.g.
+killed for its memory, breaks the pool: it is replaced and the shards still
+in flight are submitted once more, so only a batch that breaks the new pool
+too fails.
+"""
+import collections
+import itertools
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from service import config, model
+
+_executor = None
+_lock = threading.Lock()
+
+
+def getExecutor():
+    # The pool is created on first use and shared by all request threads
+    global _executor
+    with _lock:
+        if _executor is None:
+            context = multiprocessing.get_context(config.POOL_START_METHOD)
+            _executor = ProcessPoolExecutor(config.POOL_WORKERS, mp_context=context)
+        return _executor
+
+
+def shutdown():
+    global _executor
+    with _lock:
+        if _executor is not None:
+            _executor.shutdown()
+            _executor = None
+
+
+def _discard(broken):
+    # Drop a broken pool, unless another request has already replaced it
+    global _executor
+    with _lock:
+        if _executor is broken:
+            _executor = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+class _InFlight(object):
+    """
+    Shards submitted to the pool, oldest first. When the pool breaks they are
+    all submitted again, once, to a new pool.
+    """
+
+    def __init__(self):
+        self.executor = getExecutor()
+        self.pending = collections.deque()
+        self.retried = False
+
+    def __len__(self):
+        return len(self.pending)
+
+    def submit(self, shard, start):
+        entry = [shard, start, None]
+        self.pending.append(entry)
+        try:
+            entry[2] = self.executor.submit(model.unwindShard, shard, start)
+        except BrokenProcessPool:
+            self.recover()
+
+    def result(self):
+        """
+        Return the unwound items of the oldest shard.
+        """
+        while True:
+            try:
+                items = self.pending[0][2].result()
+            except BrokenProcessPool:
+                self.recover()
+                continue
+            self.pending.popleft()
+            return items
+
+    def recover(self):
+        _discard(self.executor)
+        if self.retried:
+            raise BrokenProcessPool('A pool worker died twice while unwinding this batch')
+        self.retried = True
+        self.executor = getExecutor()
+        for entry in self.pending:
+            entry[2] = self.executor.submit(model.unwindShard, entry[0], entry[1])
+
+    def cancel(self):
+        for entry in self.pending:
+            if entry[2] is not None:
+                entry[2].cancel()
+
+
+def iterShards(records, size):
+    records = iter(records)
+    while True:
+        shard = list(itertools.islice(records, size))
+        if not shard:
+            return
+        yield shard
+
+
+def unwindParallel(records, threshold, shardSize):
+    """
+    Yield the unwound items of `records`, using the pool once at least
+    `threshold` records are available.
+    """
+    records = iter(records)
+    head = list(itertools.islice(records, threshold))
+    if len(head) < threshold:
+        # Small batches stay on the inline fast path
+        for item in model.unwindSerial(head):
+            yield item
+        return
+
+    window = 2 * config.POOL_WORKERS
+    pending = _InFlight()
+    try:
+        # Keep a bounded number of shards in flight so a streamed batch is not
+        # read into memory ahead of the workers.
+        start = 0
+        for shard in iterShards(itertools.chain(head, records), shardSize):
+            pending.submit(shard, start)
+            start += len(shard)
+            if len(pending) >= window:
+                for item in pending.result():
+                    yield item
+        while pending:
+            for item in pending.result():
+                yield item
+    finally:
+        pending.cancel()
@@ -0,0 +1,102 @@
+"""
+Pre-fork serving: one waitress process per core.
+
+The CPU-bound unwind work is limited to a single core per process by the GIL.
+The supervisor here imports the application once, binds the listening socket,
+then forks workers that inherit both and serve requests independently. Dead
+workers are replaced, and workers retire themselves (draining first) after
+MAX_REQUESTS requests or once they grow past MAX_RSS, to be replaced in turn.
+"""
+import logging
+import os
+import signal
+import socket
+import time
+from service import config, logs, server
+
+log = logging.getLogger(__name__)
+
+# Workers exiting sooner than this after starting are considered crashing
+MIN_WORKER_LIFETIME = 1.0
+
+
+def bindSocket(reusePort=False):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reusePort:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((config.HOST, config.PORT))
+    sock.listen(config.SERVER_BACKLOG)
+    sock.setblocking(False)
+    return sock
+
+
+def runWorker(app, sock):
+    # Child side of the fork: never returns into the supervisor's code
+    status = 1
+    try:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        if sock is None:
+            sock = bindSocket(reusePort=True)
+        server.serveWaitress(app, [sock], config.MAX_REQUESTS, config.MAX_RSS)
+        status = 0
+    except Exception:
+        log.exception('Worker %d failed', os.getpid())
+    finally:
+        logs.stop()
+        os._exit(status)
+
+
+def serve(app):
+    """
+    Fork and supervise workers serving `app` until SIGTERM or SIGINT.
+    """
+    count = config.PREFORK_WORKERS or os.cpu_count() or 1
+    # With SO_REUSEPORT each worker binds its own socket and the kernel
+    # balances connections; otherwise all workers accept on one shared socket.
+    sock = None if config.PREFORK_REUSEPORT else bindSocket()
+    workers = {}
+    stopping = []
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            runWorker(app, sock)
+        workers[pid] = time.time()
+
+    def stop(signum, frame):
+        if not stopping:
+            log.info('Received signal %d, stopping %d workers', signum, len(workers))
+            stopping.append(signum)
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    log.info('Supervisor %d starting %d workers on %s:%d', os.getpid(), count, config.HOST, config.PORT)
+    for _ in range(count):
+        spawn()
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        started = workers.pop(pid, None)
+        if started is None or stopping:
+            continue
+
+        log.info('Worker %d exited with status %d, replacing it', pid, status)
+        if time.time() - started < MIN_WORKER_LIFETIME:
+            # Back off rather than fork in a tight loop when workers crash
+            time.sleep(MIN_WORKER_LIFETIME)
+        if not stopping:
+            spawn()
+
+    if sock is not None:
+        sock.close()
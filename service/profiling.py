@@ -0,0 +1,290 @@
+"""
+On-demand profiling of the running service.
+
+Two profilers can be switched on without a restart, through the token-protected
+/admin/profile route or by sending the process SIGUSR2:
+
+* ``cprofile`` profiles the next N unwind requests deterministically and writes
+  one pstats file per request.
+* ``sample`` snapshots every thread's stack with `sys._current_frames` for a
+  time window and writes the counts as collapsed stacks, the input format of
+  flamegraph.pl and speedscope.
+
+Either can be limited to named threads. A request for another worker of the
+same pre-fork supervisor is left as a control file for that worker, which is
+then signalled to pick it up.
+"""
+import cProfile
+import collections
+import hmac
+import itertools
+import json
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+from service import config
+
+log = logging.getLogger(__name__)
+
+MODES = ('cprofile', 'sample')
+
+_lock = threading.Lock()
+_requestsLeft = 0
+_requestThreads = None
+_sampler = None
+_sequence = itertools.count(1)
+
+
+def _outputPath(kind, extension):
+    os.makedirs(config.PROFILE_DIR, exist_ok=True)
+    name = '%s-%d-%s-%d.%s' % (kind, os.getpid(), time.strftime('%Y%m%d-%H%M%S'), next(_sequence), extension)
+    return os.path.join(config.PROFILE_DIR, name)
+
+
+def _threadSelected(thread, threads):
+    return threads is None or thread.name in threads or str(thread.ident) in threads
+
+
+#####################################################################
+#
+# Deterministic profiling of the next N requests
+#
+#####################################################################
+
+
+def claimRequest():
+    """
+    Return a profiler for the current request if one is wanted, else None.
+    """
+    global _requestsLeft
+    if not _requestsLeft:
+        return None
+    with _lock:
+        if not _requestsLeft or not _threadSelected(threading.current_thread(), _requestThreads):
+            return None
+        _requestsLeft -= 1
+    return cProfile.Profile()
+
+
+def profileRequest(profile, function, *args):
+    """
+    Call the pipeline `function` under `profile`, including the iteration of a
+    streamed payload, and write the stats once the response is complete.
+    """
+    try:
+        profile.enable()
+    except ValueError:
+        # Python 3.12+ allows one active cProfile at a time per process
+        return function(*args)
+    try:
+        contentType, payload = function(*args)
+    except BaseException:
+        profile.disable()
+        _dumpStats(profile)
+        raise
+    profile.disable()
+
+    if isinstance(payload, (str, bytes)):
+        _dumpStats(profile)
+        return contentType, payload
+    return contentType, _profileStream(profile, payload)
+
+
+def _profileStream(profile, chunks):
+    try:
+        while True:
+            profile.enable()
+            try:
+                chunk = next(chunks, None)
+            finally:
+                profile.disable()
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        chunks.close()
+        _dumpStats(profile)
+
+
+def _dumpStats(profile):
+    path = _outputPath('cprofile', 'pstats')
+    profile.dump_stats(path)
+    log.info('Wrote request profile %s', path)
+
+
+#####################################################################
+#
+# Sampling profiler
+#
+#####################################################################
+
+
+class Sampler(threading.Thread):
+    """
+    Samples the stacks of the other threads every `interval` seconds for
+    `seconds`, then writes them to `path` as collapsed stacks.
+    """
+
+    def __init__(self, path, seconds, interval, threads=None):
+        super(Sampler, self).__init__(name='bkt-sampler', daemon=True)
+        self.path = path
+        self.seconds = seconds
+        self.interval = interval
+        self.threads = threads
+        self.stacks = collections.Counter()
+        self.samples = 0
+
+    def run(self):
+        deadline = time.monotonic() + self.seconds
+        while time.monotonic() < deadline:
+            self.sample()
+            time.sleep(self.interval)
+        self.write()
+
+    def sample(self):
+        own = threading.get_ident()
+        threads = dict((t.ident, t) for t in threading.enumerate())
+        for ident, frame in sys._current_frames().items():
+            thread = threads.get(ident)
+            if ident == own or thread is None or not _threadSelected(thread, self.threads):
+                continue
+            self.stacks[collapse(thread.name, frame)] += 1
+        self.samples += 1
+
+    def write(self):
+        with open(self.path, 'w') as output:
+            for stack, count in self.stacks.most_common():
+                output.write('%s %d\n' % (stack, count))
+        log.info('Wrote sampled profile %s (%d samples)', self.path, self.samples)
+
+
+def collapse(threadName, frame):
+    """
+    Render a stack root first, as semicolon separated frames.
+    """
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append('%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+        frame = frame.f_back
+    frames.append(threadName)
+    frames.reverse()
+    return ';'.join(frames)
+
+
+#####################################################################
+#
+# Control
+#
+#####################################################################
+
+
+def authorized(token):
+    """
+    Check an X-Admin-Token header value against the configured token.
+    """
+    expected = config.ADMIN_TOKEN.encode('utf-8')
+    return bool(expected) and hmac.compare_digest((token or '').encode('utf-8'), expected)
+
+
+def start(options):
+    """
+    Start profiling in this process as described by `options`, a mapping of
+    the /admin/profile query parameters.
+    """
+    global _requestsLeft, _requestThreads, _sampler
+    mode = options.get('mode') or 'cprofile'
+    if mode not in MODES:
+        raise ValueError('Unknown profiling mode: %s' % mode)
+    threads = options.get('thread')
+    threads = frozenset(threads.split(',')) if threads else None
+
+    with _lock:
+        if mode == 'cprofile':
+            _requestThreads = threads
+            _requestsLeft = int(options.get('requests') or 10)
+            return
+        if _sampler is not None and _sampler.is_alive():
+            raise ValueError('A sampling profile is already running')
+        _sampler = Sampler(_outputPath('sample', 'collapsed'),
+                           float(options.get('seconds') or config.PROFILE_SECONDS),
+                           float(options.get('interval') or config.PROFILE_INTERVAL),
+                           threads)
+        _sampler.start()
+
+
+def status():
+    try:
+        files = sorted(os.listdir(config.PROFILE_DIR))
+    except FileNotFoundError:
+        files = []
+    return {
+        'pid': os.getpid(),
+        'requests': _requestsLeft,
+        'sampling': _sampler is not None and _sampler.is_alive(),
+        'files': [name for name in files if not name.startswith('control-')],
+    }
+
+
+def control(options):
+    """
+    Start profiling in this process or, when `options` names another worker's
+    pid, hand the request to that worker. Returns the resulting status.
+    """
+    pid = int(options.get('pid') or os.getpid())
+    if pid == os.getpid():
+        start(options)
+        return status()
+
+    if not isSibling(pid):
+        raise ValueError('Process %d is not a worker of this service' % pid)
+    os.makedirs(config.PROFILE_DIR, exist_ok=True)
+    with open(_controlPath(pid), 'w') as output:
+        json.dump(dict(options), output)
+    os.kill(pid, signal.SIGUSR2)
+    return {'pid': pid, 'signalled': True}
+
+
+def isSibling(pid):
+    # Pre-fork workers share the supervisor as their parent
+    try:
+        with open('/proc/%d/stat' % pid) as stat:
+            fields = stat.read().rsplit(')', 1)[1].split()
+    except (OSError, IndexError):
+        return False
+    return int(fields[1]) == os.getppid() != 1
+
+
+def _controlPath(pid):
+    return os.path.join(config.PROFILE_DIR, 'control-%d.json' % pid)
+
+
+def _applyControl():
+    # A control file left by another worker, or a default sampling window
+    path = _controlPath(os.getpid())
+    try:
+        with open(path) as control:
+            options = json.load(control)
+        os.remove(path)
+    except (OSError, ValueError):
+        options = {'mode': 'sample'}
+    try:
+        start(options)
+    except ValueError as e:
+        log.warning('Profiling request ignored: %s', e)
+
+
+def _onSignal(signum, frame):
+    # Locks may be held by the interrupted code, so the work is done elsewhere
+    threading.Thread(target=_applyControl, name='bkt-profile-control', daemon=True).start()
+
+
+def installSignalHandler():
+    """
+    Start profiling on SIGUSR2. Only possible from the main thread.
+    """
+    if hasattr(signal, 'SIGUSR2') and threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGUSR2, _onSignal)
@@ -0,0 +1,211 @@
+"""
+Fair scheduling of unwind work across the sensors or API keys sending it.
+
+With `config.SCHEDULER_SLOTS` set, at most that many batches are unwound at
+once per process, and batches waiting for a slot are served weighted-fair
+across keys rather than first come, first served: each key's queue advances
+by its batch sizes divided by its weight, so one key backfilling a large
+history cannot starve the others. With equal weights and similar batches
+this is plain round robin.
+
+A key may also be given a token bucket of `config.SCHEDULER_RATE` body bytes
+per second. Batches within their key's rate are always served before
+batches over it, so bulk traffic only uses capacity interactive traffic
+leaves spare. A key's bucket is dropped once it has refilled, as a new one
+would start full anyway, so keys that stop sending cost no memory.
+
+Metrics are labelled by key for the keys given weights and the first
+`config.SCHEDULER_METRIC_KEYS` others; later keys are counted as ``other``,
+so keys sent by clients cannot grow the metrics without bound.
+"""
+import collections
+import threading
+import time
+from service import config, metrics
+
+
+class WaitTimeout(Exception):
+    pass
+
+
+def parseWeights(text):
+    """
+    Parse ``key=weight,key=weight`` into a dict.
+    """
+    weights = {}
+    for entry in (text or '').split(','):
+        key, _, weight = entry.rpartition('=')
+        if key.strip():
+            weights[key.strip()] = float(weight)
+    return weights
+
+
+class TokenBucket(object):
+    """
+    Refills at `rate` per second up to `burst`. A batch is within the rate if
+    the bucket is not empty when it arrives; its full cost is then taken, so a
+    large batch leaves the bucket in debt.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def full(self, now):
+        return self.tokens + (now - self.updated) * self.rate >= self.burst
+
+    def take(self, cost):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        conforming = self.tokens > 0
+        self.tokens -= cost
+        return conforming
+
+
+class _Waiter(object):
+
+    __slots__ = ('key', 'label', 'tier', 'tag', 'ready')
+
+    def __init__(self, key, label, tier, tag):
+        self.key = key
+        self.label = label
+        self.tier = tier
+        self.tag = tag
+        self.ready = threading.Event()
+
+
+class Scheduler(object):
+
+    def __init__(self, slots, rate=0, burst=0, weights=None, waitTimeout=None, metricKeys=100):
+        self.slots = slots
+        self.rate = rate
+        self.burst = burst or rate
+        self.weights = weights or {}
+        self.waitTimeout = waitTimeout
+        self.lock = threading.Lock()
+        self.busy = 0
+        self.queues = {}
+        self.buckets = {}
+        self.swept = time.monotonic()
+        self.metricKeys = metricKeys
+        self.labels = set()
+        # Start-time fair queueing: a batch's tag is when its key's previous
+        # batch finishes in virtual time, and the smallest tag waiting is
+        # served next
+        self.virtualTime = 0.0
+        self.finishTags = {}
+
+    def acquire(self, key, cost):
+        """
+        Wait for a slot to unwind a batch of `cost` bytes for `key`, then
+        return the seconds waited. Raises WaitTimeout if no slot came up in
+        time. Every acquired slot is given back with `release`.
+        """
+        with self.lock:
+            label = self._label(key)
+            tier = 0
+            if self.rate > 0:
+                self._sweep()
+                bucket = self.buckets.get(key)
+                if bucket is None:
+                    bucket = self.buckets[key] = TokenBucket(self.rate, self.burst)
+                if not bucket.take(cost):
+                    tier = 1
+                    metrics.SCHEDULER_THROTTLED.inc(1, label)
+
+            tag = max(self.virtualTime, self.finishTags.get(key, 0.0))
+            self.finishTags[key] = tag + float(cost) / self.weights.get(key, 1.0)
+            if self.busy < self.slots and not self.queues:
+                self.busy += 1
+                self.virtualTime = tag
+                metrics.SCHEDULER_WAIT_SECONDS.observe(0.0, label)
+                return 0.0
+
+            waiter = _Waiter(key, label, tier, tag)
+            self.queues.setdefault(key, collections.deque()).append(waiter)
+            metrics.SCHEDULER_QUEUED.inc(1, label)
+
+        started = time.perf_counter()
+        if not waiter.ready.wait(self.waitTimeout):
+            with self.lock:
+                # A slot may have been handed over just as the wait ran out
+                if not waiter.ready.is_set():
+                    self._dequeue(waiter)
+                    raise WaitTimeout('No unwind slot for %s within %g seconds' % (key, self.waitTimeout))
+        waited = time.perf_counter() - started
+        metrics.SCHEDULER_WAIT_SECONDS.observe(waited, label)
+        return waited
+
+    def release(self):
+        with self.lock:
+            self.busy -= 1
+            heads = [queue[0] for queue in self.queues.values()]
+            if heads:
+                waiter = min(heads, key=lambda w: (w.tier, w.tag))
+                self._dequeue(waiter)
+                self.virtualTime = max(self.virtualTime, waiter.tag)
+                self.busy += 1
+                waiter.ready.set()
+            # A key whose last batch finishes before the clock starts afresh
+            for key in [k for k, tag in self.finishTags.items() if tag <= self.virtualTime]:
+                del self.finishTags[key]
+
+    def _dequeue(self, waiter):
+        queue = self.queues[waiter.key]
+        queue.remove(waiter)
+        if not queue:
+            del self.queues[waiter.key]
+        metrics.SCHEDULER_QUEUED.dec(1, waiter.label)
+
+    def _label(self, key):
+        if key in self.weights or key in self.labels:
+            return key
+        if len(self.labels) < self.metricKeys:
+            self.labels.add(key)
+            return key
+        return 'other'
+
+    def _sweep(self):
+        # A bucket is full again within `burst / rate` seconds of its last
+        # use unless a large batch left it in debt, so sweep about that often
+        now = time.monotonic()
+        if now - self.swept < float(self.burst) / self.rate:
+            return
+        self.swept = now
+        for key in [k for k, bucket in self.buckets.items() if bucket.full(now)]:
+            del self.buckets[key]
+
+    def depths(self):
+        with self.lock:
+            return dict((key, len(queue)) for key, queue in self.queues.items())
+
+
+_scheduler = None
+_schedulerLock = threading.Lock()
+
+
+def getScheduler():
+    """
+    Return the process's scheduler, or None when scheduling is turned off.
+    """
+    global _scheduler
+    if config.SCHEDULER_SLOTS <= 0:
+        return None
+    if _scheduler is None:
+        with _schedulerLock:
+            if _scheduler is None:
+                _scheduler = Scheduler(config.SCHEDULER_SLOTS, config.SCHEDULER_RATE, config.SCHEDULER_BURST,
+                                       parseWeights(config.SCHEDULER_WEIGHTS), config.SCHEDULER_WAIT_TIMEOUT,
+                                       config.SCHEDULER_METRIC_KEYS)
+    return _scheduler
+
+
+def batchKey(record):
+    """
+    The key a batch is scheduled under, taken from its first record.
+    """
+    value = record.get(config.SCHEDULER_KEY) if isinstance(record, dict) else None
+    return value if isinstance(value, str) and value else '-'
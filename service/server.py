@@ -0,0 +1,175 @@
+"""
+Serving the bottle application in production.
+
+By default the app runs under waitress with a pool of request threads. On
+SIGTERM or SIGINT the server stops accepting connections, lets in-flight
+unwinds finish and flush, then exits. A process can also retire itself this
+way after serving a number of requests or outgrowing a memory ceiling, which
+the pre-fork supervisor (see prefork.py) uses to recycle workers.
+"""
+import _thread
+import logging
+import os
+import resource
+import signal
+import threading
+import time
+from bottle import run
+from service import config
+
+log = logging.getLogger(__name__)
+
+
+class InflightTracker(object):
+    """
+    WSGI middleware counting requests whose responses are still being written.
+
+    When `maxRequests` or `maxRss` (bytes) is exceeded the process sends itself
+    SIGTERM, once, to drain and exit.
+    """
+
+    def __init__(self, app, maxRequests=0, maxRss=0):
+        self.app = app
+        self.maxRequests = maxRequests
+        self.maxRss = maxRss
+        self.count = 0
+        self.served = 0
+        self.retiring = False
+        self.condition = threading.Condition()
+
+    def __call__(self, environ, start_response):
+        with self.condition:
+            self.count += 1
+        try:
+            result = self.app(environ, start_response)
+        except Exception:
+            self.finished()
+            raise
+        return _ClosingIterable(result, self.finished)
+
+    def finished(self):
+        with self.condition:
+            self.count -= 1
+            self.served += 1
+            self.condition.notify_all()
+            retire = not self.retiring and self.overLimit()
+            if retire:
+                self.retiring = True
+        if retire:
+            log.info('Retiring process %d after %d requests', os.getpid(), self.served)
+            os.kill(os.getpid(), signal.SIGTERM)
+
+    def overLimit(self):
+        if self.maxRequests and self.served >= self.maxRequests:
+            return True
+        return bool(self.maxRss) and currentRss() > self.maxRss
+
+    def wait(self, timeout):
+        # Block until no requests are in flight; returns False on timeout
+        deadline = time.time() + timeout
+        with self.condition:
+            while self.count > 0:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+
+class _ClosingIterable(object):
+
+    def __init__(self, iterable, callback):
+        self.iterable = iterable
+        self.callback = callback
+
+    def __iter__(self):
+        return iter(self.iterable)
+
+    def close(self):
+        try:
+            if hasattr(self.iterable, 'close'):
+                self.iterable.close()
+        finally:
+            callback, self.callback = self.callback, None
+            if callback is not None:
+                callback()
+
+
+def currentRss():
+    # Resident set size in bytes; falls back to the peak where /proc is missing
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except (IOError, OSError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def serveWaitress(app, sockets=None, maxRequests=0, maxRss=0):
+    from waitress import wasyncore
+    from waitress.server import create_server
+
+    # Listen on inherited sockets when given, else bind host:port ourselves
+    if sockets:
+        listen = {'sockets': sockets}
+    else:
+        listen = {'host': config.HOST, 'port': config.PORT}
+
+    tracker = InflightTracker(app, maxRequests, maxRss)
+    server = create_server(tracker,
+                           threads=config.SERVER_THREADS,
+                           backlog=config.SERVER_BACKLOG,
+                           connection_limit=config.SERVER_CONNECTION_LIMIT,
+                           channel_timeout=config.SERVER_CHANNEL_TIMEOUT,
+                           max_request_body_size=config.SERVER_MAX_BODY,
+                           **listen)
+
+    def drain():
+        drained = tracker.wait(config.SERVER_DRAIN_TIMEOUT)
+        # Responses handed back by the app may still be buffered on their
+        # channels; give the event loop the rest of the budget to flush them.
+        deadline = time.time() + config.SERVER_DRAIN_TIMEOUT
+        while time.time() < deadline and _pendingOutput(server):
+            time.sleep(0.05)
+        if not drained:
+            log.warning('Shutting down with %d requests still in flight', tracker.count)
+        _thread.interrupt_main()
+
+    def stop(signum, frame):
+        log.info('Received signal %d, draining in-flight requests', signum)
+        # Once draining, a second SIGINT (or the drain thread) ends the loop
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        # The handler can interrupt the event loop mid-select, so the listener
+        # is closed from the loop itself on its next pass. Only the listening
+        # socket: server.close() would also close the trigger that task
+        # threads pull as they finish the requests being drained.
+        server.accepting = False
+        server.trigger.pull_trigger(lambda: wasyncore.dispatcher.close(server))
+        threading.Thread(target=drain, name='drain', daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    log.info('Process %d serving on %s:%d with %d threads',
+             os.getpid(), config.HOST, config.PORT, config.SERVER_THREADS)
+    server.run()
+
+
+def _pendingOutput(server):
+    channels = list(getattr(server, '_map', {}).values())
+    return any(channel is not server and channel.writable() for channel in channels)
+
+
+def serve(app):
+    """
+    Run `app` with the server selected by configuration until shut down.
+    """
+    if config.SERVER == 'waitress':
+        serveWaitress(app, maxRequests=config.MAX_REQUESTS, maxRss=config.MAX_RSS)
+    elif config.SERVER == 'prefork':
+        from service import prefork
+        prefork.serve(app)
+    elif config.SERVER == 'wsgiref':
+        run(app=app, host=config.HOST, port=config.PORT)
+    else:
+        raise ValueError('Unknown server %r' % config.SERVER)
@@ -1,21 +1,34 @@
 #!/usr/bin/env python
-import json
-import logging
-import functools
-from bottle import app, route, run, request, response, abort
-from functools import reduce
+import time
+from bottle import app, route, request, response, abort, static_file, HTTPError
+from service import admission, config, logs, metrics, pipeline, pool, profiling, server
+from service.model import InternalAssertionError, applyModel, scorelessthanone
 
-logging.basicConfig(filename='bkt_outcome_unwind.log',
-                    format='%(levelname)s:%(asctime)s:%(message)s',
-                    datefmt='%m/%d/%Y %I:%M:%S %p',
-                    level=logging.INFO)
+# Log through a queue so request threads never write to the file themselves
+logs.configure()
+
+# SIGUSR2 starts a sampling profile of this process
+profiling.installSignalHandler()
 
 
 bkt_app = app()
 
 @route('/')
 def index():
-    return '<pre>%s</pre>' % 'BKT Outcome Unwind - ready to go!!!'
+    return pipeline.indexPage()
+
+@route('/metrics')
+def exposeMetrics():
+    response.content_type = metrics.CONTENT_TYPE
+    return metrics.REGISTRY.expose()
+
+@route('/ready')
+def ready():
+    # Load balancers steer traffic away while the in-flight budget is nearly spent
+    state = admission.load()
+    if not state['ready']:
+        response.status = 503
+    return state
 
 #####################################################################
 #
@@ -27,75 +40,85 @@ def index():
 @route('/bkt_service/unwind', method='POST')
 def processPipelineOperation():
 
-    result = []
-
-    # Read JSON from previous pipeline operation
-    data = request.body.read().decode("utf-8")
-
-    if not data:
-        abort(400, 'No data received')
-
-    jsonData = json.loads(data)
-
-    # Loop through each JSON record and apply the Unwrapping Function to it
-    for record in jsonData:
-        for item in applyModel(record):
-            result.append(item)
+    # Oversized requests and requests over the in-flight budget are refused
+    # before their body is read
+    try:
+        pipeline.screenRequest(request.content_length)
+    except pipeline.PipelineError as e:
+        raise HTTPError(e.status, e.message, headers=e.headers)
+
+    # The first access to the body reads it from the client
+    started = time.perf_counter()
+    body = request.body
+    metrics.STAGE_SECONDS.observe(time.perf_counter() - started, 'read')
+
+    # Parsing, unwinding and serialization are shared with the ASGI app
+    headers = []
+    try:
+        contentType, payload = pipeline.unwindBody(body,
+                                                   request.content_type,
+                                                   request.get_header('Accept'),
+                                                   headers,
+                                                   request.query.get('shape'),
+                                                   request.get_header('Content-Encoding'),
+                                                   request.get_header('Accept-Encoding'))
+    except pipeline.PipelineError as e:
+        raise HTTPError(e.status, e.message, headers=e.headers)
 
     # return data
-    response.content_type = 'application/json'
-    return json.dumps(result)
+    response.content_type = contentType
+    for name, value in headers:
+        response.set_header(name, value)
+    if isinstance(payload, (str, bytes)):
+        return payload
+    return abortOnError(payload)
+
+
+def abortOnError(chunks):
+    # A batch limit hit before the first chunk still gets its own status
+    try:
+        for chunk in chunks:
+            yield chunk
+    except pipeline.PipelineError as e:
+        raise HTTPError(e.status, e.message, headers=e.headers)
+    finally:
+        chunks.close()
 
 #####################################################################
 #
-# Unwrapping Function
+# Administration, behind a shared token
 #
 #####################################################################
 
 
-def scorelessthanone (score):
-    if score is None or score <= 0:
-        score = 0
-    else:
-        score = score
-
-    return score
-
-
-def applyModel(record):
-    # Check incoming outcome event is a student event
-    if not reduce(lambda m, n: m or n, ["learner" in _.lower() for _ in record["event"]["actor"]["roles"]]):
-        raise InternalAssertionError("Event lacks Learner role", 21)
-
-    result = []
-    for question in record["event"]["generated"]["itemResults"]:
-       result.append(
-            {
-                "question": {
-                    "studentId": record["event"]["actor"]["@id"],
-                    "questionId": question["question_reference"],
-                    "sequenceNumber": question["sequenceNumber"],
-                    "score": scorelessthanone(question["score"]),
-                    "maxScore": question["max_score"] if question["max_score"] is not None and question["max_score"] > 0 else 0,
-                    "classroomId": record["event"]["group"]["@id"],
-                    "assessmentId": record["event"]["object"]["extensions"]["assessmentId"],
-                    "assessmentType": record["event"]["object"]["extensions"]["assessmentType"]
-                },
-                    "learnositySessionId": record["event"]["object"]["@id"],
-                    "learnosityUserId": record["event"]["group"]["extensions"]["contextId"],
-                    "assessmentAttempt":record["event"]["object"]["count"] if "count" in record["event"]["object"] else 0,
-                    "courseOfferingId":record["event"]["group"]["extensions"]["CourseOfferingId"],
-                    "eventSubmitTime":record["event"]["eventTime"] if "eventTime" in record["event"] else None,
-                    "assessmentStartTime": record["event"]["object"]["startedAtTime"] if "startedAtTime" in record["event"]["object"] else None,
-                    "assessmentEndTime":record["event"]["object"]["endedAtTime"] if "endedAtTime" in record["event"]["object"] else None,
-                    "questionType":question["question_type"],
-                    "itemReference":question["item_reference"]
-            }
-        )
-
-    return result
+def checkAdminToken():
+    # The admin routes do not exist unless a token is configured
+    if not config.ADMIN_TOKEN:
+        abort(404, 'Not found.')
+    if not profiling.authorized(request.get_header('X-Admin-Token')):
+        abort(403, 'Forbidden.')
+
+
+@route('/admin/profile', method=['GET', 'POST'])
+def profileControl():
+    checkAdminToken()
+    if request.method == 'GET':
+        return profiling.status()
+    try:
+        return profiling.control(request.query)
+    except ValueError as e:
+        abort(400, str(e))
+
+
+@route('/admin/profile/<name>')
+def profileDownload(name):
+    checkAdminToken()
+    return static_file(name, root=config.PROFILE_DIR, mimetype='application/octet-stream', download=name)
 
 # Start our bottle web server
 if __name__ == "__main__":
     # Start our bottle web server
-    run(host='0.0.0.0', port=9998)
\ No newline at end of file
+    try:
+        server.serve(bkt_app)
+    finally:
+        pool.shutdown()
\ No newline at end of file
@@ -0,0 +1,59 @@
+"""
+Builders for Caliper OutcomeEvent records used across the test modules.
+"""
+
+import json
+
+
+def outcomeEvent(items=1, roles=("urn:lti:instrole:ims/lis/Learner",), session="attempt-1", **extra):
+    """
+    Return a pipeline record wrapping an OutcomeEvent with `items` item results.
+    """
+    record = {
+        "event": {
+            "@type": "http://purl.imsglobal.org/caliper/v1/OutcomeEvent",
+            "actor": {
+                "@id": "student-1",
+                "roles": list(roles)
+            },
+            "object": {
+                "@id": session,
+                "extensions": {
+                    "assessmentType": "Diagnostic Assessment",
+                    "assessmentId": "assessment-1"
+                },
+                "count": 1,
+                "startedAtTime": "2016-05-03T21:33:41.844Z",
+                "endedAtTime": "2016-05-03T22:03:41.844Z"
+            },
+            "generated": {
+                "itemResults": [
+                    {
+                        "question_type": "mcq",
+                        "score": n,
+                        "max_score": 10,
+                        "question_reference": "question-%d" % n,
+                        "item_reference": "item-%d" % n,
+                        "sequenceNumber": n
+                    } for n in range(1, items + 1)
+                ]
+            },
+            "group": {
+                "@id": "class-01",
+                "extensions": {
+                    "CourseOfferingId": "1200.0",
+                    "contextId": "587279312bf9a9afd947ddab"
+                }
+            },
+            "eventTime": "2017-01-09T14:21:00Z"
+        }
+    }
+    record.update(extra)
+    return record
+
+
+def batch(*records):
+    """
+    Serialize records as the JSON array body the unwind endpoint expects.
+    """
+    return json.dumps(list(records))
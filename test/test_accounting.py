@@ -0,0 +1,45 @@
+"""
+Tests for the per-request cost reported in response headers.
+"""
+
+from service import config, unwind_array
+from webtest import TestApp as TApp  # Change alias so that pytest does not attempt to load this as a test case class
+from .events import outcomeEvent, batch
+
+test_app = TApp(unwind_array.bkt_app)
+
+BODY = batch(outcomeEvent(items=3), outcomeEvent(roles=("teacher",)))
+
+
+def post(**headers):
+    headers.setdefault("Content-Type", "application/json")
+    return test_app.post("/bkt_service/unwind", BODY, headers=headers)
+
+
+def test_cost_headers():
+    response = post()
+    assert response.headers["X-Unwind-Records"] == "2"
+    assert response.headers["X-Unwind-Items"] == "4"
+    assert response.headers["X-Unwind-Rejected"] == "1"
+    assert response.headers["X-Unwind-Bytes-In"] == str(len(BODY))
+    assert response.headers["X-Unwind-Bytes-Out"] == str(len(response.body))
+    assert "X-Unwind-Memory-Peak" not in response.headers
+
+    timings = dict(entry.split(";dur=") for entry in response.headers["Server-Timing"].split(", "))
+    assert sorted(timings) == ["cpu", "decode", "encode", "total", "unwind"]
+    assert all(float(value) >= 0 for value in timings.values())
+
+
+def test_memory_peak_when_sampled(monkeypatch):
+    monkeypatch.setattr(config, "ACCOUNTING_MEMORY_RATE", 1.0)
+    assert int(post().headers["X-Unwind-Memory-Peak"]) > 0
+
+
+def test_unsampled_requests_are_not_accounted(monkeypatch):
+    monkeypatch.setattr(config, "ACCOUNTING_RATE", 0.0)
+    assert "Server-Timing" not in post().headers
+
+
+def test_streamed_responses_have_no_cost_headers():
+    response = post(Accept="application/x-ndjson")
+    assert "Server-Timing" not in response.headers
@@ -0,0 +1,96 @@
+"""
+Tests for admission control and load shedding.
+"""
+
+import gzip
+import json
+import pytest
+from service import admission, config, unwind_array
+from webtest import TestApp as TApp  # Change alias so that pytest does not attempt to load this as a test case class
+from .events import outcomeEvent, batch
+
+test_app = TApp(unwind_array.bkt_app)
+
+BODY = batch(outcomeEvent(items=3), outcomeEvent(items=2))
+
+
+def post(body=BODY, status=200, **headers):
+    headers.setdefault("Content-Type", "application/json")
+    return test_app.post("/bkt_service/unwind", body, headers=headers, status=status)
+
+
+@pytest.fixture
+def busy(monkeypatch):
+    """
+    Hold most of a small in-flight budget, as another request would.
+    """
+    monkeypatch.setattr(config, "INFLIGHT_BUDGET_BYTES", 1000)
+    admission.reserve(900)
+    yield
+    admission.release(900)
+
+
+def test_body_over_limit(monkeypatch):
+    monkeypatch.setattr(config, "MAX_BODY_BYTES", 100)
+    response = post(status=413)
+    assert b"exceeds 100 bytes" in response.body
+
+
+def test_decompressed_body_over_limit(monkeypatch):
+    body = batch(*[outcomeEvent() for _ in range(20)])
+    compressed = gzip.compress(body.encode())
+    monkeypatch.setattr(config, "MAX_BODY_BYTES", len(compressed) + 100)
+    post(compressed, status=413, **{"Content-Encoding": "gzip"})
+
+
+def test_records_over_limit(monkeypatch):
+    monkeypatch.setattr(config, "MAX_BATCH_RECORDS", 1)
+    post(status=413)
+    monkeypatch.setattr(config, "MAX_BATCH_RECORDS", 2)
+    post()
+
+
+def test_streamed_records_over_limit(monkeypatch):
+    monkeypatch.setattr(config, "MAX_BATCH_RECORDS", 1)
+    lines = "\n".join(json.dumps(json.loads(BODY)[i]) for i in range(2))
+    response = post(lines, status=413, **{"Content-Type": "application/x-ndjson"})
+    assert b"Batch exceeds 1 events" in response.body
+
+
+def test_items_over_limit(monkeypatch):
+    monkeypatch.setattr(config, "MAX_BATCH_ITEMS", 4)
+    post(status=413)
+    monkeypatch.setattr(config, "MAX_BATCH_ITEMS", 5)
+    assert len(post().json) == 5
+
+
+def test_shed_over_budget(busy):
+    response = post(status=429)
+    assert response.headers["Retry-After"] == "%d" % config.RETRY_AFTER
+    assert b"bkt_unwind_shed_total{reason=\"budget\"}" in test_app.get("/metrics").body
+
+
+def test_idle_process_admits_a_request_over_budget(monkeypatch):
+    monkeypatch.setattr(config, "INFLIGHT_BUDGET_BYTES", 10)
+    post()
+
+
+def test_budget_is_released(monkeypatch):
+    post()
+    post("", status=400)
+    monkeypatch.setattr(config, "MAX_BATCH_ITEMS", 1)
+    post(status=413)
+    assert admission.load()["requests"] == 0
+    assert admission.load()["bytes"] == 0
+
+
+def test_ready():
+    response = test_app.get("/ready")
+    assert response.json["ready"] is True
+    assert response.json["requests"] == 0
+
+
+def test_not_ready_near_budget(busy):
+    response = test_app.get("/ready", status=503)
+    assert response.json["ready"] is False
+    assert response.json["utilization"] == 0.9
@@ -0,0 +1,183 @@
+"""
+Tests for the ASGI front end, checked against the bottle application.
+"""
+
+import asyncio
+import gzip
+import json
+import pytest
+from service import admission, asgi, config, dedup, pipeline, unwind_array
+from webtest import TestApp as TApp  # Change alias so that pytest does not attempt to load this as a test case class
+from .events import outcomeEvent, batch
+
+test_app = TApp(unwind_array.bkt_app)
+
+
+def call(method, path, body=b"", headers=(), onSend=None):
+    """
+    Drive the ASGI application through one request and collect the response,
+    passing each message sent to `onSend` if given.
+    """
+    chunks = [body[i:i + 7] for i in range(0, len(body), 7)] or [b""]
+    messages = [{"type": "http.request", "body": c, "more_body": i < len(chunks) - 1}
+                for i, c in enumerate(chunks)]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        if onSend is not None:
+            onSend(message)
+        sent.append(message)
+
+    path, _, query = path.partition("?")
+    scope = {"type": "http", "method": method, "path": path, "query_string": query.encode(),
+             "headers": [(k.lower().encode(), v.encode()) for k, v in headers]}
+    asyncio.run(asgi.application(scope, receive, send))
+    asgi._slots = None  # The semaphore belongs to the loop that just closed
+    start = sent[0]
+    return start["status"], dict(start["headers"]), b"".join(m.get("body", b"") for m in sent[1:])
+
+
+def test_index():
+    status, headers, body = call("GET", "/")
+    assert status == 200
+    assert body.decode() == unwind_array.index()
+
+
+def test_metrics():
+    status, headers, body = call("GET", "/metrics")
+    assert status == 200
+    assert headers[b"content-type"].startswith(b"text/plain; version=0.0.4")
+    assert b"# TYPE bkt_unwind_stage_seconds histogram" in body
+
+
+def test_ready():
+    status, headers, body = call("GET", "/ready")
+    assert status == 200
+    assert json.loads(body)["ready"] is True
+
+
+def test_body_over_limit_is_refused_before_it_is_read(monkeypatch):
+    monkeypatch.setattr(config, "MAX_BODY_BYTES", 10)
+    status, headers, body = call("POST", "/bkt_service/unwind", b"[]",
+                                 [("Content-Type", "application/json"), ("Content-Length", "100")])
+    assert status == 413
+
+
+def test_chunked_body_over_limit_is_refused_while_it_is_read(monkeypatch):
+    monkeypatch.setattr(config, "MAX_BODY_BYTES", 10)
+    status, headers, body = call("POST", "/bkt_service/unwind", b"[" + b" " * 50 + b"]",
+                                 [("Content-Type", "application/json")])
+    assert status == 413
+
+    messages = [{"type": "http.request", "body": b" " * 7, "more_body": True} for _ in range(100)]
+
+    async def receive():
+        return messages.pop(0)
+
+    with pytest.raises(admission.TooLarge):
+        asyncio.run(asgi.readBody(receive))
+    assert len(messages) == 98
+
+
+def test_no_data():
+    status, headers, body = call("POST", "/bkt_service/unwind")
+    assert status == 400
+    assert b"No data" in body
+
+
+def test_matches_bottle_app(monkeypatch):
+    """
+    Assert buffered and streamed responses match the bottle application.
+    """
+    body = batch(outcomeEvent(items=3), outcomeEvent(items=2))
+    expected = test_app.post("/bkt_service/unwind", params=body).body
+
+    status, headers, data = call("POST", "/bkt_service/unwind", body.encode())
+    assert status == 200
+    assert headers[b"content-type"] == b"application/json"
+    assert data == expected
+
+    monkeypatch.setattr(config, "STREAM_RESPONSE", True)
+    status, headers, data = call("POST", "/bkt_service/unwind", body.encode())
+    assert data == expected
+
+    status, headers, data = call("POST", "/bkt_service/unwind", body.encode(),
+                                 [("Accept", "application/x-ndjson")])
+    assert headers[b"content-type"] == b"application/x-ndjson"
+    assert [json.loads(line) for line in data.splitlines()] == json.loads(expected)
+
+
+def test_grouped_shape_matches_bottle_app():
+    body = batch(outcomeEvent(items=3), outcomeEvent(items=2))
+    expected = test_app.post("/bkt_service/unwind?shape=grouped", params=body).body
+    status, headers, data = call("POST", "/bkt_service/unwind?shape=grouped", body.encode())
+    assert status == 200
+    assert data == expected
+
+
+def test_compressed_response():
+    body = batch(*[outcomeEvent(items=5) for _ in range(4)])
+    expected = test_app.post("/bkt_service/unwind", params=body).body
+    status, headers, data = call("POST", "/bkt_service/unwind", gzip.compress(body.encode()),
+                                 [("Content-Encoding", "gzip"), ("Accept-Encoding", "gzip")])
+    assert headers[b"content-encoding"] == b"gzip"
+    assert gzip.decompress(data) == expected
+
+
+def test_unknown_route():
+    assert call("GET", "/nothing")[0] == 404
+    assert call("GET", "/bkt_service/unwind")[0] == 405
+
+
+def test_unwind_failure_is_a_server_error(monkeypatch):
+    monkeypatch.setattr(config, "STREAM_RESPONSE", True)
+    status, headers, body = call("POST", "/bkt_service/unwind", b'[{"event": {}}')
+    assert status == 500
+
+
+@pytest.mark.parametrize("accept", ["application/json", "application/x-ndjson"])
+def test_grouped_unwind_failure_is_a_server_error(monkeypatch, accept):
+    monkeypatch.setattr(config, "STREAM_RESPONSE", True)
+
+    def failing(records, stats=None):
+        raise RuntimeError("unwind failed")
+        yield
+
+    monkeypatch.setattr(pipeline, "unwindRecords", failing)
+    status, headers, body = call("POST", "/bkt_service/unwind?shape=grouped", batch(outcomeEvent()).encode(),
+                                 [("Accept", accept)])
+    assert status == 500
+
+
+def test_slot_is_free_while_a_response_is_sent(monkeypatch):
+    monkeypatch.setattr(config, "ASGI_CONCURRENCY", 1)
+    monkeypatch.setattr(config, "STREAM_RESPONSE", True)
+    held = []
+    body = batch(outcomeEvent(items=3), outcomeEvent(items=2)).encode()
+    for accept in ["application/json", "application/x-ndjson"]:
+        status, headers, data = call("POST", "/bkt_service/unwind", body, [("Accept", accept)],
+                                     onSend=lambda message: held.append(asgi.getSlots().locked()))
+        assert status == 200
+    monkeypatch.setattr(config, "STREAM_RESPONSE", False)
+    call("POST", "/bkt_service/unwind", body, onSend=lambda message: held.append(asgi.getSlots().locked()))
+    assert len(held) > 6
+    assert not any(held)
+
+
+def test_events_of_an_unsent_response_are_not_remembered(monkeypatch):
+    monkeypatch.setattr(config, "DEDUP_WINDOW", 60.0)
+    monkeypatch.setattr(dedup, "_filter", None)
+    body = batch(outcomeEvent(items=2)).encode()
+
+    def disconnect(message):
+        if message["type"] == "http.response.body":
+            raise OSError("client went away")
+
+    with pytest.raises(OSError):
+        call("POST", "/bkt_service/unwind", body, onSend=disconnect)
+    asgi._slots = None
+    assert len(json.loads(call("POST", "/bkt_service/unwind", body)[2])) == 2
+    assert json.loads(call("POST", "/bkt_service/unwind", body)[2]) == []
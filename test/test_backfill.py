@@ -0,0 +1,92 @@
+"""
+Tests for the offline backfill command.
+"""
+
+import gzip
+import io
+import json
+import pytest
+from service import backfill, unwind_array
+from webtest import TestApp as TApp  # Change alias so that pytest does not attempt to load this as a test case class
+from .events import outcomeEvent, batch
+
+test_app = TApp(unwind_array.bkt_app)
+
+RECORDS = [outcomeEvent(items=n % 3 + 1, session="attempt-%d" % n) for n in range(7)]
+RECORDS[4] = outcomeEvent(roles=("teacher",))
+
+
+def serviceOutput(records):
+    return test_app.post("/bkt_service/unwind", batch(*records),
+                         headers={"Content-Type": "application/json", "Accept": "application/x-ndjson"}).body
+
+
+def jsonLines(records):
+    return "".join(json.dumps(record) + "\n\n" for record in records).encode()
+
+
+INPUTS = {
+    "events.json": lambda: batch(*RECORDS).encode(),
+    "events.jsonl": lambda: jsonLines(RECORDS),
+    "events.jsonl.gz": lambda: gzip.compress(jsonLines(RECORDS)),
+    "events.json.gz": lambda: gzip.compress(batch(*RECORDS).encode()),
+}
+
+
+@pytest.mark.parametrize("name", sorted(INPUTS))
+def test_output_matches_service(tmp_path, name):
+    path = tmp_path / name
+    path.write_bytes(INPUTS[name]())
+    progress = backfill.backfill([str(path)], str(tmp_path / "out"), shardSize=3)
+    assert (tmp_path / "out" / "events.ndjson").read_bytes() == serviceOutput(RECORDS)
+    assert (progress.records, progress.items, progress.rejected) == (7, 12, 1)
+
+
+def test_worker_processes(tmp_path):
+    path = tmp_path / "events.jsonl"
+    path.write_bytes(jsonLines(RECORDS))
+    backfill.backfill([str(path)], str(tmp_path / "out"), workers=2, shardSize=2)
+    assert (tmp_path / "out" / "events.ndjson").read_bytes() == serviceOutput(RECORDS)
+
+
+def test_resume_after_crash(tmp_path, monkeypatch):
+    path = tmp_path / "events.jsonl"
+    path.write_bytes(jsonLines(RECORDS))
+    out = tmp_path / "out"
+    unwindShard = backfill.unwindShard
+
+    def crashing(records, start, lineNumbers=None, format="ndjson"):
+        if start >= 4:
+            raise RuntimeError("crash")
+        return unwindShard(records, start, lineNumbers, format)
+
+    monkeypatch.setattr(backfill, "unwindShard", crashing)
+    with pytest.raises(RuntimeError):
+        backfill.backfill([str(path)], str(out), shardSize=2, checkpointInterval=0)
+    assert backfill.Checkpoint(str(out / backfill.CHECKPOINT_NAME)).entry(str(path))["records"] == 4
+
+    # Output written after the checkpoint is discarded on resume
+    with open(str(out / "events.ndjson"), "ab") as partial:
+        partial.write(b'{"partial')
+    monkeypatch.setattr(backfill, "unwindShard", unwindShard)
+    progress = backfill.backfill([str(path)], str(out), shardSize=2)
+    assert progress.records == 3
+    assert (out / "events.ndjson").read_bytes() == serviceOutput(RECORDS)
+
+    # A finished file is skipped
+    assert backfill.backfill([str(path)], str(out)).records == 0
+
+
+def test_malformed_line(tmp_path):
+    path = tmp_path / "events.jsonl"
+    path.write_bytes(jsonLines(RECORDS[:2]) + b"{not json\n")
+    with pytest.raises(ValueError, match="line 5"):
+        backfill.backfill([str(path)], str(tmp_path / "out"))
+
+
+def test_progress_line():
+    stream = io.StringIO()
+    progress = backfill.Progress(0, stream)
+    progress.add(10, 40, 1, 2000)
+    progress.report()
+    assert stream.getvalue().startswith("unwound 10 records, 40 items (1 rejected) in ")
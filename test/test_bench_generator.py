@@ -0,0 +1,31 @@
+"""
+Tests for the synthetic OutcomeEvent generator used by the benchmarks.
+"""
+
+import json
+from bench.generator import generateBody, generateEvents
+from service import compact, model
+
+
+def test_generator_is_seeded():
+    assert generateBody(5, seed=7) == generateBody(5, seed=7)
+    assert generateBody(5, seed=7) != generateBody(5, seed=8)
+
+
+def test_generated_events_unwind():
+    """
+    Assert generated events unwind, with instructor events rejected by role.
+    """
+    records = list(generateEvents(50, items=(2, 4), learnerRate=0.8, optionalRate=0.5))
+    for index, record in enumerate(records):
+        items = [compact.toItem(item) for item in model.unwindRecord(record, index)]
+        if "Learner" in record["event"]["actor"]["roles"][0]:
+            assert 2 <= len(items) <= 4
+            assert all(item["error"]["code"] == model.OK for item in items)
+        else:
+            assert items[0]["error"]["code"] == model.LACKS_LEARNER_ROLE
+
+
+def test_ndjson_body():
+    lines = generateBody(3, ndjson=True).decode("utf-8").splitlines()
+    assert [json.loads(line) for line in lines] == json.loads(generateBody(3))
@@ -227,8 +227,8 @@ def test_teacher_role():
     ]''')
     assert response.status == '200 OK'
     assert len(response.json) == 1
-    #assert response.json[0]["error"]["code"] == 21
-    #assert "role" in response.json[0]["error"]["message"]
+    assert response.json[0]["error"]["code"] == 21
+    assert "role" in response.json[0]["error"]["message"]
 
 
 def test_valid_data_null_scores():
@@ -0,0 +1,124 @@
+"""
+Tests for the idempotency cache of unwind results.
+"""
+
+import gzip
+import threading
+import time
+import pytest
+from service import cache, config, metrics, model, unwind_array
+from webtest import TestApp as TApp  # Change alias so that pytest does not attempt to load this as a test case class
+from .events import outcomeEvent, batch
+
+test_app = TApp(unwind_array.bkt_app)
+
+BODY = batch(outcomeEvent(items=3), outcomeEvent(roles=("teacher",)))
+
+
+@pytest.fixture
+def results(monkeypatch):
+    monkeypatch.setattr(config, "CACHE_MAX_BYTES", 1024 * 1024)
+    monkeypatch.setattr(cache, "_cache", None)
+    return cache.getCache()
+
+
+def post(body=BODY, path="/bkt_service/unwind", **headers):
+    headers.setdefault("Content-Type", "application/json")
+    return test_app.post(path, body, headers=headers)
+
+
+def test_cache_is_off_by_default():
+    assert "X-Unwind-Cache" not in post().headers
+
+
+def test_retried_batch_is_served_from_cache(results, monkeypatch):
+    first = post()
+    assert first.headers["X-Unwind-Cache"] == "miss"
+
+    # A retry must not unwind again
+    monkeypatch.setattr(model, "applyModelRows", None)
+    second = post()
+    assert second.headers["X-Unwind-Cache"] == "hit"
+    assert second.body == first.body
+    assert second.headers["X-Unwind-Items"] == "4"
+    assert second.headers["X-Unwind-Rejected"] == "1"
+
+    # The same events, compressed, hit the same entry
+    assert post(gzip.compress(BODY.encode()), **{"Content-Encoding": "gzip"}).headers["X-Unwind-Cache"] == "hit"
+
+
+def test_format_options_are_part_of_the_key(results):
+    post()
+    assert post(Accept="application/x-ndjson").headers["X-Unwind-Cache"] == "miss"
+    assert post(path="/bkt_service/unwind?shape=grouped").headers["X-Unwind-Cache"] == "miss"
+    assert post(batch(outcomeEvent(items=2))).headers["X-Unwind-Cache"] == "miss"
+
+
+def test_streamed_results_are_cached(results, monkeypatch):
+    monkeypatch.setattr(config, "STREAM_RESPONSE", True)
+    first = post()
+    second = post()
+    assert second.headers["X-Unwind-Cache"] == "hit"
+    assert second.body == first.body
+
+
+def test_errors_are_not_cached(results):
+    test_app.post("/bkt_service/unwind", "", status=400)
+    assert results.entries == {} and results.flights == {}
+
+
+def test_lru_eviction_and_ttl(monkeypatch):
+    monkeypatch.setattr(config, "CACHE_MAX_ENTRY_BYTES", 10 ** 6)
+    results = cache.ResultCache(2 * (100 + 256), 1)
+
+    def store(key):
+        flight = results.begin(key)[1]
+        flight.finish(cache.CachedResult("application/json", b"x" * 100, "json", 1, 1, 0))
+
+    store(b"a")
+    store(b"b")
+    assert results.begin(b"a")[0] is not None
+    store(b"c")
+    assert list(results.entries) == [b"a", b"c"]
+    assert results.bytes == 2 * (100 + 256)
+
+    monkeypatch.setattr(config, "CACHE_TTL", -1)
+    store(b"d")
+    result, flight = results.begin(b"d")
+    assert result is None
+    flight.finish(None)
+
+
+def test_concurrent_duplicates_are_coalesced(monkeypatch):
+    results = cache.ResultCache(10 ** 6, 5)
+    leader = results.begin(b"key")[1]
+    answers = []
+
+    def follower():
+        answers.append(results.begin(b"key")[0])
+
+    def served():
+        return sum(metrics.CACHE_REQUESTS.values.get((result,), 0) for result in ("hit", "coalesced"))
+
+    before = served()
+    followers = [threading.Thread(target=follower) for _ in range(3)]
+    for thread in followers:
+        thread.start()
+    time.sleep(0.05)
+    leader.finish(cache.CachedResult("application/json", b"[]", "json", 0, 0, 0))
+    for thread in followers:
+        thread.join()
+    assert [answer.payload for answer in answers] == [b"[]"] * 3
+    assert served() - before == 3
+
+
+def test_failed_leader_releases_followers():
+    results = cache.ResultCache(10 ** 6, 5)
+    leader = results.begin(b"key")[1]
+    outcome = []
+    thread = threading.Thread(target=lambda: outcome.append(results.begin(b"key")))
+    thread.start()
+    leader.finish(None)
+    thread.join()
+    result, flight = outcome[0]
+    assert result is None and flight is not leader
@@ -0,0 +1,52 @@
+"""
+Tests for request capture and its replay file format.
+"""
+
+import time
+from service import capture, config, unwind_array
+from webtest import TestApp as TApp  # Change alias so that pytest does not attempt to load this as a test case class
+from .events import outcomeEvent, batch
+
+test_app = TApp(unwind_array.bkt_app)
+
+
+def waitFor(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_captured_requests_replay_identically(tmp_path, monkeypatch):
+    """
+    Assert sampled bodies are written off the request path and replay the same.
+    """
+    path = str(tmp_path / "capture.jsonl")
+    monkeypatch.setattr(config, "CAPTURE_FILE", path)
+    monkeypatch.setattr(config, "CAPTURE_RATE", 1.0)
+    body = batch(outcomeEvent(items=2))
+    response = test_app.post("/bkt_service/unwind", params=body)
+
+    assert waitFor(lambda: capture.getCapture().captured == 1)
+    entries = list(capture.readCapture(path))
+    assert len(entries) == 1
+    assert entries[0]["body"] == body
+    replayed = test_app.post("/bkt_service/unwind", params=entries[0]["body"],
+                             content_type=entries[0]["contentType"])
+    assert replayed.body == response.body
+
+
+def test_oversized_and_unsampled_bodies_are_skipped(tmp_path, monkeypatch):
+    path = str(tmp_path / "capture.jsonl")
+    monkeypatch.setattr(config, "CAPTURE_FILE", path)
+    monkeypatch.setattr(config, "CAPTURE_RATE", 1.0)
+    monkeypatch.setattr(config, "CAPTURE_MAX_BYTES", 10)
+    test_app.post("/bkt_service/unwind", params=batch(outcomeEvent()))
+
+    monkeypatch.setattr(config, "CAPTURE_RATE", 0.0)
+    monkeypatch.setattr(config, "CAPTURE_MAX_BYTES", 10 ** 6)
+    test_app.post("/bkt_service/unwind", params=batch(outcomeEvent()))
+
+    time.sleep(0.05)
+    assert capture.getCapture().queue.empty()
+    assert not (tmp_path / "capture.jsonl").exists()
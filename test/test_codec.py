@@ -0,0 +1,54 @@
+"""
+Tests for the JSON codec layer.
+"""
+
+import json
+import pytest
+from service import codec, unwind_array
+
+
+@pytest.mark.parametrize("text", [
+    b'[{"a": 1.5, "b": null, "c": "caf\\u00e9"}]',
+    b'12345678901234567890123',
+    b'{"a": [1, -12345678901234567890123]}',
+    b'[NaN, Infinity, -Infinity]',
+    b'"\\ud800"',
+    '["é"]'.encode("utf-8"),
+])
+def test_loads_matches_stdlib(text):
+    """
+    Assert the selected backend decodes exactly what the stdlib decodes.
+    """
+    assert repr(codec.loads(text)) == repr(json.loads(text))
+
+
+@pytest.mark.parametrize("text, found", [
+    (b'{"a": 12345678901234567890}', True),
+    (b'[1,\n -12345678901234567890]', True),
+    (b'{"a": 1234567890123456789.5}', True),
+    (b'{"a": 123456789012345678}', False),
+    (b'{"id": "f00d12345678901234567890"}', False),
+])
+def test_long_integers_are_found(text, found):
+    assert codec._hasLongInteger(text) is found
+
+
+def test_long_integer_across_scan_chunks(monkeypatch):
+    monkeypatch.setattr(codec, "_SCAN_CHUNK", 8)
+    assert codec._hasLongInteger(b'{"abc": 12345678901234567890}')
+    assert not codec._hasLongInteger(b'{"abc": "x12345678901234567890"}')
+
+
+@pytest.mark.parametrize("text", [b'[1,]', b'', b'{"a": }'])
+def test_loads_rejects_malformed_input(text):
+    with pytest.raises(ValueError):
+        codec.loads(text)
+
+
+def test_dumps_is_stdlib_compatible():
+    value = [{"score": 1e16, "id": "é", "n": None}]
+    assert codec.dumps(value) == json.dumps(value)
+
+
+def test_index_reports_backend():
+    assert codec.BACKEND in unwind_array.index()
@@ -0,0 +1,113 @@
+"""
+Tests for Arrow and Parquet output of unwound questions.
+"""
+
+import io
+import pytest
+from service import backfill, cache, columnar, config, model, unwind_array
+from webtest import TestApp as TApp  # Change alias so that pytest does not attempt to load this as a test case class
+from .events import outcomeEvent, batch
+
+test_app = TApp(unwind_array.bkt_app)
+
+needsArrow = pytest.mark.skipif(not columnar.available(), reason="pyarrow is not installed")
+
+RECORDS = [outcomeEvent(items=3), outcomeEvent(roles=("teacher",)), outcomeEvent(items=2, session="attempt-2")]
+
+
+def post(accept, records=RECORDS, status=200):
+    return test_app.post("/bkt_service/unwind", batch(*records),
+                         headers={"Content-Type": "application/json", "Accept": accept}, status=status)
+
+
+def expectedRows(records):
+    """
+    The rows the flat JSON items of `records` stand for.
+    """
+    rows = []
+    for item in post("application/json", records).json:
+        row = dict.fromkeys(columnar.NAMES)
+        if "recordIndex" in item:
+            row.update(recordIndex=item["recordIndex"], errorCode=item["error"]["code"],
+                       errorMessage=item["error"]["message"])
+        else:
+            row.update(item["question"])
+            row.update((key, value) for key, value in item.items() if key not in ("question", "error"))
+            row.update(errorCode=0, errorMessage="")
+        rows.append(row)
+    return rows
+
+
+@needsArrow
+def test_arrow_stream():
+    import pyarrow.ipc
+    response = post(columnar.ARROW)
+    assert response.content_type == columnar.ARROW
+    table = pyarrow.ipc.open_stream(response.body).read_all()
+    assert table.column_names == list(columnar.NAMES)
+    assert table.to_pylist() == expectedRows(RECORDS)
+    assert pyarrow.types.is_dictionary(table.schema.field("studentId").type)
+
+
+@needsArrow
+def test_parquet():
+    import pyarrow.parquet
+    response = post("%s, application/json;q=0.5" % columnar.PARQUET)
+    assert response.content_type == columnar.PARQUET
+    assert pyarrow.parquet.read_table(io.BytesIO(response.body)).to_pylist() == expectedRows(RECORDS)
+
+
+@needsArrow
+@pytest.mark.parametrize("format", [columnar.PARQUET, columnar.ARROW])
+def test_cached(monkeypatch, format):
+    monkeypatch.setattr(config, "CACHE_MAX_BYTES", 1024 * 1024)
+    monkeypatch.setattr(cache, "_cache", None)
+    first = post(format)
+    second = post(format)
+    assert (first.headers["X-Unwind-Cache"], second.headers["X-Unwind-Cache"]) == ("miss", "hit")
+    assert second.content_type == format
+    assert second.body == first.body
+
+
+@needsArrow
+def test_batches_replace_dictionaries():
+    import pyarrow.ipc
+    records = [outcomeEvent(items=2, session="attempt-%d" % n) for n in range(5)]
+    items = list(model.unwindSerial(records))
+    table = pyarrow.ipc.open_stream(columnar.encodeArrow(items, rows=3)).read_all()
+    # Batches end on event boundaries
+    assert [b.num_rows for b in table.to_batches()] == [4, 4, 2]
+    assert table.column("learnositySessionId").to_pylist() == ["attempt-%d" % (n // 2) for n in range(10)]
+
+
+@needsArrow
+def test_empty_result_carries_the_schema():
+    import pyarrow.ipc
+    table = pyarrow.ipc.open_stream(columnar.encodeArrow([])).read_all()
+    assert table.num_rows == 0
+    assert table.schema == columnar.schema()
+
+
+@needsArrow
+def test_value_the_schema_cannot_hold():
+    record = outcomeEvent()
+    record["event"]["generated"]["itemResults"][0]["sequenceNumber"] = "first"
+    response = post(columnar.PARQUET, [record], status=406)
+    assert b"sequenceNumber" in response.body
+
+
+def test_json_when_pyarrow_is_missing(monkeypatch):
+    monkeypatch.setattr(columnar, "pyarrow", None)
+    assert post("%s, application/json;q=0.5" % columnar.ARROW).json == post("application/json").json
+
+
+@needsArrow
+def test_backfill_parts(tmp_path):
+    import pyarrow.parquet
+    path = tmp_path / "events.json"
+    path.write_text(batch(*RECORDS))
+    backfill.backfill([str(path)], str(tmp_path / "out"), shardSize=2, format="parquet")
+    parts = sorted(p.name for p in (tmp_path / "out" / "events.parquet").iterdir())
+    assert parts == ["part-00000.parquet", "part-00001.parquet"]
+    table = pyarrow.parquet.read_table(str(tmp_path / "out" / "events.parquet"))
+    assert table.to_pylist() == expectedRows(RECORDS)
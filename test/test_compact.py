@@ -0,0 +1,58 @@
+"""
+Tests for the compact row layout and its serialization.
+"""
+
+import json
+import pickle
+from service import compact, model
+from .events import outcomeEvent
+
+
+def rowsOf(record):
+    return model.applyModelRows(record)
+
+
+def test_rows_share_one_header():
+    rows = rowsOf(outcomeEvent(items=3))
+    assert len(rows) == 3
+    assert all(row[0] is rows[0][0] for row in rows)
+
+
+def test_encoding_matches_json_dumps():
+    """
+    Assert rows encode exactly like the item dicts, whatever the value types.
+    """
+    record = outcomeEvent(items=5)
+    event = record["event"]
+    event["actor"]["@id"] = "stüdent \"quoted\" ☃"
+    event["object"]["count"] = 2.5
+    event["group"]["extensions"]["CourseOfferingId"] = None
+    questions = event["generated"]["itemResults"]
+    questions[0].update(score=0.75, max_score=1e20)
+    questions[1].update(question_reference=12345678901234567890, question_type=None)
+    questions[2].update(item_reference={"nested": [1, True, None]}, sequenceNumber=float("nan"))
+    questions[3].update(score=float("inf"), item_reference="\x00\t\n")
+
+    rows = rowsOf(record)
+    for row in rows:
+        assert compact.encodeItem(row) == json.dumps(compact.toItem(row))
+    error = model.errorItem(3, model.MISSING_FIELD, "Event is missing field 'group'")
+    items = rows + [error]
+    assert compact.encodeArray(items) == json.dumps([compact.toItem(item) for item in items])
+    assert compact.encodeArray([]) == "[]"
+
+
+def test_repeated_strings_are_interned():
+    first, second = outcomeEvent(), outcomeEvent()
+    second["event"]["group"]["@id"] = "".join(first["event"]["group"]["@id"])
+    assert rowsOf(first)[0][0].classroomId is rowsOf(second)[0][0].classroomId
+
+
+def test_rows_survive_pickling():
+    rows = rowsOf(outcomeEvent(items=2))
+    compact.encodeItem(rows[0])
+    restored = pickle.loads(pickle.dumps(rows))
+    assert restored == rows
+    assert restored[0][0] is restored[1][0]
+    assert restored[0][0].fragments is None
+    assert compact.encodeItem(restored[1]) == compact.encodeItem(rows[1])
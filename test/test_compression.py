@@ -0,0 +1,110 @@
+"""
+Tests for compressed request bodies and negotiated response compression.
+"""
+
+import gzip
+import io
+import zlib
+import pytest
+from webob import Request
+from service import compression, config, unwind_array
+from webtest import TestApp as TApp  # Change alias so that pytest does not attempt to load this as a test case class
+from .events import outcomeEvent, batch
+
+test_app = TApp(unwind_array.bkt_app)
+
+BODY = batch(*[outcomeEvent(items=5) for _ in range(4)]).encode()
+
+
+def post(body, **headers):
+    headers.setdefault("Content-Type", "application/json")
+    return test_app.post("/bkt_service/unwind", body, headers=headers, expect_errors=True)
+
+
+EXPECTED = post(BODY).body
+
+
+def postRaw(body, **headers):
+    """
+    Post without webtest, which would undo the Content-Encoding of the response.
+    """
+    headers.setdefault("Content-Type", "application/json")
+    request = Request.blank("/bkt_service/unwind", method="POST", body=body, headers=headers)
+    return request.get_response(unwind_array.bkt_app)
+
+
+@pytest.mark.parametrize("encode, coding", [
+    (gzip.compress, "gzip"),
+    (lambda data: gzip.compress(data[:100]) + gzip.compress(data[100:]), "gzip"),
+    (zlib.compress, "deflate"),
+    (lambda data: zlib.compress(data)[2:-4], "deflate"),
+    (lambda data: zlib.compress(gzip.compress(data)), "gzip, deflate"),
+])
+def test_compressed_requests(encode, coding):
+    assert post(encode(BODY), **{"Content-Encoding": coding}).body == EXPECTED
+
+
+def test_bad_request_encodings():
+    assert post(BODY, **{"Content-Encoding": "br"}).status_int == 415
+    assert post(b"not gzip at all", **{"Content-Encoding": "gzip"}).status_int == 400
+    assert post(gzip.compress(BODY)[:-20], **{"Content-Encoding": "gzip"}).status_int == 400
+
+
+@pytest.mark.skipif(compression.zstandard is None, reason="zstandard is not installed")
+def test_bad_zstd_request():
+    compressed = compression.zstandard.ZstdCompressor().compress(BODY)
+    assert post(compressed, **{"Content-Encoding": "zstd"}).body == EXPECTED
+    assert post(b"not zstd at all", **{"Content-Encoding": "zstd"}).status_int == 400
+    assert post(compressed[:-20], **{"Content-Encoding": "zstd"}).status_int == 400
+
+
+def test_decompressed_size_is_limited(monkeypatch):
+    monkeypatch.setattr(config, "MAX_DECOMPRESSED_BYTES", 10000)
+    bomb = gzip.compress(b" " * 10 ** 7)
+    response = post(bomb, **{"Content-Encoding": "gzip"})
+    assert response.status_int == 413
+    assert post(gzip.compress(BODY[:9000]), **{"Content-Encoding": "gzip"}).status_int != 413
+
+
+@pytest.mark.parametrize("stream", (False, True))
+def test_compressed_responses(monkeypatch, stream):
+    monkeypatch.setattr(config, "STREAM_RESPONSE", stream)
+    monkeypatch.setattr(config, "WRITE_CHUNK_SIZE", 256)
+    response = postRaw(BODY, **{"Accept-Encoding": "deflate;q=0.5, gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["Vary"] == "Accept-Encoding"
+    assert gzip.decompress(response.body) == EXPECTED
+    assert len(response.body) < len(EXPECTED) / 5
+
+    response = postRaw(BODY, **{"Accept-Encoding": "deflate"})
+    assert zlib.decompress(response.body) == EXPECTED
+
+
+def test_small_or_unwanted_responses_are_not_compressed(monkeypatch):
+    assert "Content-Encoding" not in postRaw(BODY, **{"Accept-Encoding": "gzip;q=0"}).headers
+    assert "Content-Encoding" not in postRaw(batch().encode(), **{"Accept-Encoding": "gzip"}).headers
+    monkeypatch.setattr(config, "COMPRESSION_LEVEL", 0)
+    assert "Content-Encoding" not in postRaw(BODY, **{"Accept-Encoding": "gzip"}).headers
+
+
+def test_negotiation():
+    assert compression.negotiate(None) is None
+    assert compression.negotiate("identity") is None
+    assert compression.negotiate("br, deflate") == "deflate"
+    assert compression.negotiate("*") == compression.supportedEncodings()[0]
+    assert compression.negotiate("gzip;q=0.1, deflate;q=0.9") == "deflate"
+
+
+def test_streamed_chunks_decompress_as_they_arrive():
+    chunks = [b'[{"a": 1}', b', {"b": 2}]']
+    compressed = list(compression.iterCompressed((chunk for chunk in chunks), "gzip"))
+    inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    assert inflater.decompress(compressed[0]) == chunks[0]
+    assert inflater.decompress(b"".join(compressed[1:])) == chunks[1]
+
+
+def test_decoded_body_is_seekable():
+    body = compression.decodeBody(io.BytesIO(gzip.compress(BODY)), "gzip")
+    assert body.read() == BODY
+    body.seek(0)
+    assert body.read(1) == b"["
@@ -0,0 +1,138 @@
+"""
+Tests for suppression of events resent across batches.
+"""
+
+import io
+import os
+import pytest
+from service import cache, config, dedup, pipeline, unwind_array
+from webtest import TestApp as TApp  # Change alias so that pytest does not attempt to load this as a test case class
+from .events import outcomeEvent, batch
+
+test_app = TApp(unwind_array.bkt_app)
+
+
+def post(body):
+    return test_app.post("/bkt_service/unwind", body, headers={"Content-Type": "application/json"}).json
+
+
+@pytest.fixture
+def window(monkeypatch):
+    monkeypatch.setattr(config, "DEDUP_WINDOW", 60.0)
+    monkeypatch.setattr(dedup, "_filter", None)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(dedup.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_resent_event_is_dropped(window):
+    assert len(post(batch(outcomeEvent(items=3)))) == 3
+    items = post(batch(outcomeEvent(items=3), outcomeEvent(items=2, session="attempt-2")))
+    assert [item["learnositySessionId"] for item in items] == ["attempt-2"] * 2
+
+
+def test_duplicate_within_batch_is_dropped(window):
+    assert len(post(batch(outcomeEvent(items=2), outcomeEvent(items=2)))) == 2
+
+
+def test_identity_fields(window):
+    post(batch(outcomeEvent(items=2)))
+    attempt = outcomeEvent(items=2)
+    attempt["event"]["object"]["count"] = 2
+    questions = outcomeEvent(items=3)
+    rescored = outcomeEvent(items=2)
+    rescored["event"]["generated"]["itemResults"][0]["score"] = 0
+    # A new attempt or new questions are new events; a new score alone is not
+    assert len(post(batch(attempt, questions, rescored))) == 5
+
+
+def test_error_items_are_kept(window):
+    post(batch(outcomeEvent()))
+    items = post(batch(outcomeEvent(), outcomeEvent(roles=["Instructor"]), outcomeEvent(roles=["Instructor"])))
+    assert [item["recordIndex"] for item in items] == [1, 2]
+
+
+def test_duplicates_are_counted(window):
+    post(batch(outcomeEvent(items=3), outcomeEvent(items=3)))
+    body = test_app.get("/metrics").body
+    assert b"bkt_unwind_duplicates_total" in body
+    assert b"bkt_unwind_duplicate_items_total" in body
+
+
+def test_retry_after_a_refused_batch_gets_every_event(window, monkeypatch):
+    monkeypatch.setattr(config, "MAX_BATCH_ITEMS", 3)
+    test_app.post("/bkt_service/unwind", batch(outcomeEvent(items=2), outcomeEvent(items=2, session="attempt-2")),
+                  headers={"Content-Type": "application/json"}, status=413)
+    assert len(post(batch(outcomeEvent(items=2)))) == 2
+
+
+def test_retry_after_a_disconnect_gets_every_event(window):
+    body = batch(*[outcomeEvent(items=2, session="attempt-%d" % n) for n in range(3)])
+    responseType, chunks = pipeline.unwindBody(io.BytesIO(body.encode()), "application/json", "application/x-ndjson")
+    next(chunks)
+    # The client goes away after the first line
+    chunks.close()
+    assert len(post(body)) == 6
+    assert post(body) == []
+
+
+def test_whole_response_is_remembered_once_sent(window):
+    body = batch(outcomeEvent(items=2))
+    headers = []
+    responseType, payload = pipeline.unwindBody(io.BytesIO(body.encode()), "application/json", None, headers)
+    assert ("Content-Length", "%d" % len(next(payload))) in headers
+    # The server gives up before the response is written
+    payload.close()
+    assert len(post(body)) == 2
+    assert post(body) == []
+
+
+def test_cache_answers_a_retry_with_the_first_response(window, monkeypatch):
+    monkeypatch.setattr(config, "CACHE_MAX_BYTES", 1024 * 1024)
+    monkeypatch.setattr(cache, "_cache", None)
+    body = batch(outcomeEvent(items=2))
+    assert len(post(body)) == 2
+    assert len(post(body)) == 2
+    # The same event in another batch is still dropped
+    assert post(batch(outcomeEvent(items=2), outcomeEvent(roles=["Instructor"]))) == [
+        {"recordIndex": 1, "error": {"code": 21, "message": "Event lacks Learner role"}}]
+
+
+def test_off_by_default(monkeypatch):
+    monkeypatch.setattr(dedup, "_filter", None)
+    assert dedup.getFilter() is None
+    assert len(post(batch(outcomeEvent(), outcomeEvent()))) == 2
+
+
+def test_window(clock):
+    seen = dedup.WindowedFilter(60, 100, 1e-6)
+    seen.add([b"a" * 16])
+    clock[0] += 90
+    # Still held by the previous generation
+    assert seen.holds(b"a" * 16)
+    seen.add([b"a" * 16])
+    clock[0] += 60
+    # Seen again, so carried into the next generation
+    assert seen.holds(b"a" * 16)
+    clock[0] += 121
+    assert not seen.holds(b"a" * 16)
+
+
+def test_capacity_rotates_early(clock):
+    seen = dedup.WindowedFilter(60, 2, 1e-6)
+    seen.add([b"a" * 16, b"b" * 16, b"c" * 16, b"d" * 16, b"e" * 16])
+    assert seen.holds(b"e" * 16)
+    assert not seen.holds(b"a" * 16)
+
+
+def test_false_positive_rate():
+    bloom = dedup.BloomFilter(10000, 0.01)
+    for _ in range(10000):
+        bloom.add(os.urandom(16))
+    false = sum(1 for _ in range(10000) if os.urandom(16) in bloom)
+    assert false < 200
+    assert len(dedup.BloomFilter(1000000, 1e-6).bits) < 4 * 1024 * 1024
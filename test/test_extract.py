@@ -0,0 +1,78 @@
+"""
+Tests for the shape-specialized extractors behind applyModel.
+"""
+
+import itertools
+import pytest
+from service import extract, unwind_array
+from .events import outcomeEvent
+
+
+def walkRecord(record):
+    """
+    Reference unwinding that walks the record for every question.
+    """
+    event = record["event"]
+    return [
+        {
+            "question": {
+                "studentId": event["actor"]["@id"],
+                "questionId": question["question_reference"],
+                "sequenceNumber": question["sequenceNumber"],
+                "score": unwind_array.scorelessthanone(question["score"]),
+                "maxScore": question["max_score"] if question["max_score"] is not None and question["max_score"] > 0 else 0,
+                "classroomId": event["group"]["@id"],
+                "assessmentId": event["object"]["extensions"]["assessmentId"],
+                "assessmentType": event["object"]["extensions"]["assessmentType"]
+            },
+            "learnositySessionId": event["object"]["@id"],
+            "learnosityUserId": event["group"]["extensions"]["contextId"],
+            "assessmentAttempt": event["object"]["count"] if "count" in event["object"] else 0,
+            "courseOfferingId": event["group"]["extensions"]["CourseOfferingId"],
+            "eventSubmitTime": event["eventTime"] if "eventTime" in event else None,
+            "assessmentStartTime": event["object"]["startedAtTime"] if "startedAtTime" in event["object"] else None,
+            "assessmentEndTime": event["object"]["endedAtTime"] if "endedAtTime" in event["object"] else None,
+            "questionType": question["question_type"],
+            "itemReference": question["item_reference"],
+            "error": {"code": 0, "message": ""}
+        }
+        for question in event["generated"]["itemResults"]
+    ]
+
+
+@pytest.mark.parametrize("shape", list(itertools.product((True, False), repeat=4)))
+def test_every_shape_matches_reference(shape):
+    """
+    Assert each compiled shape unwinds exactly like the dictionary walk.
+    """
+    record = outcomeEvent(items=3)
+    event = record["event"]
+    event["generated"]["itemResults"][0].update(score=None, max_score=None)
+    event["generated"]["itemResults"][1].update(score=-2, max_score=0)
+    for present, (_, container, key, _) in zip(shape, extract.OPTIONAL_FIELDS):
+        if not present:
+            del (event if container == "event" else event["object"])[key]
+
+    assert extract.shapeOf(event) == shape
+    assert unwind_array.applyModel(record) == walkRecord(record)
+
+
+def test_extractor_is_cached():
+    event = outcomeEvent()["event"]
+    assert extract.extractorFor(event) is extract.extractorFor(dict(event))
+
+
+def test_empty_item_results_skip_record_fields():
+    """
+    Assert record-level fields are not required when there is nothing to unwind.
+    """
+    record = outcomeEvent(items=0)
+    del record["event"]["group"]
+    assert unwind_array.applyModel(record) == []
+
+
+def test_missing_field_raises_key_error():
+    record = outcomeEvent(items=2)
+    del record["event"]["group"]["extensions"]["contextId"]
+    with pytest.raises(KeyError):
+        unwind_array.applyModel(record)
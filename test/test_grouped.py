@@ -0,0 +1,64 @@
+"""
+Tests for the grouped output shape and its reference expander.
+"""
+
+import json
+import pytest
+from service import config, grouped, unwind_array
+from webtest import TestApp as TApp  # Change alias so that pytest does not attempt to load this as a test case class
+from .events import outcomeEvent, batch
+
+test_app = TApp(unwind_array.bkt_app)
+
+BODY = batch(outcomeEvent(items=3), outcomeEvent(roles=("teacher",)), outcomeEvent(items=0),
+             outcomeEvent(items=2, session="attempt-2"))
+
+PROFILE = 'application/json; profile="%s"' % grouped.PROFILE
+
+
+def post(path="/bkt_service/unwind", **headers):
+    headers.setdefault("Content-Type", "application/json")
+    return test_app.post(path, BODY, headers=headers)
+
+
+def test_grouped_document():
+    flat = post().json
+    response = post("/bkt_service/unwind?shape=grouped")
+    assert response.headers["Content-Type"] == PROFILE
+    document = response.json
+    assert document["schemaVersion"] == grouped.SCHEMA_VERSION
+    assert document["columns"] == list(grouped.COLUMNS)
+    events = document["events"]
+    assert [len(group.get("rows", [])) for group in events] == [3, 0, 2]
+    assert events[1]["recordIndex"] == 1
+    assert events[0]["header"]["learnositySessionId"] == flat[0]["learnositySessionId"]
+    assert json.dumps(grouped.expand(document)) == post().text
+    assert len(response.body) < len(post().body)
+
+
+def test_accept_profile_selects_grouped():
+    response = post(Accept=PROFILE)
+    assert response.json["schemaVersion"] == grouped.SCHEMA_VERSION
+    assert "schemaVersion" not in post(Accept="application/json").text
+
+
+@pytest.mark.parametrize("stream", (False, True))
+def test_streamed_and_buffered_documents_match(monkeypatch, stream):
+    monkeypatch.setattr(config, "STREAM_RESPONSE", stream)
+    monkeypatch.setattr(config, "WRITE_CHUNK_SIZE", 64)
+    assert grouped.expand(post(Accept=PROFILE).json) == post().json
+
+
+def test_grouped_ndjson_lines():
+    response = post("/bkt_service/unwind?shape=grouped", Accept="application/x-ndjson")
+    assert response.headers["Content-Type"].startswith("application/x-ndjson; profile=")
+    lines = response.text.splitlines()
+    assert json.loads(lines[0]) == grouped.SCHEMA
+    assert len(lines) == 4
+    assert grouped.expandLines(lines) == post().json
+
+
+def test_unknown_shape_or_version():
+    test_app.post("/bkt_service/unwind?shape=columns", BODY, status=400)
+    with pytest.raises(ValueError):
+        grouped.expand({"schemaVersion": 99, "columns": [], "events": []})
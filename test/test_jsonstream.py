@@ -0,0 +1,147 @@
+"""
+Tests for incremental parsing of pipeline request bodies.
+"""
+
+import io
+import json
+import pytest
+from service import config, jsonstream, pipeline, unwind_array
+from webtest import TestApp as TApp  # Change alias so that pytest does not attempt to load this as a test case class
+from .events import outcomeEvent, batch
+
+test_app = TApp(unwind_array.bkt_app)
+
+
+def parse(text, chunkSize=3):
+    return list(jsonstream.iterArrayElements(io.BytesIO(text.encode("utf-8")), chunkSize))
+
+
+def test_elements_match_json_loads():
+    """
+    Assert every chunk size yields the same elements as json.loads.
+    """
+    text = '[ {"a": [1, 2, {"b": "c"}]}, 12345, -1.5e3, "x\\"y", null, true, [], false, "\\u00e9 long string" ]'
+    for chunkSize in (1, 2, 7, 4096):
+        assert parse(text, chunkSize) == json.loads(text)
+
+
+def test_number_split_across_chunks():
+    """
+    Assert a number at a chunk boundary is not truncated.
+    """
+    assert parse('[123456789]', 4) == [123456789]
+
+
+def test_multibyte_characters_split_across_chunks():
+    """
+    Assert UTF-8 sequences split between chunks are decoded intact.
+    """
+    assert parse('["café ✓"]', 1) == ["café ✓"]
+
+
+def test_empty_array():
+    assert parse(' [ ] ') == []
+
+
+@pytest.mark.parametrize("text", ['{"a": 1}', '[1 2]', '[1,]', '[1] 2', '[{"a": 1}'])
+def test_malformed_input(text):
+    """
+    Assert malformed or non-array documents raise ValueError.
+    """
+    with pytest.raises(ValueError):
+        parse(text)
+
+
+def test_malformed_element_fails_before_the_rest_is_read():
+    """
+    Assert a bad element near the start does not pull the whole body in.
+    """
+    stream = io.BytesIO(b'[{"a": x}, ' + b'{"a": 1}, ' * 100000 + b'{"a": 1}]')
+    with pytest.raises(ValueError):
+        list(jsonstream.iterArrayElements(stream, 1024))
+    assert stream.tell() <= 4096
+
+
+def test_streamed_request(monkeypatch):
+    """
+    Assert streaming mode unwinds the same output as the buffered mode.
+    """
+    body = batch(outcomeEvent(items=3), outcomeEvent(items=2))
+    expected = test_app.post("/bkt_service/unwind", params=body).json
+
+    monkeypatch.setattr(config, "STREAM_REQUEST", True)
+    monkeypatch.setattr(config, "READ_CHUNK_SIZE", 16)
+    response = test_app.post("/bkt_service/unwind", params=body)
+    assert response.status == '200 OK'
+    assert response.json == expected
+    assert len(response.json) == 5
+
+
+def test_streamed_request_no_data(monkeypatch):
+    monkeypatch.setattr(config, "STREAM_REQUEST", True)
+    response = test_app.post("/bkt_service/unwind", expect_errors=True)
+    assert response.status == '400 Bad Request'
+    assert "No data" in response.text
+
+
+def test_array_chunks_match_json_dumps():
+    """
+    Assert the chunked encoder reproduces json.dumps byte for byte.
+    """
+    items = [{"a": 1, "b": [1.5, None]}, "é", 3]
+    for chunkSize in (1, 10, 4096):
+        chunks = list(jsonstream.iterArrayChunks(iter(items), chunkSize))
+        assert b"".join(chunks).decode("utf-8") == json.dumps(items)
+    assert list(jsonstream.iterArrayChunks(iter([]))) == [b"[]"]
+
+
+def test_streamed_response(monkeypatch):
+    """
+    Assert streaming responses carry the same body as buffered responses.
+    """
+    body = batch(outcomeEvent(items=4), outcomeEvent(items=1))
+    expected = test_app.post("/bkt_service/unwind", params=body)
+
+    monkeypatch.setattr(config, "STREAM_RESPONSE", True)
+    monkeypatch.setattr(config, "WRITE_CHUNK_SIZE", 64)
+    response = test_app.post("/bkt_service/unwind", params=body)
+    assert response.status == '200 OK'
+    assert response.content_type == 'application/json'
+    assert response.body == expected.body
+
+
+def test_json_lines():
+    """
+    Assert blank lines are skipped and malformed lines are reported by number.
+    """
+    assert list(jsonstream.iterJsonLines(io.BytesIO(b'{"a": 1}\n\n[2]\r\n'))) == [{"a": 1}, [2]]
+    with pytest.raises(ValueError) as e:
+        list(jsonstream.iterJsonLines(io.BytesIO(b'1\n{"a"\n')))
+    assert "line 2" in str(e.value)
+
+
+def test_ndjson_request_and_response():
+    """
+    Assert NDJSON in either direction unwinds the same items as JSON arrays.
+    """
+    records = [outcomeEvent(items=2), outcomeEvent(items=3)]
+    expected = test_app.post("/bkt_service/unwind", params=batch(*records)).json
+
+    lines = "\n".join(json.dumps(r) for r in records)
+    response = test_app.post("/bkt_service/unwind", params=lines,
+                             content_type="application/x-ndjson")
+    assert response.json == expected
+
+    response = test_app.post("/bkt_service/unwind", params=lines,
+                             content_type="application/x-ndjson; charset=utf-8",
+                             headers={"Accept": "application/x-ndjson"})
+    assert response.content_type == "application/x-ndjson"
+    assert [json.loads(line) for line in response.text.splitlines()] == expected
+
+
+def test_accept_negotiation():
+    assert pipeline.acceptsNdjson("application/x-ndjson")
+    assert pipeline.acceptsNdjson("application/json;q=0.5, application/x-ndjson")
+    assert not pipeline.acceptsNdjson("application/json, application/x-ndjson;q=0.9")
+    assert not pipeline.acceptsNdjson("*/*")
+    assert not pipeline.acceptsNdjson(None)
@@ -0,0 +1,54 @@
+"""
+Tests for the queued, batched logging pipeline and the per-request log line.
+"""
+
+import logging
+import queue
+from service import config, logs, unwind_array
+from webtest import TestApp as TApp  # Change alias so that pytest does not attempt to load this as a test case class
+from .events import outcomeEvent, batch
+
+test_app = TApp(unwind_array.bkt_app)
+
+
+def record(message):
+    return logging.LogRecord("test", logging.INFO, __file__, 1, message, None, None)
+
+
+def test_full_queue_drops_and_counts():
+    handler = logs.BoundedQueueHandler(queue.Queue(1))
+    handler.handle(record("kept"))
+    handler.handle(record("dropped"))
+    assert handler.queue.qsize() == 1
+    assert handler.dropped == 1
+
+
+def test_writer_writes_batches_and_stops_cleanly(tmp_path, monkeypatch):
+    """
+    Assert queued records reach the rotating file by the time the writer stops.
+    """
+    monkeypatch.setattr(config, "LOG_FILE", str(tmp_path / "service.log"))
+    monkeypatch.setattr(config, "LOG_MAX_BYTES", 200)
+    records = queue.Queue()
+    writer = logs.BatchWriter(records, logs.fileHandler(), batchSize=3, flushInterval=0.01)
+    writer.start()
+    for n in range(10):
+        records.put(record("message %d" % n))
+    writer.stop()
+    writer.handler.close()
+
+    written = "".join(path.read_text() for path in sorted(tmp_path.iterdir()))
+    assert all("message %d" % n in written for n in range(10))
+    assert len(list(tmp_path.iterdir())) > 1
+
+
+def test_one_structured_line_per_request(caplog):
+    missing = outcomeEvent()
+    del missing["event"]["group"]
+    with caplog.at_level(logging.INFO, logger="service.pipeline"):
+        test_app.post("/bkt_service/unwind", params=batch(outcomeEvent(items=3), missing))
+
+    lines = [r.getMessage() for r in caplog.records if r.name == "service.pipeline"]
+    assert len(lines) == 1
+    assert "status=200 format=json records=2 items=4 rejected=1" in lines[0]
+    assert "bytes_in=" in lines[0] and "bytes_out=" in lines[0] and "duration_ms=" in lines[0]
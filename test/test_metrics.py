@@ -0,0 +1,61 @@
+"""
+Tests for the /metrics endpoint and the metric types behind it.
+"""
+
+from service import metrics, unwind_array
+from webtest import TestApp as TApp  # Change alias so that pytest does not attempt to load this as a test case class
+from .events import outcomeEvent, batch
+
+test_app = TApp(unwind_array.bkt_app)
+
+
+def sample(text, line):
+    """
+    Return the value of the exposed sample named by `line`, or None.
+    """
+    for exposed in text.splitlines():
+        name, _, value = exposed.rpartition(' ')
+        if name == line:
+            return float(value)
+    return None
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = metrics.Histogram('test_seconds', 'Test.', buckets=(0.1, 1))
+    for value in (0.05, 0.5, 0.5, 5):
+        histogram.observe(value)
+    text = '\n'.join(histogram.expose())
+    assert sample(text, 'test_seconds_bucket{le="0.1"}') == 1
+    assert sample(text, 'test_seconds_bucket{le="1.0"}') == 3
+    assert sample(text, 'test_seconds_bucket{le="+Inf"}') == 4
+    assert sample(text, 'test_seconds_count') == 4
+    assert sample(text, 'test_seconds_sum') == 6.05
+
+
+def test_labels_are_escaped():
+    counter = metrics.Counter('test_total', 'Test.', ('name',))
+    counter.inc(2, 'say "hi"')
+    assert counter.expose()[-1] == 'test_total{name="say \\"hi\\""} 2'
+
+
+def test_unwind_updates_metrics():
+    """
+    Assert an unwind request is counted and timed in each stage.
+    """
+    before = test_app.get('/metrics').text
+    test_app.post('/bkt_service/unwind', batch(outcomeEvent(items=3), outcomeEvent(roles=("teacher",))),
+                  headers={'Content-Type': 'application/json'})
+    response = test_app.get('/metrics')
+    assert response.content_type == 'text/plain'
+    after = response.text
+
+    def delta(line):
+        return sample(after, line) - (sample(before, line) or 0)
+
+    assert delta('bkt_unwind_requests_total{status="200"}') == 1
+    assert delta('bkt_unwind_records_total') == 2
+    assert delta('bkt_unwind_items_total') == 4
+    assert delta('bkt_unwind_rejected_total') == 1
+    for stage in ('read', 'decode', 'unwind', 'encode'):
+        assert delta('bkt_unwind_stage_seconds_count{stage="%s"}' % stage) == 1
+    assert sample(after, 'bkt_unwind_inflight_requests') == 0
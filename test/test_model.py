@@ -0,0 +1,45 @@
+"""
+Tests for per-record error isolation in the unwind model.
+"""
+
+import pytest
+from service import model, unwind_array
+from webtest import TestApp as TApp  # Change alias so that pytest does not attempt to load this as a test case class
+from .events import outcomeEvent, batch
+
+test_app = TApp(unwind_array.bkt_app)
+
+
+@pytest.mark.parametrize("roles", [["urn:lti:role:ims/lis/Instructor"], []])
+def test_non_learner_raises_internal_assertion(roles):
+    with pytest.raises(model.InternalAssertionError) as e:
+        model.applyModel(outcomeEvent(roles=roles))
+    assert e.value.code == model.LACKS_LEARNER_ROLE
+
+
+def test_bad_records_are_replaced_in_place():
+    """
+    Assert one bad event yields one error item and the batch carries on.
+    """
+    missing = outcomeEvent(items=2)
+    del missing["event"]["object"]["extensions"]["assessmentId"]
+    records = [
+        outcomeEvent(items=2),
+        outcomeEvent(roles=["urn:lti:role:ims/lis/Instructor"]),
+        missing,
+        "not an event",
+        outcomeEvent(items=1),
+    ]
+
+    response = test_app.post("/bkt_service/unwind", params=batch(*records))
+    assert response.status == '200 OK'
+
+    codes = [(item.get("recordIndex"), item["error"]["code"]) for item in response.json]
+    assert codes == [
+        (None, model.OK), (None, model.OK),
+        (1, model.LACKS_LEARNER_ROLE),
+        (2, model.MISSING_FIELD),
+        (3, model.MALFORMED_EVENT),
+        (None, model.OK),
+    ]
+    assert "assessmentId" in response.json[3]["error"]["message"]
@@ -0,0 +1,89 @@
+"""
+Tests for process-pool unwinding of large batches.
+"""
+
+import os
+import signal
+import pytest
+from service import config, model, pool, unwind_array
+from webtest import TestApp as TApp  # Change alias so that pytest does not attempt to load this as a test case class
+from .events import outcomeEvent, batch
+
+test_app = TApp(unwind_array.bkt_app)
+
+
+@pytest.fixture
+def workers(monkeypatch):
+    monkeypatch.setattr(config, "POOL_WORKERS", 2)
+    yield
+    pool.shutdown()
+
+
+def records(count):
+    return [outcomeEvent(items=n % 3 + 1, session="attempt-%d" % n) for n in range(count)]
+
+
+def test_parallel_output_keeps_record_order(workers):
+    batchRecords = records(11)
+    expected = list(model.unwindSerial(batchRecords))
+    assert list(pool.unwindParallel(iter(batchRecords), 4, 2)) == expected
+
+
+def test_small_batches_stay_inline(workers):
+    assert list(pool.unwindParallel(records(3), 4, 2)) == list(model.unwindSerial(records(3)))
+    assert pool._executor is None
+
+
+def test_worker_errors_keep_record_index(workers):
+    """
+    Assert records rejected in a worker report their index in the whole batch.
+    """
+    batchRecords = records(6)
+    del batchRecords[4]["event"]["group"]
+    result = list(pool.unwindParallel(batchRecords, 2, 2))
+    assert result == list(model.unwindSerial(batchRecords))
+    errors = [item for item in result if isinstance(item, dict)]
+    assert [item["recordIndex"] for item in errors] == [4]
+
+
+def test_endpoint_uses_pool(workers, monkeypatch):
+    """
+    Assert pooled requests return the same body as inline requests.
+    """
+    body = batch(*records(9))
+    monkeypatch.setattr(config, "POOL_WORKERS", 0)
+    expected = test_app.post("/bkt_service/unwind", params=body)
+
+    monkeypatch.setattr(config, "POOL_WORKERS", 2)
+    monkeypatch.setattr(config, "POOL_THRESHOLD", 5)
+    monkeypatch.setattr(config, "POOL_SHARD_SIZE", 2)
+    response = test_app.post("/bkt_service/unwind", params=body)
+    assert response.body == expected.body
+    assert pool._executor is not None
+
+
+def killWorker():
+    process = next(iter(pool._executor._processes.values()))
+    os.kill(process.pid, signal.SIGKILL)
+    process.join()
+
+
+def test_killed_worker_is_replaced(workers):
+    """
+    Assert a pool broken by a dead worker is replaced, not failed forever.
+    """
+    batchRecords = records(11)
+    expected = list(model.unwindSerial(batchRecords))
+    assert list(pool.unwindParallel(batchRecords, 4, 2)) == expected
+    killWorker()
+    for _ in range(3):
+        assert list(pool.unwindParallel(batchRecords, 4, 2)) == expected
+
+
+def test_shards_in_flight_survive_a_killed_worker(workers):
+    batchRecords = records(11)
+    expected = list(model.unwindSerial(batchRecords))
+    items = pool.unwindParallel(batchRecords, 4, 2)
+    first = next(items)
+    killWorker()
+    assert [first] + list(items) == expected
@@ -0,0 +1,95 @@
+"""
+Tests for on-demand profiling through the /admin/profile routes.
+"""
+
+import os
+import pstats
+import threading
+import time
+from service import config, profiling, unwind_array
+from webtest import TestApp as TApp  # Change alias so that pytest does not attempt to load this as a test case class
+from .events import outcomeEvent, batch
+
+test_app = TApp(unwind_array.bkt_app)
+
+TOKEN = {"X-Admin-Token": "secret"}
+
+
+def setup(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, "ADMIN_TOKEN", "secret")
+    monkeypatch.setattr(config, "PROFILE_DIR", str(tmp_path))
+
+
+def test_admin_routes_need_a_token(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, "ADMIN_TOKEN", "")
+    test_app.get("/admin/profile", headers=TOKEN, status=404)
+    setup(monkeypatch, tmp_path)
+    test_app.get("/admin/profile", status=403)
+    test_app.get("/admin/profile", headers={"X-Admin-Token": "guess"}, status=403)
+    assert test_app.get("/admin/profile", headers=TOKEN).json["pid"] == os.getpid()
+
+
+def test_profiles_next_requests(monkeypatch, tmp_path):
+    """
+    Assert only the armed number of requests are profiled, one pstats file each.
+    """
+    setup(monkeypatch, tmp_path)
+    test_app.post("/admin/profile?mode=cprofile&requests=2", headers=TOKEN)
+    for _ in range(3):
+        test_app.post("/bkt_service/unwind", batch(outcomeEvent(items=2)),
+                      headers={"Content-Type": "application/json"})
+
+    status = test_app.get("/admin/profile", headers=TOKEN).json
+    assert status["requests"] == 0
+    assert len(status["files"]) == 2
+    stats = pstats.Stats(*[str(tmp_path / name) for name in status["files"]])
+    assert any(name == "unwindRecord" for _, _, name in stats.stats)
+
+    download = test_app.get("/admin/profile/%s" % status["files"][0], headers=TOKEN)
+    assert download.body == (tmp_path / status["files"][0]).read_bytes()
+
+
+def test_profile_can_target_a_thread(monkeypatch, tmp_path):
+    setup(monkeypatch, tmp_path)
+    test_app.post("/admin/profile?requests=1&thread=elsewhere", headers=TOKEN)
+    test_app.post("/bkt_service/unwind", batch(outcomeEvent()), headers={"Content-Type": "application/json"})
+    assert test_app.get("/admin/profile", headers=TOKEN).json["requests"] == 1
+    test_app.post("/admin/profile?requests=0", headers=TOKEN)
+
+
+def test_unknown_mode_or_process(monkeypatch, tmp_path):
+    setup(monkeypatch, tmp_path)
+    test_app.post("/admin/profile?mode=perf", headers=TOKEN, status=400)
+    test_app.post("/admin/profile?pid=1", headers=TOKEN, status=400)
+
+
+def test_sampler_writes_collapsed_stacks(tmp_path):
+    stop = threading.Event()
+
+    def busy():
+        while not stop.is_set():
+            sum(range(1000))
+
+    worker = threading.Thread(target=busy, name="busy")
+    worker.start()
+    sampler = profiling.Sampler(str(tmp_path / "out.collapsed"), 0.2, 0.01, frozenset(["busy"]))
+    sampler.start()
+    sampler.join()
+    stop.set()
+    worker.join()
+
+    lines = (tmp_path / "out.collapsed").read_text().splitlines()
+    assert lines
+    assert all(line.startswith("busy;") for line in lines)
+    assert any("busy (test_profiling.py" in line for line in lines)
+    assert sum(int(line.rsplit(" ", 1)[1]) for line in lines) == sampler.samples
+
+
+def test_signal_starts_sampling(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, "PROFILE_DIR", str(tmp_path))
+    monkeypatch.setattr(config, "PROFILE_SECONDS", 0.05)
+    profiling._onSignal(None, None)
+    deadline = time.monotonic() + 5
+    while not any(name.endswith(".collapsed") for name in os.listdir(str(tmp_path))):
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
@@ -0,0 +1,172 @@
+"""
+Tests for fair scheduling of unwind work across sensors.
+"""
+
+import threading
+import time
+import pytest
+from service import codec, config, pipeline, scheduler, unwind_array
+from webtest import TestApp as TApp  # Change alias so that pytest does not attempt to load this as a test case class
+from .events import outcomeEvent, batch
+
+test_app = TApp(unwind_array.bkt_app)
+
+
+def queue(slots, key, cost, order):
+    """
+    Wait for a slot on a thread, recording when it is granted.
+    """
+    def run():
+        slots.acquire(key, cost)
+        order.append(key)
+    depth = sum(slots.depths().values())
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    while sum(slots.depths().values()) == depth:
+        time.sleep(0.001)
+    return thread
+
+
+def drain(slots, order, count):
+    for n in range(1, count + 1):
+        slots.release()
+        while len(order) < n:
+            time.sleep(0.001)
+
+
+def test_backfill_does_not_starve_other_keys():
+    slots = scheduler.Scheduler(1)
+    slots.acquire("backfill", 100)
+    order = []
+    for _ in range(3):
+        queue(slots, "backfill", 100, order)
+    queue(slots, "live", 100, order)
+    drain(slots, order, 4)
+    assert order == ["live", "backfill", "backfill", "backfill"]
+
+
+def test_weights():
+    slots = scheduler.Scheduler(1, weights=scheduler.parseWeights("live=3"))
+    slots.acquire("other", 1)
+    order = []
+    for _ in range(4):
+        queue(slots, "bulk", 100, order)
+    for _ in range(4):
+        queue(slots, "live", 100, order)
+    drain(slots, order, 8)
+    assert order == ["bulk", "live", "live", "live", "bulk", "live", "bulk", "bulk"]
+
+
+def test_keys_over_their_rate_wait_behind_the_rest():
+    slots = scheduler.Scheduler(1, rate=100)
+    slots.acquire("other", 1)
+    order = []
+    queue(slots, "bulk", 1000, order)
+    queue(slots, "bulk", 1000, order)
+    queue(slots, "live", 10, order)
+    queue(slots, "live", 10, order)
+    drain(slots, order, 4)
+    assert order == ["bulk", "live", "live", "bulk"]
+
+
+def test_wait_timeout():
+    slots = scheduler.Scheduler(1, waitTimeout=0.01)
+    slots.acquire("a", 1)
+    with pytest.raises(scheduler.WaitTimeout):
+        slots.acquire("b", 1)
+    assert slots.depths() == {}
+    slots.release()
+    assert slots.acquire("b", 1) == 0.0
+
+
+def test_idle_buckets_are_dropped(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(scheduler.time, "monotonic", lambda: now[0])
+    slots = scheduler.Scheduler(10, rate=100, burst=200)
+    for n in range(5):
+        slots.acquire("sensor-%d" % n, 50)
+        slots.release()
+    slots.acquire("bulk", 1000)
+    slots.release()
+    assert len(slots.buckets) == 6
+    now[0] += 3
+    slots.acquire("live", 10)
+    slots.release()
+    # Only the bucket still in debt is kept
+    assert sorted(slots.buckets) == ["bulk", "live"]
+    now[0] += 10
+    slots.acquire("live", 10)
+    slots.release()
+    assert sorted(slots.buckets) == ["live"]
+
+
+def test_metric_keys_are_capped():
+    slots = scheduler.Scheduler(10, weights={"capped-live": 2}, metricKeys=2)
+    for key in ["capped-1", "capped-2", "capped-3", "capped-4", "capped-live", "capped-1"]:
+        slots.acquire(key, 10)
+        slots.release()
+    body = test_app.get("/metrics").body
+    for label in [b"capped-1", b"capped-2", b"other", b"capped-live"]:
+        assert b'bkt_unwind_scheduler_wait_seconds_count{key="%s"}' % label in body
+    assert b'key="capped-3"' not in body
+    assert b'key="capped-4"' not in body
+
+
+@pytest.fixture
+def slots(monkeypatch):
+    monkeypatch.setattr(config, "SCHEDULER_SLOTS", 1)
+    monkeypatch.setattr(scheduler, "_scheduler", None)
+    return scheduler.getScheduler()
+
+
+def test_unwind_is_scheduled_by_sensor(slots):
+    response = test_app.post("/bkt_service/unwind", batch(outcomeEvent(sensorId="sensor-7")),
+                             headers={"Content-Type": "application/json"})
+    assert len(response.json) == 1
+    assert slots.busy == 0
+    assert b'bkt_unwind_scheduler_wait_seconds_count{key="sensor-7"} 1' in test_app.get("/metrics").body
+
+
+def test_streamed_response_holds_its_slot(slots, monkeypatch):
+    monkeypatch.setattr(config, "STREAM_RESPONSE", True)
+    test_app.post("/bkt_service/unwind", batch(outcomeEvent()), headers={"Content-Type": "application/json"})
+    assert slots.busy == 0
+
+
+def test_shed_when_no_slot_frees_up(slots):
+    slots.waitTimeout = 0.01
+    slots.acquire("other", 1)
+    try:
+        response = test_app.post("/bkt_service/unwind", batch(outcomeEvent()),
+                                 headers={"Content-Type": "application/json"}, status=429)
+    finally:
+        slots.release()
+    assert response.headers["Retry-After"] == "%d" % config.RETRY_AFTER
+
+
+@pytest.mark.parametrize("contentType", ["application/json", "application/x-ndjson"])
+def test_slot_is_taken_before_the_body_is_decoded(slots, monkeypatch, contentType):
+    decoded = []
+    loads = codec.loads
+    monkeypatch.setattr(pipeline.codec, "loads", lambda data: decoded.append(len(data)) or loads(data))
+    acquire = slots.acquire
+
+    def check(key, cost):
+        # Only the first record may have been decoded to find the key
+        assert key == "sensor-7"
+        assert sum(decoded) < cost / 2
+        return acquire(key, cost)
+
+    monkeypatch.setattr(slots, "acquire", check)
+    records = [outcomeEvent(items=5, sensorId="sensor-7") for _ in range(4)]
+    if contentType == "application/json":
+        body = batch(*records)
+    else:
+        body = "\n".join(batch(record)[1:-1] for record in records)
+    response = test_app.post("/bkt_service/unwind", body, headers={"Content-Type": contentType})
+    assert len(response.json) == 20
+
+
+def test_slot_is_released_when_the_body_is_malformed(slots):
+    test_app.post("/bkt_service/unwind", "[{", headers={"Content-Type": "application/json"}, expect_errors=True)
+    assert slots.busy == 0
@@ -0,0 +1,133 @@
+"""
+Tests for the production server helpers.
+"""
+
+import http.client
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from service import server
+
+# A server process whose one route answers slowly, logging to stderr
+SLOW_SERVER = """
+import logging, sys, time
+logging.basicConfig(stream=sys.stderr)
+from service import config, server
+BODY = b"x" * 100000
+def app(environ, start_response):
+    time.sleep(0.5)
+    start_response("200 OK", [("Content-Type", "text/plain"), ("Content-Length", str(len(BODY)))])
+    return [BODY]
+config.HOST = "127.0.0.1"
+config.PORT = int(sys.argv[1])
+server.serveWaitress(app)
+"""
+
+
+def test_inflight_tracker_counts_until_close():
+    """
+    Assert a request stays in flight until its response iterable is closed.
+    """
+    def app(environ, start_response):
+        start_response('200 OK', [])
+        return iter([b'a', b'b'])
+
+    tracker = server.InflightTracker(app)
+    result = tracker({}, lambda status, headers, exc_info=None: None)
+    assert tracker.count == 1
+    assert not tracker.wait(0.01)
+    assert list(result) == [b'a', b'b']
+    result.close()
+    result.close()
+    assert tracker.count == 0
+    assert tracker.wait(0.01)
+
+
+def test_inflight_tracker_releases_on_error():
+    def app(environ, start_response):
+        raise RuntimeError()
+
+    tracker = server.InflightTracker(app)
+    try:
+        tracker({}, None)
+    except RuntimeError:
+        pass
+    assert tracker.count == 0
+
+
+def test_inflight_tracker_retires_after_max_requests(monkeypatch):
+    """
+    Assert the process signals itself once when its request budget is spent.
+    """
+    signals = []
+    monkeypatch.setattr(server.os, "kill", lambda pid, signum: signals.append(signum))
+
+    def app(environ, start_response):
+        return [b'']
+
+    tracker = server.InflightTracker(app, maxRequests=2)
+    for _ in range(4):
+        tracker({}, None).close()
+    assert signals == [server.signal.SIGTERM]
+
+
+def test_inflight_tracker_retires_over_memory_ceiling(monkeypatch):
+    signals = []
+    monkeypatch.setattr(server.os, "kill", lambda pid, signum: signals.append(signum))
+    tracker = server.InflightTracker(lambda environ, start_response: [b''], maxRss=1)
+    tracker({}, None).close()
+    assert signals == [server.signal.SIGTERM]
+    assert server.currentRss() > 1
+
+
+def freePort():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def test_sigterm_drains_in_flight_requests():
+    """
+    Assert a request in flight at SIGTERM gets its whole response, and the
+    shutdown logs no errors.
+    """
+    port = freePort()
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    process = subprocess.Popen([sys.executable, "-c", SLOW_SERVER, str(port)], cwd=root,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    try:
+        deadline = time.time() + 30
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", port), 0.1).close()
+                break
+            except OSError:
+                assert time.time() < deadline and process.poll() is None
+                time.sleep(0.05)
+
+        result = {}
+
+        def fetch():
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+            connection.request("GET", "/")
+            response = connection.getresponse()
+            result["status"], result["body"] = response.status, response.read()
+
+        client = threading.Thread(target=fetch)
+        client.start()
+        time.sleep(0.2)
+        process.send_signal(server.signal.SIGTERM)
+        client.join(10)
+        process.wait(15)
+    finally:
+        if process.poll() is None:
+            process.kill()
+        errors = process.stderr.read().decode()
+        process.stderr.close()
+
+    assert result["status"] == 200
+    assert len(result["body"]) == 100000
+    assert "Exception" not in errors and "Bad file descriptor" not in errors, errors